@@ -0,0 +1,216 @@
+# ============================================
+# BENCHMARK ARCHIVIO HOT / COLD
+# ============================================
+# Genera anni di appuntamenti per alcuni medici (la maggior parte chiusi),
+# misura le liste prima e dopo l'archiviazione su S3 (vedi archive.py):
+#
+#   medico /my       GET /api/appointments/my di un medico
+#   paziente /my     GET /api/appointments/my del paziente con più visite
+#   dashboard        GET /api/dashboard del medico (conteggi su tutti gli appuntamenti)
+#
+# Per ogni lista riporta tempo (mediana di --repeat), chiamate alla tabella,
+# item letti (ScannedCount) e dimensione della risposta. Poi sfoglia lo
+# storico /api/appointments/my/archive e verifica che tabella + archivio
+# contengano esattamente gli appuntamenti generati, senza lock di slot
+# residui per gli appuntamenti archiviati.
+#
+# Gira senza AWS: tabella SQLite temporanea, S3 simulato da moto.
+# --delay simula la latenza di rete di ogni chiamata alla tabella.
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.bench_archive --doctors 5 --days 730 --per-day 12 --delay 0.005
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench_archive.db"))
+os.environ.setdefault("NOTIFICATIONS_BACKEND", "fake")
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+os.environ.setdefault("AWS_REGION", "us-east-2")
+os.environ.setdefault("S3_BUCKET_NAME", "clinica-bench-archive")
+
+from moto import mock_aws
+
+# Il mock deve essere attivo prima che src.main crei i client boto3
+aws_mock = mock_aws()
+aws_mock.start()
+
+import boto3
+import httpx
+from boto3.dynamodb.conditions import Attr
+
+from src import archive, main
+from src.availability import slot_label
+from src.booking import HOLDING_STATUSES, appointment_lock_key
+from src.indexes import with_index_keys
+from bench.bench_bulk import CountingTable, user
+
+
+class ReadCountingTable(CountingTable):
+    """CountingTable che somma anche gli item letti (ScannedCount) da query e scan."""
+
+    def __init__(self, inner, delay: float):
+        super().__init__(inner, delay)
+        self.scanned = 0
+
+    def __getattr__(self, op):
+        call = super().__getattr__(op)
+        if op not in ('query', 'scan'):
+            return call
+
+        def counted(*args, **kwargs):
+            response = call(*args, **kwargs)
+            self.scanned += response.get('ScannedCount', response.get('Count', 0))
+            return response
+        return counted
+
+
+def seed(args) -> tuple:
+    rng = random.Random(7)
+    doctors = [user('doctor', i) for i in range(args.doctors)]
+    patients = [user('patient', i) for i in range(args.patients)]
+    today = date.today()
+    first_day = today - timedelta(days=args.days)
+    slots = [slot_label(18 + i) for i in range(args.per_day)]
+    seeded = []
+    with main.table.batch_writer() as batch:
+        for d in range(args.days + args.future_days):
+            day = first_day + timedelta(days=d)
+            for doctor in doctors:
+                for slot in slots:
+                    if day < today:
+                        status = rng.choices(['completed', 'cancelled', 'rejected', 'confirmed'], [80, 9, 9, 2])[0]
+                    else:
+                        status = rng.choice(['pending', 'confirmed'])
+                    patient = rng.choice(patients)
+                    appointment_id = str(uuid.uuid4())
+                    appt = with_index_keys({
+                        'PK': f"APPT#{appointment_id}", 'SK': 'APPT', 'appointment_id': appointment_id,
+                        'patient_id': patient['user_id'], 'doctor_id': doctor['user_id'],
+                        'patient_name': f"Patient {patient['surname']}", 'doctor_name': f"Dr. {doctor['surname']}",
+                        'date': day.isoformat(), 'time_slot': slot, 'status': status,
+                        'reason': 'Controllo periodico', 'created_at': f"{day.isoformat()}T08:00:00",
+                    })
+                    batch.put_item(Item=appt)
+                    if status in HOLDING_STATUSES:
+                        batch.put_item(Item={**appointment_lock_key(appt), 'appointment_ref': appointment_id})
+                    seeded.append(appt)
+    boto3.client('s3', region_name=main.AWS_REGION).create_bucket(
+        Bucket=main.S3_BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': main.AWS_REGION}
+    )
+    busiest = max(patients, key=lambda p: sum(1 for a in seeded if a['patient_id'] == p['user_id']))
+    return doctors[0], busiest, seeded
+
+
+async def measure(client, table: ReadCountingTable, path: str, who: dict, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        table.calls.clear()
+        table.scanned = 0
+        start = time.perf_counter()
+        res = await client.get(path, headers={'Authorization': who['token']})
+        timings.append(time.perf_counter() - start)
+        assert res.status_code == 200, res.text
+    return {'ms': statistics.median(timings) * 1000, 'calls': sum(table.calls.values()),
+            'scanned': table.scanned, 'kb': len(res.content) / 1024, 'data': res.json()}
+
+
+def report(label: str, before: dict, after: dict):
+    print(f"  {label:<14} prima {before['ms']:8.1f} ms {before['calls']:3d} chiamate {before['scanned']:6d} item "
+          f"{before['kb']:8.1f} KB   dopo {after['ms']:7.1f} ms {after['calls']:3d} chiamate "
+          f"{after['scanned']:5d} item {after['kb']:7.1f} KB   ({before['ms'] / after['ms']:.1f}x)")
+
+
+async def history(client, who: dict, limit: int) -> tuple:
+    items, pages, cursor = [], 0, None
+    start = time.perf_counter()
+    while True:
+        params = {'limit': limit, **({'cursor': cursor} if cursor else {})}
+        res = await client.get("/api/appointments/my/archive", headers={'Authorization': who['token']}, params=params)
+        assert res.status_code == 200, res.text
+        assert len(res.json()['items']) <= limit, len(res.json()['items'])
+        pages += 1
+        items.extend(res.json()['items'])
+        cursor = res.json()['next_cursor']
+        if not cursor:
+            return items, pages, time.perf_counter() - start
+
+
+async def run(args) -> int:
+    start = time.perf_counter()
+    doctor, patient, seeded = seed(args)
+    print(f"Generati {len(seeded)} appuntamenti ({args.doctors} medici, {args.days} giorni) "
+          f"in {time.perf_counter() - start:.1f} s")
+    inner = main.table
+    table = main.table = ReadCountingTable(inner, args.delay)
+    transport = httpx.ASGITransport(app=main.app)
+    lists = [("medico /my", "/api/appointments/my", doctor), ("paziente /my", "/api/appointments/my", patient),
+             ("dashboard", "/api/dashboard", doctor)]
+    ok = True
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        before = [await measure(client, table, path, who, args.repeat) for _, path, who in lists]
+
+        cutoff = archive.cutoff_day(args.archive_after)
+        start = time.perf_counter()
+        summary = await archive.run_archive(inner, main.s3_client, main.S3_BUCKET_NAME, cutoff, segments=4)
+        elapsed = time.perf_counter() - start
+        print(f"Archiviati {summary['appointments']} appuntamenti chiusi prima del {cutoff} in {elapsed:.1f} s: "
+              f"{len(summary['segments'])} segmenti, {summary['bytes'] / 1024:.0f} KB gzip, "
+              f"conflitti {summary['conflicts']}")
+
+        after = [await measure(client, table, path, who, args.repeat) for _, path, who in lists]
+        print(f"Liste (latenza tabella {args.delay * 1000:.0f} ms per chiamata):")
+        for (label, _, _), b, a in zip(lists, before, after):
+            report(label, b, a)
+
+        # Tabella + archivio = appuntamenti generati (le liste escludono i cancellati)
+        archived = {a['appointment_id'] for a in seeded
+                    if a['date'] < cutoff and a['status'] in archive.CLOSED_STATUSES}
+        ok &= summary['appointments'] == len(archived) and summary['conflicts'] == 0
+        for label, who, owner, result in (("medico", doctor, 'doctor_id', after[0]),
+                                          ("paziente", patient, 'patient_id', after[1])):
+            mine = [a for a in seeded if a[owner] == who['user_id'] and a['status'] != 'cancelled']
+            items, pages, took = await history(client, who, args.page_size)
+            hot_ids = [a['appointment_id'] for a in result['data']]
+            ok &= sorted(hot_ids) == sorted(a['appointment_id'] for a in mine if a['appointment_id'] not in archived)
+            ok &= sorted(a['appointment_id'] for a in items) == sorted(a['appointment_id'] for a in mine
+                                                                       if a['appointment_id'] in archived)
+            ok &= [a['index_sk'] for a in items] == sorted((a['index_sk'] for a in items), reverse=True)
+            print(f"  storico {label:<9} {len(items):6d} appuntamenti in {pages} pagine da {args.page_size}, "
+                  f"{took * 1000 / pages:.1f} ms per pagina")
+
+        # IN () non è un'espressione valida: niente da verificare se nessun appuntamento è archiviato
+        leftover = inner.scan(FilterExpression=Attr('PK').begins_with("LOCK#") & Attr('appointment_ref').is_in(
+            sorted(archived)[:100]))['Items'] if archived else []
+        ok &= not leftover
+        again = await archive.run_archive(inner, main.s3_client, main.S3_BUCKET_NAME, cutoff, dry_run=True)
+        ok &= again['appointments'] == 0
+    main.table = inner
+
+    print("OK" if ok else "FALLITO: tabella e archivio non coincidono con i dati generati")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark archivio hot/cold degli appuntamenti")
+    parser.add_argument("--doctors", type=int, default=5)
+    parser.add_argument("--patients", type=int, default=300)
+    parser.add_argument("--days", type=int, default=730, help="giorni di storico generati")
+    parser.add_argument("--future-days", type=int, default=30)
+    parser.add_argument("--per-day", type=int, default=12, help="appuntamenti per medico al giorno")
+    parser.add_argument("--archive-after", type=int, default=archive.ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.005, help="latenza simulata per chiamata alla tabella (s)")
+    parser.add_argument("--repeat", type=int, default=3)
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,168 @@
+# ============================================
+# STRESS TEST PRENOTAZIONE ATOMICA
+# ============================================
+# Molti pazienti prenotano in parallelo gli stessi slot: per ogni slot deve
+# riuscire esattamente una richiesta (200) e tutte le altre ricevere
+# "Slot occupato" (400). Misura anche le prenotazioni riuscite al secondo.
+#
+# Le transazioni condizionali girano su tre backend (--backend):
+#
+#   sqlite   tabella SQLite temporanea (default, nessun servizio esterno)
+#   moto     DynamoDB simulato da moto in memoria
+#   local    DynamoDB Local (DYNAMODB_ENDPOINT_URL, default localhost:8000):
+#              docker run -p 8000:8000 amazon/dynamodb-local
+#
+# Il backend di moto non è thread-safe: con --backend moto le chiamate alla
+# tabella sono serializzate (le richieste restano concorrenti tra una
+# chiamata e l'altra, le transazioni condizionali sono quelle reali).
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.bench_booking --slots 10 --contenders 20
+#   python -m bench.bench_booking --backend local
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BACKENDS = ('sqlite', 'moto', 'local')
+
+# Il backend va scelto prima dell'import di src.main, che apre la tabella
+_pre = argparse.ArgumentParser(add_help=False)
+_pre.add_argument("--backend", choices=BACKENDS, default="sqlite")
+BACKEND = _pre.parse_known_args()[0].backend
+
+os.environ.setdefault("NOTIFICATIONS_BACKEND", "fake")
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+if BACKEND == "sqlite":
+    os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+    os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench_booking.db"))
+else:
+    os.environ.setdefault("DYNAMODB_TABLE", f"BenchBooking-{uuid.uuid4().hex[:8]}")
+    if BACKEND == "local":
+        os.environ.setdefault("DYNAMODB_ENDPOINT_URL", "http://localhost:8000")
+    else:
+        from moto import mock_aws
+
+        # Il mock deve essere attivo prima che src.main crei i client boto3
+        aws_mock = mock_aws()
+        aws_mock.start()
+
+import boto3
+import httpx
+
+from src import main
+from src.auth import create_access_token
+from src.indexes import table_definition
+
+DATE = "2030-01-07"
+
+
+class SerializedTable:
+    """Proxy della Table che esegue una chiamata alla volta (moto)."""
+
+    def __init__(self, inner):
+        self._inner = inner
+        self._lock = threading.Lock()
+        self.name = inner.name
+
+    def __getattr__(self, op):
+        fn = getattr(self._inner, op)
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return fn(*args, **kwargs)
+        call.__name__ = op
+        return call
+
+
+def create_table():
+    """Client DynamoDB della tabella creata per il benchmark (None con SQLite)."""
+    if BACKEND == "sqlite":
+        return None
+    client = boto3.client('dynamodb', region_name=main.AWS_REGION, endpoint_url=os.getenv("DYNAMODB_ENDPOINT_URL"))
+    client.create_table(**table_definition(main.table.name))
+    client.get_waiter('table_exists').wait(TableName=main.table.name)
+    return client
+
+
+def seed_doctor() -> dict:
+    doctor = {
+        'PK': 'USER#bench-doctor', 'SK': 'PROFILE', 'user_id': 'bench-doctor', 'email': 'doc@bench.it',
+        'role': 'doctor', 'name': 'Bench', 'surname': 'Doctor', 'phone': '0', 'specialization': 'Cardiologia',
+    }
+    main.table.put_item(Item=doctor)
+    return doctor
+
+
+def patient_token(i: int) -> str:
+    user = {
+        'user_id': f"bench-patient-{i}", 'email': f"p{i}@bench.it", 'role': 'patient',
+        'name': 'Paziente', 'surname': str(i), 'phone': '0', 'token_version': 0,
+    }
+    main.table.put_item(Item={'PK': f"USER#{user['user_id']}", 'SK': 'PROFILE', **user})
+    return create_access_token(user)
+
+
+async def run(args) -> int:
+    client = create_table()
+    if BACKEND == "moto":
+        main.table = SerializedTable(main.table)
+    try:
+        seed_doctor()
+        tokens = [patient_token(i) for i in range(args.contenders)]
+        slots = [f"{9 + i // 2:02d}:{'30' if i % 2 else '00'}" for i in range(args.slots)]
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as http:
+            async def book(slot: str, token: str):
+                return slot, await http.post("/api/appointments", json={
+                    'doctor_id': 'bench-doctor', 'date': DATE, 'time_slot': slot, 'reason': 'stress test',
+                }, headers={'Authorization': f"Bearer {token}"})
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*[book(slot, token) for slot in slots for token in tokens])
+            elapsed = time.perf_counter() - start
+
+        winners = {slot: 0 for slot in slots}
+        unexpected = []
+        for slot, r in results:
+            if r.status_code == 200:
+                winners[slot] += 1
+            elif r.status_code != 400 or r.json().get('detail') != "Slot occupato":
+                unexpected.append((slot, r.status_code, r.text))
+
+        report = {
+            'requests': len(results),
+            'slots': len(slots),
+            'booked': sum(winners.values()),
+            'elapsed_s': round(elapsed, 3),
+            'requests_per_sec': round(len(results) / elapsed, 1),
+            'bookings_per_sec': round(sum(winners.values()) / elapsed, 1),
+        }
+        print(json.dumps(report, indent=2))
+
+        double = {slot: n for slot, n in winners.items() if n != 1}
+        if double or unexpected:
+            print(f"FALLITO: slot con prenotazioni != 1: {double}; risposte inattese: {unexpected[:5]}")
+            return 1
+        print("OK: una sola prenotazione per slot")
+        return 0
+    finally:
+        if client is not None:
+            client.delete_table(TableName=main.table.name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress test prenotazioni concorrenti sullo stesso slot")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite")
+    parser.add_argument("--slots", type=int, default=10)
+    parser.add_argument("--contenders", type=int, default=20, help="pazienti che prenotano ogni slot")
+    sys.exit(asyncio.run(run(parser.parse_args())))
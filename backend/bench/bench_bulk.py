@@ -0,0 +1,162 @@
+# ============================================
+# BENCHMARK OPERAZIONI IN BLOCCO
+# ============================================
+# Confronta, sullo stesso carico, gli endpoint singoli con quelli in blocco:
+#
+#   disponibilità   N giorni con POST /api/doctors/availability uno per uno
+#                   vs un solo POST /api/doctors/availability/bulk
+#   conferme        M appuntamenti confermati uno per uno
+#                   vs un solo POST /api/appointments/status/bulk
+#
+# Per ogni variante riporta richieste HTTP, chiamate alla tabella, tempo e
+# (per le conferme) i messaggi SNS inviati dal dispatcher: con il blocco uno
+# per paziente. --delay simula la latenza di rete di ogni chiamata alla
+# tabella, come in bench_concurrency.
+#
+# Gira senza AWS: tabella SQLite temporanea (STORAGE_BACKEND=sqlite, vedi
+# storage.py) e notifiche FakeSNS.
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.bench_bulk --weeks 4 --patients 8 --appointments 40 --delay 0.005
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from datetime import date, timedelta
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench_bulk.db"))
+os.environ.setdefault("NOTIFICATIONS_BACKEND", "fake")
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+
+import httpx
+
+from src import main
+from src.auth import create_access_token
+from src.availability import slot_label
+from src.indexes import appointments_for_doctor
+
+WEEKDAY_SLOTS = [slot_label(i) for i in range(18, 36)]   # 09:00 - 17:30
+
+
+class CountingTable:
+    """Proxy della Table: conta le chiamate e aggiunge una latenza fissa a ognuna."""
+
+    def __init__(self, inner, delay: float):
+        self._inner = inner
+        self._delay = delay
+        self.name = inner.name
+        self.calls = Counter()
+
+    def __getattr__(self, op):
+        fn = getattr(self._inner, op)
+
+        def call(*args, **kwargs):
+            self.calls[op] += 1
+            time.sleep(self._delay)
+            return fn(*args, **kwargs)
+        call.__name__ = op
+        return call
+
+
+def user(role: str, i: int) -> dict:
+    user_id = str(uuid.uuid4())
+    profile = {
+        'PK': f"USER#{user_id}", 'SK': 'PROFILE', 'user_id': user_id, 'email': f"{role}{i}@clinica.it",
+        'role': role, 'name': role.title(), 'surname': str(i), 'phone': '0',
+        'specialization': 'Cardiologia' if role == 'doctor' else None,
+    }
+    main.table.put_item(Item=profile)
+    return {**profile, 'token': f"Bearer {create_access_token(profile)}"}
+
+
+async def measure(table: CountingTable, label: str, requests) -> float:
+    table.calls.clear()
+    start = time.perf_counter()
+    responses = [await r for r in requests]
+    elapsed = time.perf_counter() - start
+    assert all(r.status_code == 200 for r in responses), [(r.status_code, r.text) for r in responses]
+    print(f"  {label:<10} {len(responses):4d} richieste HTTP  {sum(table.calls.values()):5d} chiamate tabella  "
+          f"{elapsed * 1000:8.1f} ms   {dict(table.calls)}")
+    return elapsed
+
+
+async def outbox_messages(publisher) -> int:
+    """Svuota l'outbox e restituisce i messaggi SNS inviati."""
+    sent = len(publisher.sent)
+    while await main.notification_outbox.dispatch_once():
+        pass
+    return len(publisher.sent) - sent
+
+
+async def run(args) -> int:
+    inner = main.table
+    doctor, other_doctor = user('doctor', 1), user('doctor', 2)
+    patients = [user('patient', i) for i in range(args.patients)]
+    table = main.table = CountingTable(inner, args.delay)
+    publisher = main.notification_outbox.publisher
+    transport = httpx.ASGITransport(app=main.app)
+    ok = True
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # --- disponibilità ---
+        start = date.today() + timedelta(days=7 - date.today().weekday())   # prossimo lunedì
+        days = [start + timedelta(days=i) for i in range(args.weeks * 7)]
+        print(f"Disponibilità: {args.weeks} settimane, lunedì-venerdì")
+        single = await measure(table, "singole", (client.post("/api/doctors/availability", headers={'Authorization': doctor['token']},
+            json={'date': d.isoformat(), 'time_slots': WEEKDAY_SLOTS, 'is_available': True}) for d in days if d.weekday() < 5))
+        batch = await measure(table, "blocco", [client.post("/api/doctors/availability/bulk", headers={'Authorization': other_doctor['token']},
+            json={'start_date': days[0].isoformat(), 'end_date': days[-1].isoformat(), 'is_available': True,
+                  'templates': [{'weekday': w, 'time_slots': WEEKDAY_SLOTS} for w in range(5)]})])
+        print(f"  speedup {single / batch:.1f}x")
+        for d in days[:7]:
+            a = await client.get(f"/api/doctors/{doctor['user_id']}/availability", params={'date': d.isoformat()})
+            b = await client.get(f"/api/doctors/{other_doctor['user_id']}/availability", params={'date': d.isoformat()})
+            ok &= a.json()['available_slots'] == b.json()['available_slots']
+
+        # --- conferme ---
+        groups = {}
+        for variant, owner in (("singole", doctor), ("blocco", other_doctor)):
+            ids = []
+            for i in range(args.appointments):
+                patient = patients[i % len(patients)]
+                day = days[i // len(WEEKDAY_SLOTS)]
+                res = await client.post("/api/appointments", headers={'Authorization': patient['token']}, json={
+                    'doctor_id': owner['user_id'], 'date': day.isoformat(),
+                    'time_slot': WEEKDAY_SLOTS[i % len(WEEKDAY_SLOTS)], 'reason': 'Controllo'})
+                assert res.status_code == 200, res.text
+                ids.append(res.json()['appointment_id'])
+            groups[variant] = ids
+        await outbox_messages(publisher)   # richieste di prenotazione ai medici
+
+        print(f"Conferme: {args.appointments} appuntamenti di {args.patients} pazienti")
+        single = await measure(table, "singole", (client.put(f"/api/appointments/{i}/status", params={'status': 'confirmed'},
+            headers={'Authorization': doctor['token']}) for i in groups["singole"]))
+        single_messages = await outbox_messages(publisher)
+        batch = await measure(table, "blocco", [client.post("/api/appointments/status/bulk", headers={'Authorization': other_doctor['token']},
+            json={'appointment_ids': groups["blocco"], 'status': 'confirmed'})])
+        batch_messages = await outbox_messages(publisher)
+        print(f"  speedup {single / batch:.1f}x   messaggi SNS: singole {single_messages}, blocco {batch_messages}")
+        ok &= batch_messages == min(args.patients, args.appointments)
+
+        confirmed = appointments_for_doctor(inner, other_doctor['user_id'])
+        ok &= sorted(a['status'] for a in confirmed) == ['confirmed'] * args.appointments
+
+    print("OK" if ok else "FALLITO: risultati diversi tra endpoint singoli e in blocco")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark operazioni in blocco")
+    parser.add_argument("--weeks", type=int, default=4)
+    parser.add_argument("--patients", type=int, default=8)
+    parser.add_argument("--appointments", type=int, default=40)
+    parser.add_argument("--delay", type=float, default=0.005, help="latenza simulata per chiamata alla tabella (s)")
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,74 @@
+# ============================================
+# BENCHMARK CONCORRENZA CHIAMATE AWS
+# ============================================
+# Verifica che N richieste parallele con un backend lento terminino in circa
+# 1x la latenza di una singola richiesta (e non Nx): le chiamate boto3 non
+# devono bloccare l'event loop.
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.bench_concurrency --requests 20 --delay 0.2
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+
+from src import main
+from src.aws import AWS_IO_WORKERS
+
+
+class SlowTable:
+    """Table finta: ogni chiamata dorme `delay` secondi come un round trip lento."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def get_item(self, **kwargs):
+        time.sleep(self.delay)
+        return {}
+
+    def query(self, **kwargs):
+        time.sleep(self.delay)
+        return {'Items': []}
+
+
+async def timed_requests(client: httpx.AsyncClient, n: int) -> float:
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+        client.get(f"/api/doctors/doc-{i}/availability", params={'date': '2030-01-01'}) for i in range(n)
+    ])
+    elapsed = time.perf_counter() - start
+    assert all(r.status_code == 200 for r in responses), [r.status_code for r in responses]
+    return elapsed
+
+
+async def run(n: int, delay: float) -> int:
+    main.table = SlowTable(delay)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        single = await timed_requests(client, 1)
+        parallel = await timed_requests(client, n)
+
+    ratio = parallel / single
+    print(f"1 richiesta:      {single * 1000:8.1f} ms")
+    print(f"{n} richieste parallele: {parallel * 1000:8.1f} ms  ({ratio:.2f}x)")
+    if ratio > 2:
+        print("FALLITO: le chiamate AWS si serializzano")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark concorrenza chiamate AWS")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.2, help="latenza simulata per chiamata (s)")
+    args = parser.parse_args()
+    if args.requests > AWS_IO_WORKERS:
+        print(f"Nota: {args.requests} richieste > AWS_IO_WORKERS={AWS_IO_WORKERS}, attese code nel pool")
+    sys.exit(asyncio.run(run(args.requests, args.delay)))
@@ -0,0 +1,143 @@
+# ============================================
+# BENCHMARK DASHBOARD AGGREGATA
+# ============================================
+# Confronta il caricamento della dashboard del paziente e del medico:
+#
+#   separate    GET /api/users/me, /api/appointments/my, /api/reports/my
+#               una dopo l'altra, come faceva il frontend
+#   parallele   le stesse tre richieste lanciate insieme
+#   dashboard   un solo GET /api/dashboard (letture in parallelo lato server)
+#
+# Per ogni variante riporta chiamate alla tabella e tempo (mediana di
+# --repeat caricamenti). --delay simula la latenza di rete di ogni chiamata
+# alla tabella, come in bench_bulk. Verifica poi che la dashboard restituisca
+# gli stessi appuntamenti e referti degli endpoint separati.
+#
+# Gira senza AWS: tabella SQLite temporanea e notifiche FakeSNS.
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.bench_dashboard --appointments 60 --reports 20 --delay 0.01
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench_dashboard.db"))
+os.environ.setdefault("NOTIFICATIONS_BACKEND", "fake")
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+
+import httpx
+
+from src import main
+from src.indexes import with_index_keys
+from bench.bench_bulk import CountingTable, user
+
+STATUSES = ['pending', 'confirmed', 'completed', 'cancelled']
+
+
+def seed(args) -> tuple:
+    doctors = [user('doctor', i) for i in range(4)]
+    patient = user('patient', 1)
+    first_day = date.today() - timedelta(days=args.appointments // 2)
+    for i in range(args.appointments):
+        appointment_id = str(uuid.uuid4())
+        main.table.put_item(Item=with_index_keys({
+            'PK': f"APPT#{appointment_id}", 'SK': 'APPT', 'appointment_id': appointment_id,
+            'patient_id': patient['user_id'], 'doctor_id': doctors[i % len(doctors)]['user_id'],
+            'patient_name': "Patient 1", 'doctor_name': f"Dr. {i % len(doctors)}",
+            'date': (first_day + timedelta(days=i)).isoformat(), 'time_slot': '09:00',
+            'status': STATUSES[i % len(STATUSES)], 'reason': 'Controllo',
+        }))
+    for i in range(args.reports):
+        report_id = str(uuid.uuid4())
+        main.table.put_item(Item=with_index_keys({
+            'PK': f"REPORT#{report_id}", 'SK': 'METADATA', 'report_id': report_id,
+            'patient_id': patient['user_id'], 'doctor_id': doctors[i % len(doctors)]['user_id'],
+            'appointment_id': str(uuid.uuid4()), 'exam_type': 'Radiografia',
+            'exam_date': (first_day + timedelta(days=i)).isoformat(), 's3_key': f"reports/{report_id}.pdf",
+        }))
+    return patient, doctors[0]
+
+
+async def measure(table: CountingTable, label: str, load, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        table.calls.clear()
+        start = time.perf_counter()
+        responses = await load()
+        timings.append(time.perf_counter() - start)
+        assert all(r.status_code == 200 for r in responses), [(r.status_code, r.text) for r in responses]
+    elapsed = statistics.median(timings)
+    print(f"  {label:<10} {len(responses):2d} richieste HTTP  {sum(table.calls.values()):3d} chiamate tabella  "
+          f"{elapsed * 1000:8.1f} ms   {dict(table.calls)}")
+    return [r.json() for r in responses]
+
+
+async def compare(client, table: CountingTable, who: dict, args) -> bool:
+    headers = {'Authorization': who['token']}
+    paths = ["/api/users/me", "/api/appointments/my", "/api/reports/my"]
+
+    async def separate():
+        return [await client.get(p, headers=headers) for p in paths]
+
+    async def parallel():
+        return await asyncio.gather(*[client.get(p, headers=headers) for p in paths])
+
+    async def dashboard():
+        return [await client.get("/api/dashboard", headers=headers, params={'reports_limit': args.reports_limit})]
+
+    profile, appts, reports = await measure(table, "separate", separate, args.repeat)
+    await measure(table, "parallele", parallel, args.repeat)
+    data, = await measure(table, "dashboard", dashboard, args.repeat)
+
+    # Stessi dati: profilo, appuntamenti attivi, referti più recenti e conteggi
+    ok = data['profile'] == profile and 'password_hash' not in data['profile']
+    ok &= [a['appointment_id'] for a in data['appointments']] == [a['appointment_id'] for a in appts]
+    recent = sorted(reports, key=lambda r: r['index_sk'], reverse=True)[:args.reports_limit]
+    ok &= [(r['report_id'], r.get('doctor_name')) for r in data['reports']] == \
+          [(r['report_id'], r.get('doctor_name')) for r in recent]
+    ok &= data['counts']['appointments'] == len(appts) and data['counts']['reports'] == len(reports)
+
+    # Finestra di date: solo gli appuntamenti da oggi in poi, conteggi invariati
+    today = date.today().isoformat()
+    window = (await client.get("/api/dashboard", headers=headers, params={'date_from': today})).json()
+    ok &= [a['appointment_id'] for a in window['appointments']] == \
+          [a['appointment_id'] for a in appts if a['date'] >= today]
+    ok &= window['counts'] == data['counts']
+    print(f"  conteggi {data['counts']}")
+    return ok
+
+
+async def run(args) -> int:
+    patient, doctor = seed(args)
+    inner = main.table
+    table = main.table = CountingTable(inner, args.delay)
+    transport = httpx.ASGITransport(app=main.app)
+    ok = True
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for label, who in (("Paziente", patient), ("Medico", doctor)):
+            print(f"{label}: {args.appointments} appuntamenti, {args.reports} referti, latenza tabella {args.delay * 1000:.0f} ms")
+            ok &= await compare(client, table, who, args)
+    main.table = inner
+
+    print("OK" if ok else "FALLITO: la dashboard non coincide con gli endpoint separati")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dashboard aggregata")
+    parser.add_argument("--appointments", type=int, default=60)
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--reports-limit", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=0.01, help="latenza simulata per chiamata alla tabella (s)")
+    parser.add_argument("--repeat", type=int, default=5)
+    sys.exit(asyncio.run(run(parser.parse_args())))
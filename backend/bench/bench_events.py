@@ -0,0 +1,193 @@
+# ============================================
+# BENCHMARK EVENTI IN TEMPO REALE (SSE)
+# ============================================
+# Avvia il backend (uvicorn, un processo) e apre uno stream
+# /api/events/stream per ognuno di --clients pazienti più uno per il medico,
+# poi misura:
+#
+#   connessioni   tempo di apertura di tutti gli stream, memoria del server
+#                 per stream (VmRSS) e gauge clinica_events_connections
+#   latenza       dalla pubblicazione (ts dell'evento) alla ricezione nel
+#                 client per le prenotazioni (una per paziente: evento al
+#                 paziente e al medico) e per la conferma in blocco
+#   chiusura      gli stream chiusi dai client escono dal gauge
+#
+# Gira senza AWS: tabella SQLite temporanea e notifiche FakeSNS, server e
+# client sulla stessa macchina (stesso orologio per la latenza).
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.bench_events --clients 200
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+
+import httpx
+
+from bench.bench_server import PORT, command, environment, stop, wait_ready
+from src.auth import create_access_token
+from src.availability import slot_label
+from src.sqlite_table import SqliteTable
+
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+
+def seed(path: str, patients: int) -> tuple:
+    table = SqliteTable("ClinicaDB", path)
+    users = []
+    for i, role in enumerate(['doctor'] + ['patient'] * patients):
+        user_id = str(uuid.uuid4())
+        profile = {'PK': f"USER#{user_id}", 'SK': 'PROFILE', 'user_id': user_id, 'email': f"{role}{i}@clinica.it",
+                   'role': role, 'name': role.title(), 'surname': str(i), 'phone': '0',
+                   'specialization': 'Cardiologia' if role == 'doctor' else None}
+        table.put_item(Item=profile)
+        users.append({**profile, 'token': f"Bearer {create_access_token(profile)}"})
+    return users[0], users[1:]
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+
+
+async def gauge(client: httpx.AsyncClient) -> int:
+    text = (await client.get("/metrics")).text
+    for line in text.splitlines():
+        if line.startswith("clinica_events_connections "):
+            return int(float(line.split()[1]))
+    return 0
+
+
+class Listener:
+    """Uno stream SSE: registra latenza e tipo di ogni evento ricevuto."""
+
+    def __init__(self, client: httpx.AsyncClient, user: dict):
+        self.user = user
+        self.ready = asyncio.Event()
+        self.received = []          # (tipo, latenza in secondi)
+        self._client = client
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        headers = {'Authorization': self.user['token']}
+        async with self._client.stream("GET", "/api/events/stream", headers=headers) as res:
+            async for line in res.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event['type'] == 'ready':
+                    self.ready.set()
+                else:
+                    self.received.append((event['type'], time.time() - event['ts']))
+
+    def count(self, event_type: str) -> int:
+        return sum(1 for t, _ in self.received if t == event_type)
+
+    async def close(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def wait_for(condition, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+
+def latency_line(label: str, latencies: list) -> str:
+    latencies = sorted(latencies)
+    if not latencies:
+        return f"  {label:<22} nessun evento"
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+    return (f"  {label:<22} {len(latencies):5d} eventi   p50 {statistics.median(latencies) * 1000:6.1f} ms   "
+            f"p99 {p99 * 1000:6.1f} ms   max {latencies[-1] * 1000:6.1f} ms")
+
+
+async def run(args) -> int:
+    ok = True
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = environment("single", 1, data_dir)
+        doctor, patients = seed(env['SQLITE_PATH'], args.clients)
+        env['EVENTS_HEARTBEAT_SECONDS'] = "5"
+        process = subprocess.Popen(command("single"), env=env, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, start_new_session=True)
+        limits = httpx.Limits(max_connections=args.clients + 50, max_keepalive_connections=args.clients + 50)
+        try:
+            async with httpx.AsyncClient(base_url=BASE_URL, limits=limits, timeout=None) as client:
+                await wait_ready(client, process)
+                rss_before = rss_kb(process.pid)
+
+                # --- connessioni ---
+                start = time.perf_counter()
+                listeners = [Listener(client, u) for u in [doctor] + patients]
+                await asyncio.wait_for(asyncio.gather(*[l.ready.wait() for l in listeners]), timeout=60)
+                opened = time.perf_counter() - start
+                rss_after = rss_kb(process.pid)
+                connections = await gauge(client)
+                ok &= connections == len(listeners)
+                print(f"Stream aperti: {len(listeners)} in {opened * 1000:.0f} ms, gauge {connections}, "
+                      f"memoria server +{(rss_after - rss_before) / len(listeners):.1f} KB per stream")
+
+                # --- prenotazioni: un delta al paziente e uno al medico ---
+                day = date.today() + timedelta(days=30)
+                slots = [((day + timedelta(days=i // 20)).isoformat(), slot_label(18 + i % 20)) for i in range(len(patients))]
+                start = time.perf_counter()
+                responses = await asyncio.gather(*[client.post("/api/appointments", headers={'Authorization': p['token']},
+                    json={'doctor_id': doctor['user_id'], 'date': d, 'time_slot': s, 'reason': 'Controllo'})
+                    for p, (d, s) in zip(patients, slots)])
+                booked = time.perf_counter() - start
+                assert all(r.status_code == 200 for r in responses), [r.text for r in responses if r.status_code != 200][:3]
+                doctor_listener = listeners[0]
+                await wait_for(lambda: doctor_listener.count('appointment.created') == len(patients)
+                               and all(l.count('appointment.created') == 1 for l in listeners[1:]))
+                ok &= doctor_listener.count('appointment.created') == len(patients)
+                ok &= all(l.count('appointment.created') == 1 for l in listeners[1:])
+                print(f"Prenotazioni: {len(patients)} in {booked * 1000:.0f} ms")
+                print(latency_line("medico (created)", [lat for t, lat in doctor_listener.received if t == 'appointment.created']))
+                print(latency_line("pazienti (created)", [lat for l in listeners[1:] for t, lat in l.received if t == 'appointment.created']))
+
+                # --- conferma in blocco: un delta per appuntamento ---
+                ids = [r.json()['appointment_id'] for r in responses]
+                start = time.perf_counter()
+                res = await client.post("/api/appointments/status/bulk", headers={'Authorization': doctor['token']},
+                                        json={'appointment_ids': ids[:100], 'status': 'confirmed'})
+                assert res.status_code == 200, res.text
+                confirmed = len(ids[:100])
+                await wait_for(lambda: sum(l.count('appointment.updated') for l in listeners[1:]) == confirmed
+                               and doctor_listener.count('appointment.updated') == confirmed)
+                print(f"Conferma in blocco: {confirmed} appuntamenti in {(time.perf_counter() - start) * 1000:.0f} ms")
+                print(latency_line("pazienti (updated)", [lat for l in listeners[1:] for t, lat in l.received if t == 'appointment.updated']))
+                ok &= sum(l.count('appointment.updated') for l in listeners[1:]) == confirmed
+                ok &= doctor_listener.count('appointment.updated') == confirmed
+
+                # --- chiusura ---
+                await asyncio.gather(*[l.close() for l in listeners])
+                deadline = time.perf_counter() + 10
+                while (remaining := await gauge(client)) and time.perf_counter() < deadline:
+                    await asyncio.sleep(0.05)
+                ok &= remaining == 0
+                print(f"Stream aperti dopo la chiusura dei client: {remaining}")
+        finally:
+            stop(process)
+
+    print("OK" if ok else "FALLITO")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark eventi in tempo reale (SSE)")
+    parser.add_argument("--clients", type=int, default=200, help="pazienti con uno stream aperto")
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,96 @@
+# ============================================
+# BENCHMARK LOGIN: HASH INLINE vs POOL DI PROCESSI
+# ============================================
+# Misura il throughput di /api/auth/login e la latenza di /health durante
+# la raffica di login, con pbkdf2 eseguito inline (come prima) e nel pool.
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.bench_login --logins 200 --concurrency 32
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import httpx
+
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+
+from src import main
+from src.hashing import PasswordHasher, _hash
+
+PASSWORD = "password-benchmark"
+
+
+class LoginTable:
+    """Table finta con un solo utente, restituito dalla query su EmailIndex."""
+
+    def __init__(self, password_hash: str):
+        self.user = {
+            'PK': 'USER#bench', 'SK': 'PROFILE', 'user_id': 'bench', 'email': 'bench@clinica.it',
+            'password_hash': password_hash, 'role': 'patient', 'name': 'Bench', 'surname': 'Mark', 'phone': '0',
+        }
+
+    def query(self, **kwargs):
+        return {'Items': [self.user]}
+
+    def update_item(self, **kwargs):
+        return {}
+
+
+async def health_probe(client, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/health")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+async def run_mode(workers: int, logins: int, concurrency: int) -> dict:
+    main.table = LoginTable(_hash(PASSWORD))
+    main.password_hasher = PasswordHasher(workers=workers, max_pending=max(concurrency, 1))
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        # Warm-up: avvio dei processi del pool
+        await client.post("/api/auth/login", json={'email': 'bench@clinica.it', 'password': PASSWORD})
+
+        async def one_login():
+            async with semaphore:
+                r = await client.post("/api/auth/login", json={'email': 'bench@clinica.it', 'password': PASSWORD})
+                assert r.status_code == 200, r.text
+
+        stop = asyncio.Event()
+        health_latencies = []
+        probe = asyncio.create_task(health_probe(client, stop, health_latencies))
+        start = time.perf_counter()
+        await asyncio.gather(*[one_login() for _ in range(logins)])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe
+
+    main.password_hasher.shutdown()
+    health_latencies.sort()
+    return {
+        'mode': f"pool ({workers} processi)" if workers else "inline",
+        'logins_per_sec': round(logins / elapsed, 1),
+        'health_p50_ms': round(statistics.median(health_latencies) * 1000, 1) if health_latencies else None,
+        'health_max_ms': round(health_latencies[-1] * 1000, 1) if health_latencies else None,
+    }
+
+
+async def run(args):
+    results = [await run_mode(0, args.logins, args.concurrency)]
+    results.append(await run_mode(args.workers, args.logins, args.concurrency))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark login con e senza pool di hashing")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=main.password_hasher.workers)
+    asyncio.run(run(parser.parse_args()))
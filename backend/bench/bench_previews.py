@@ -0,0 +1,200 @@
+# ============================================
+# BENCHMARK ANTEPRIME DEI REFERTI
+# ============================================
+# Carica un referto PDF (pagine scansionate) tramite /api/reports/upload,
+# attende la pipeline di anteprima e confronta quanto scarica una dashboard:
+# il file intero (download) contro la sola anteprima JPEG. Verifica poi gli
+# header di cache (URL versionato immutabile, 304 con If-None-Match) e che un
+# nuovo upload per lo stesso appuntamento (stessa s3_key) rigeneri
+# l'anteprima con una nuova versione. Infine un errore S3 transitorio (il
+# referto resta pending e il job viene ritentato) e un PDF danneggiato
+# (stato failed, definitivo).
+#
+# Gira senza AWS: S3 simulato da moto, tabella SQLite temporanea.
+#
+# Uso (dalla cartella backend/):
+#   pip install -r bench/requirements.txt
+#   python -m bench.bench_previews --pages 4
+
+import argparse
+import asyncio
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ.pop("DYNAMODB_ENDPOINT_URL", None)
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench_previews.db"))
+os.environ.setdefault("NOTIFICATIONS_BACKEND", "fake")
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+os.environ.setdefault("AWS_REGION", "us-east-2")
+os.environ.setdefault("S3_BUCKET_NAME", "clinica-bench-previews")
+
+from moto import mock_aws
+
+# Il mock deve essere attivo prima che src.main crei i client boto3
+aws_mock = mock_aws()
+aws_mock.start()
+
+import boto3
+import httpx
+from botocore.exceptions import EndpointConnectionError
+from PIL import Image, ImageDraw
+
+from src import main, previews
+from src.auth import create_access_token
+
+
+def scanned_pdf(pages: int) -> bytes:
+    """PDF di pagine A4 a 150 dpi con rumore, come un referto scansionato."""
+    rng = random.Random(42)
+    images = []
+    for n in range(pages):
+        page = Image.effect_noise((1240, 1754), 24).convert('RGB')
+        draw = ImageDraw.Draw(page)
+        draw.rectangle([100, 100, 1140, 260], outline='black', width=6)
+        for y in range(340, 1650, 40):
+            draw.line([120, y, rng.randint(500, 1120), y], fill='black', width=4)
+        draw.text((120, 160), f"REFERTO - pagina {n + 1}", fill='black')
+        images.append(page)
+    out = io.BytesIO()
+    images[0].save(out, format='PDF', save_all=True, append_images=images[1:], resolution=150)
+    return out.getvalue()
+
+
+def png_report() -> bytes:
+    image = Image.new('RGB', (1600, 1200), 'white')
+    ImageDraw.Draw(image).ellipse([200, 200, 1400, 1000], outline='black', width=12)
+    out = io.BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+
+def seed() -> dict:
+    boto3.client('s3', region_name=main.AWS_REGION).create_bucket(
+        Bucket=main.S3_BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': main.AWS_REGION}
+    )
+    users = {}
+    for role in ('doctor', 'patient'):
+        user_id = str(uuid.uuid4())
+        profile = {'PK': f"USER#{user_id}", 'SK': 'PROFILE', 'user_id': user_id, 'email': f"{role}@clinica.it",
+                   'role': role, 'name': role.title(), 'surname': 'Bench', 'phone': '0'}
+        main.table.put_item(Item=profile)
+        users[role] = {**profile, 'token': f"Bearer {create_access_token(profile)}"}
+    appointment_id = str(uuid.uuid4())
+    main.table.put_item(Item={
+        'PK': f"APPT#{appointment_id}", 'SK': 'APPT', 'appointment_id': appointment_id,
+        'patient_id': users['patient']['user_id'], 'doctor_id': users['doctor']['user_id'],
+        'date': '2030-01-07', 'time_slot': '09:00', 'status': 'completed',
+    })
+    users['appointment_id'] = appointment_id
+    return users
+
+
+class FlakyS3:
+    """Client S3 le cui prime `failures` get_object falliscono come una rete assente."""
+
+    def __init__(self, inner, failures: int):
+        self._inner = inner
+        self.failures = failures
+
+    def get_object(self, **kwargs):
+        if self.failures > 0:
+            self.failures -= 1
+            raise EndpointConnectionError(endpoint_url="https://s3.us-east-2.amazonaws.com")
+        return self._inner.get_object(**kwargs)
+
+    def __getattr__(self, op):
+        return getattr(self._inner, op)
+
+
+async def wait_status(client, users: dict, timeout: float = 10) -> dict:
+    """Attende che l'ultimo referto esca da pending (i ritentativi sono fuori dalla coda)."""
+    deadline = time.perf_counter() + timeout
+    while True:
+        reports = (await client.get("/api/reports/my", headers={'Authorization': users['patient']['token']})).json()
+        if reports[0]['preview_status'] != previews.PENDING or time.perf_counter() > deadline:
+            return reports[0]
+        await asyncio.sleep(0.1)
+
+
+async def upload(client, users: dict, filename: str, body: bytes, content_type: str) -> str:
+    res = await client.post("/api/reports/upload", headers={'Authorization': users['doctor']['token']},
+                            params={'appointment_id': users['appointment_id'], 'exam_type': 'Radiografia',
+                                    'exam_date': '2030-01-07'},
+                            files={'file': (filename, body, content_type)})
+    assert res.status_code == 200, res.text
+    start = time.perf_counter()
+    await main.preview_pipeline.drain()
+    reports = (await client.get("/api/reports/my", headers={'Authorization': users['patient']['token']})).json()
+    print(f"  {filename}: {len(body) / 1024:8.1f} KB, anteprima pronta in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return reports[0]
+
+
+async def run(args) -> int:
+    users = seed()
+    main.preview_pipeline.start()
+    headers = {'Authorization': users['patient']['token']}
+    transport = httpx.ASGITransport(app=main.app)
+    ok = True
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            print(f"Referto PDF di {args.pages} pagine")
+            report = await upload(client, users, "referto.pdf", scanned_pdf(args.pages), "application/pdf")
+            ok &= report['preview_status'] == previews.READY
+            url = f"/api/reports/{report['report_id']}"
+
+            full = await client.get(f"{url}/download", headers=headers, params={'redirect': 'false'})
+            preview = await client.get(f"{url}/preview", headers=headers, params={'v': report['preview_version']})
+            ok &= preview.status_code == 200 and preview.headers['content-type'] == 'image/jpeg'
+            ok &= 'immutable' in preview.headers['cache-control']
+            ok &= Image.open(io.BytesIO(preview.content)).size == (report['preview_width'], report['preview_height'])
+            print(f"  dashboard: download {len(full.content) / 1024:.1f} KB vs anteprima "
+                  f"{len(preview.content) / 1024:.1f} KB ({len(full.content) / len(preview.content):.0f}x), "
+                  f"{report['preview_width']}x{report['preview_height']} px")
+
+            revalidated = await client.get(f"{url}/preview", headers={**headers, 'If-None-Match': preview.headers['etag']})
+            ok &= revalidated.status_code == 304
+            print(f"  rivalidazione senza versione: {revalidated.status_code}")
+
+            print("Nuovo upload per lo stesso appuntamento (stessa s3_key)")
+            updated = await upload(client, users, "referto.png", png_report(), "image/png")
+            ok &= updated['s3_key'] == report['s3_key'] and updated['preview_key'] == report['preview_key']
+            ok &= updated['preview_status'] == previews.READY
+            ok &= updated['preview_version'] != report['preview_version']
+            stale = await client.get(f"{url}/preview", headers={**headers, 'If-None-Match': preview.headers['etag']})
+            ok &= stale.status_code == 200 and 'no-cache' in stale.headers['cache-control']
+            print(f"  versione {report['preview_version']} -> {updated['preview_version']}, "
+                  f"{updated['preview_width']}x{updated['preview_height']} px")
+
+            print("Errore S3 transitorio durante la generazione")
+            flaky = FlakyS3(main.s3_client, failures=1)
+            main.preview_pipeline._s3 = flaky
+            pending = await upload(client, users, "referto.png", png_report(), "image/png")
+            retried = await wait_status(client, users)
+            main.preview_pipeline._s3 = main.s3_client
+            ok &= flaky.failures == 0 and pending['preview_status'] == previews.PENDING
+            ok &= retried['preview_status'] == previews.READY
+            print(f"  dopo l'errore: {pending['preview_status']}, dopo il ritentativo: {retried['preview_status']}")
+
+            print("PDF danneggiato")
+            broken = await upload(client, users, "referto.pdf", b"%PDF-1.4\n" + os.urandom(4096), "application/pdf")
+            ok &= broken['preview_status'] == previews.FAILED
+            print(f"  stato: {broken['preview_status']}")
+    finally:
+        await main.preview_pipeline.stop()
+
+    print("OK" if ok else "FALLITO")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark anteprime referti")
+    parser.add_argument("--pages", type=int, default=4)
+    sys.exit(asyncio.run(run(parser.parse_args())))
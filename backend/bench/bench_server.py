@@ -0,0 +1,177 @@
+# ============================================
+# BENCHMARK MODALITÀ DI AVVIO DEL SERVER
+# ============================================
+# Avvia il backend come processo separato in tre modalità e misura:
+#
+#   dev      uvicorn --reload (il vecchio CMD del Dockerfile)
+#   single   uvicorn senza reload, un processo
+#   prod     gunicorn + worker uvicorn (gunicorn.conf.py), WEB_CONCURRENCY=--workers
+#
+#   avvio        dal lancio del processo al primo 200 su /ready (mediana di --repeat lanci)
+#   throughput   richieste/s e latenza p50/p99 di un endpoint che legge la
+#                tabella, con --concurrency client per --duration secondi
+#
+# Gira senza AWS: tabella SQLite temporanea, notifiche FakeSNS. Il generatore
+# di carico gira sulla stessa macchina e consuma CPU: conta il confronto più
+# dei numeri assoluti, e con un solo core il multi-worker non può scalare
+# (il benchmark riporta i core disponibili).
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.bench_server --modes dev single prod --workers 4 --duration 10
+
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+PORT = 8765
+ENDPOINT = "/api/doctors/bench-doctor/availability?date=2030-01-07"
+
+
+def command(mode: str) -> list:
+    if mode == "prod":
+        return [sys.executable, "-m", "gunicorn", "src.main:app", "-c", "gunicorn.conf.py",
+                "--bind", f"127.0.0.1:{PORT}", "--access-logfile", "/dev/null"]
+    cmd = [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(PORT), "--no-access-log"]
+    return cmd + ["--reload"] if mode == "dev" else cmd
+
+
+def environment(mode: str, workers: int, data_dir: str) -> dict:
+    env = {
+        **os.environ,
+        'STORAGE_BACKEND': 'sqlite',
+        'SQLITE_PATH': os.path.join(data_dir, "bench_server.db"),
+        'NOTIFICATIONS_BACKEND': 'fake',
+        'JWT_SECRET_KEY': 'bench-secret',
+        'AWS_ACCESS_KEY_ID': 'bench',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'AWS_REGION': 'us-east-2',
+    }
+    # Anche uvicorn legge WEB_CONCURRENCY come numero di worker: solo per prod
+    env.pop('WEB_CONCURRENCY', None)
+    if mode == "prod":
+        env['WEB_CONCURRENCY'] = str(workers)
+        # gunicorn.conf.py rifiuta il broker in memoria con più worker; il
+        # benchmark non usa gli eventi, senza Redis l'avvio registra solo l'errore
+        if workers > 1:
+            env.setdefault('EVENTS_BACKEND', 'redis')
+    return env
+
+
+async def wait_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 60) -> dict:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server terminato con codice {process.returncode}")
+        try:
+            res = await client.get("/ready")
+            if res.status_code == 200:
+                return res.json()
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.02)
+    raise RuntimeError("server non pronto entro il timeout")
+
+
+async def load(client: httpx.AsyncClient, concurrency: int, duration: float) -> dict:
+    latencies, errors, pids = [], 0, set()
+    end = time.perf_counter() + duration
+
+    async def user():
+        nonlocal errors
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            try:
+                res = await client.get(ENDPOINT)
+                ok = res.status_code == 200
+            except httpx.TransportError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    await asyncio.gather(*[user() for _ in range(concurrency)])
+    # Worker che hanno risposto: /ready riporta il pid, una connessione nuova per richiesta
+    for _ in range(20):
+        async with httpx.AsyncClient(base_url=client.base_url) as fresh:
+            pids.add((await fresh.get("/ready")).json()['pid'])
+    latencies.sort()
+    return {
+        'rps': len(latencies) / duration,
+        'p50': statistics.median(latencies) * 1000 if latencies else 0,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+        'errors': errors,
+        'workers_seen': len(pids),
+    }
+
+
+def stop(process: subprocess.Popen):
+    """SIGTERM a tutto il gruppo (reloader / master e worker) e attesa dell'uscita di tutti."""
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait(timeout=30)
+    deadline = time.perf_counter() + 30
+    while time.perf_counter() < deadline:
+        try:
+            os.killpg(process.pid, 0)
+        except ProcessLookupError:
+            return
+        time.sleep(0.05)
+    os.killpg(process.pid, signal.SIGKILL)
+
+
+async def startup(mode: str, args, data_dir: str) -> float:
+    started = time.perf_counter()
+    process = subprocess.Popen(command(mode), env=environment(mode, args.workers, data_dir),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}") as client:
+            await wait_ready(client, process)
+            return time.perf_counter() - started
+    finally:
+        stop(process)
+
+
+async def measure(mode: str, args, data_dir: str) -> dict:
+    # Avvio: mediana di più lanci (la prima importazione scalda la cache del disco)
+    startups = [await startup(mode, args, data_dir) for _ in range(args.repeat)]
+    process = subprocess.Popen(command(mode), env=environment(mode, args.workers, data_dir),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=30) as client:
+            status = await wait_ready(client, process)
+            await load(client, args.concurrency, 1)  # riscaldamento
+            result = await load(client, args.concurrency, args.duration)
+    finally:
+        stop(process)
+    return {'mode': mode, 'startup_ms': statistics.median(startups) * 1000, 'warm_up_ms': status['startup_ms'], **result}
+
+
+async def run(args) -> int:
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    print(f"Core disponibili: {cpus}   worker prod: {args.workers}   client: {args.concurrency}   durata: {args.duration}s")
+    print(f"{'modalità':<8} {'avvio':>9} {'warm-up':>8} {'req/s':>8} {'p50':>8} {'p99':>8} {'errori':>7} {'worker':>7}")
+    with tempfile.TemporaryDirectory() as data_dir:
+        for mode in args.modes:
+            r = await measure(mode, args, data_dir)
+            print(f"{r['mode']:<8} {r['startup_ms']:7.0f}ms {r['warm_up_ms']:6}ms {r['rps']:8.0f} "
+                  f"{r['p50']:6.1f}ms {r['p99']:6.1f}ms {r['errors']:7d} {r['workers_seen']:7d}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark modalità di avvio del server")
+    parser.add_argument("--modes", nargs="+", choices=["dev", "single", "prod"], default=["dev", "single", "prod"])
+    parser.add_argument("--workers", type=int, default=max(2, os.cpu_count() or 1))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--repeat", type=int, default=3, help="lanci per la misura dell'avvio")
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,240 @@
+# ============================================
+# BENCHMARK STATISTICHE DEL MEDICO (CONTATORI)
+# ============================================
+# Genera lo storico di un medico direttamente nella tabella, ricostruisce i
+# contatori con la riconciliazione (vedi stats.py), poi esegue via API un
+# carico misto: prenotazioni concorrenti anche su giorni passati, conferme
+# singole e in blocco, rifiuti, completamenti, cancellazioni e referti.
+#
+# Verifica che i contatori aggiornati dalle scritture coincidano con quelli
+# ricalcolati dai dati sorgente (nessuna correzione da riconciliare) e
+# confronta:
+#
+#   lato client   GET /api/appointments/my + /api/reports/my e conteggio
+#   contatori     GET /api/doctors/me/stats (un get_item)
+#
+# riportando tempo (mediana di --repeat), chiamate alla tabella e byte
+# trasferiti. --delay simula la latenza di rete di ogni chiamata alla tabella.
+#
+# Gira senza AWS: tabella SQLite temporanea, S3 simulato da moto.
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.bench_stats --history 5000 --bookings 200 --delay 0.005
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench_stats.db"))
+os.environ.setdefault("NOTIFICATIONS_BACKEND", "fake")
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+os.environ.setdefault("AWS_REGION", "us-east-2")
+os.environ.setdefault("S3_BUCKET_NAME", "clinica-bench-stats")
+
+from moto import mock_aws
+
+# Il mock deve essere attivo prima che src.main crei i client boto3
+aws_mock = mock_aws()
+aws_mock.start()
+
+import boto3
+import httpx
+
+from src import main, stats
+from src.availability import slot_label
+from src.indexes import with_index_keys
+from bench.bench_bulk import CountingTable, user
+
+SLOTS = [slot_label(i) for i in range(18, 36)]
+
+
+def seed_history(doctor: dict, patients: list, count: int, rng: random.Random):
+    today = date.today()
+    with main.table.batch_writer() as batch:
+        for i in range(count):
+            day = today - timedelta(days=1 + i // len(SLOTS))
+            status = rng.choices(['completed', 'confirmed', 'cancelled', 'rejected'], [80, 8, 7, 5])[0]
+            appointment_id = str(uuid.uuid4())
+            patient = rng.choice(patients)
+            batch.put_item(Item=with_index_keys({
+                'PK': f"APPT#{appointment_id}", 'SK': 'APPT', 'appointment_id': appointment_id,
+                'patient_id': patient['user_id'], 'doctor_id': doctor['user_id'],
+                'patient_name': f"Patient {patient['surname']}", 'doctor_name': "Dr. 0",
+                'date': day.isoformat(), 'time_slot': SLOTS[i % len(SLOTS)], 'status': status,
+                'reason': 'Controllo', 'created_at': f"{day.isoformat()}T08:00:00",
+            }))
+            if status == 'completed' and i % 4 == 0:
+                report_id = str(uuid.uuid4())
+                batch.put_item(Item=with_index_keys({
+                    'PK': f"REPORT#{report_id}", 'SK': 'METADATA', 'report_id': report_id,
+                    'appointment_id': appointment_id, 'patient_id': patient['user_id'],
+                    'doctor_id': doctor['user_id'], 'exam_type': 'Visita', 'exam_date': day.isoformat(),
+                    's3_key': f"reports/{report_id}.pdf", 'upload_date': f"{day.isoformat()}T12:00:00",
+                }))
+
+
+async def live_writes(client, doctor: dict, patients: list, args, rng: random.Random) -> dict:
+    """Carico misto via API; restituisce il numero di operazioni per tipo."""
+    doc_headers = {'Authorization': doctor['token']}
+    today = date.today()
+    # Prenotazioni concorrenti: metà prima dello storico (poi completate o no-show), metà da oggi in poi
+    history_days = args.history // len(SLOTS) + 1
+    requests = []
+    for i in range(args.bookings):
+        offset = i % 14
+        day = today + timedelta(days=offset) if offset < 7 else today - timedelta(days=history_days + offset)
+        requests.append((patients[i % len(patients)], {'doctor_id': doctor['user_id'], 'date': day.isoformat(),
+                                                       'time_slot': SLOTS[(i // 14) % len(SLOTS)], 'reason': 'Controllo'}))
+    # A ondate di 14 (un appuntamento per giorno): concorrenti sul contatore del medico, non sul calendario del giorno
+    responses = []
+    for i in range(0, len(requests), 14):
+        responses += await asyncio.gather(*[client.post("/api/appointments", headers={'Authorization': p['token']}, json=body)
+                                            for p, body in requests[i:i + 14]])
+    booked = [r.json() for r in responses if r.status_code == 200]
+    assert len(booked) == len(requests), [r.text for r in responses if r.status_code != 200][:3]
+
+    past = [a for a in booked if a['date'] < today.isoformat()]
+    upcoming = [a for a in booked if a['date'] >= today.isoformat()]
+    counts = {'prenotazioni': len(booked)}
+
+    # Conferma in blocco dei prossimi, rifiuto singolo di qualcuno
+    res = await client.post("/api/appointments/status/bulk", headers=doc_headers,
+                            json={'appointment_ids': [a['appointment_id'] for a in upcoming[:80]], 'status': 'confirmed'})
+    assert res.status_code == 200, res.text
+    counts['conferme in blocco'] = res.json()['updated']
+    rejected = upcoming[80:90]
+    responses = await asyncio.gather(*[client.patch(f"/api/appointments/{a['appointment_id']}/status", headers=doc_headers,
+                                                    params={'status': 'rejected'}) for a in rejected])
+    assert all(r.status_code == 200 for r in responses)
+    counts['rifiuti'] = len(rejected)
+
+    # Passati: confermati, poi completati (con referto) o lasciati confermati (no-show)
+    for a in past:
+        res = await client.patch(f"/api/appointments/{a['appointment_id']}/status", headers=doc_headers,
+                                 params={'status': 'confirmed'})
+        assert res.status_code == 200, res.text
+    completed = [a for a in past if rng.random() < 0.75]
+    await asyncio.gather(*[client.patch(f"/api/appointments/{a['appointment_id']}/status", headers=doc_headers,
+                                        params={'status': 'completed'}) for a in completed])
+    counts['completati'] = len(completed)
+    counts['no-show'] = len(past) - len(completed)
+    for a in completed[:args.reports]:
+        res = await client.post("/api/reports/upload", headers=doc_headers,
+                                params={'appointment_id': a['appointment_id'], 'exam_type': 'Visita', 'exam_date': a['date']},
+                                files={'file': ('referto.pdf', b'%PDF-1.4 bench', 'application/pdf')})
+        assert res.status_code == 200, res.text
+    # Un secondo upload sullo stesso appuntamento sostituisce il referto: non conta
+    if completed:
+        await client.post("/api/reports/upload", headers=doc_headers,
+                          params={'appointment_id': completed[0]['appointment_id'], 'exam_type': 'Visita', 'exam_date': completed[0]['date']},
+                          files={'file': ('referto.pdf', b'%PDF-1.4 bench v2', 'application/pdf')})
+    counts['referti'] = min(len(completed), args.reports)
+
+    # Cancellazioni dai pazienti
+    cancelled = upcoming[90:100]
+    by_patient = {p['user_id']: p for p in patients}
+    await asyncio.gather(*[client.delete(f"/api/appointments/{a['appointment_id']}",
+                                         headers={'Authorization': by_patient[a['patient_id']]['token']}) for a in cancelled])
+    counts['cancellazioni'] = len(cancelled)
+    return counts
+
+
+def client_side(appointments: list, reports: list, today: str) -> dict:
+    """Gli stessi numeri contati dal client sulle liste complete."""
+    past = [a for a in appointments if a['date'] < today]
+    no_show = sum(1 for a in past if a['status'] == 'confirmed')
+    completed = sum(1 for a in past if a['status'] == 'completed')
+    return {
+        'pending': sum(1 for a in appointments if a['status'] == 'pending'),
+        'confirmed_today': sum(1 for a in appointments if a['date'] == today and a['status'] == 'confirmed'),
+        'reports_this_month': sum(1 for r in reports if r.get('upload_date', '')[:7] == today[:7]),
+        'no_show_rate': round(no_show / (no_show + completed), 4) if no_show + completed else None,
+    }
+
+
+async def measure(table: CountingTable, label: str, load, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        table.calls.clear()
+        start = time.perf_counter()
+        responses, result = await load()
+        timings.append(time.perf_counter() - start)
+    size = sum(len(r.content) for r in responses)
+    print(f"  {label:<12} {len(responses)} richieste HTTP {sum(table.calls.values()):3d} chiamate tabella "
+          f"{size / 1024:8.1f} KB {statistics.median(timings) * 1000:8.1f} ms   {result}")
+    return result
+
+
+async def run(args) -> int:
+    rng = random.Random(11)
+    doctor = user('doctor', 0)
+    patients = [user('patient', i) for i in range(args.patients)]
+    boto3.client('s3', region_name=main.AWS_REGION).create_bucket(
+        Bucket=main.S3_BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': main.AWS_REGION}
+    )
+    seed_history(doctor, patients, args.history, rng)
+    start = time.perf_counter()
+    stats.reconcile(main.table, doctor['user_id'])
+    print(f"Storico: {args.history} appuntamenti, contatori ricostruiti in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    inner = main.table
+    table = main.table = CountingTable(inner, args.delay)
+    transport = httpx.ASGITransport(app=main.app)
+    ok = True
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        counts = await live_writes(client, doctor, patients, args, rng)
+        print(f"Scritture via API in {time.perf_counter() - start:.1f} s: {counts}")
+
+        # Contatori mantenuti dalle scritture == contatori ricalcolati dai dati sorgente
+        live = inner.get_item(Key=stats.stats_key(doctor['user_id']))['Item']
+        rebuilt = stats.reconcile(inner, doctor['user_id'], dry_run=True)
+        corrections = stats.drift(live, rebuilt)
+        ok &= not corrections
+        print(f"Riconciliazione: {len(corrections)} contatori da correggere" + (f" {corrections}" if corrections else ""))
+
+        headers = {'Authorization': doctor['token']}
+        today = date.today().isoformat()
+        print(f"Lettura delle statistiche (latenza tabella {args.delay * 1000:.0f} ms per chiamata):")
+
+        async def lists():
+            responses = await asyncio.gather(client.get("/api/appointments/my", headers=headers),
+                                             client.get("/api/reports/my", headers=headers))
+            return responses, client_side(responses[0].json(), responses[1].json(), today)
+
+        async def counters():
+            res = await client.get("/api/doctors/me/stats", headers=headers)
+            assert res.status_code == 200, res.text
+            data = res.json()
+            return [res], {'pending': data['pending'], 'confirmed_today': data['day'].get('confirmed', 0),
+                           'reports_this_month': data['reports']['this_month'], 'no_show_rate': data['no_show_rate']}
+
+        expected = await measure(table, "lato client", lists, args.repeat)
+        got = await measure(table, "contatori", counters, args.repeat)
+        # /api/appointments/my esclude i cancellati: i confronti non dipendono da loro
+        ok &= got == expected
+    main.table = inner
+
+    print("OK" if ok else "FALLITO: i contatori non coincidono con i dati")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark statistiche del medico con contatori atomici")
+    parser.add_argument("--history", type=int, default=5000, help="appuntamenti passati generati")
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--bookings", type=int, default=200, help="prenotazioni via API")
+    parser.add_argument("--reports", type=int, default=30, help="referti caricati via API")
+    parser.add_argument("--delay", type=float, default=0.005, help="latenza simulata per chiamata alla tabella (s)")
+    parser.add_argument("--repeat", type=int, default=5)
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,419 @@
+# ============================================
+# LOAD TEST OFFLINE (DYNAMODB / S3 / SNS SIMULATI)
+# ============================================
+# Esegue l'app FastAPI in-process contro i servizi AWS simulati da moto,
+# quindi senza account AWS. Semina medici, pazienti, appuntamenti e referti,
+# poi N utenti virtuali eseguono un carico misto:
+#
+#   login, doctors, availability, book, list_appointments, list_reports,
+#   upload, download
+#
+# Per ogni endpoint riporta richieste, errori, throughput, latenza
+# p50/p95/p99 e unità di capacità DynamoDB (RCU/WCU) stimate dalla
+# dimensione degli item letti e scritti, con le regole di calcolo di
+# DynamoDB (4 KB per lettura, 1 KB per scrittura, metà per letture
+# eventually consistent, doppio per le transazioni).
+#
+# Con STORAGE_BACKEND=sqlite la tabella è un file SQLite temporaneo (vedi
+# storage.py) e moto simula solo S3 / SNS. Moto non è thread-safe: con la
+# tabella simulata le chiamate DynamoDB passano una alla volta (come in
+# bench_booking), quindi le latenze contano anche l'attesa del lock.
+#
+# Il risultato è JSON; con --baseline si confronta il p95 con un risultato
+# precedente e si esce con codice 1 oltre la regressione ammessa.
+#
+# Uso (dalla cartella backend/):
+#   pip install -r bench/requirements.txt
+#   python -m bench.loadtest --duration 30 --users 50 --output loadtest.json
+#   python -m bench.loadtest --baseline loadtest.json --max-regression 0.25
+#   STORAGE_BACKEND=sqlite python -m bench.loadtest --duration 30
+
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+# Configurazione letta da src.main all'import: tutto locale
+os.environ.pop("DYNAMODB_ENDPOINT_URL", None)
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "loadtest")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "loadtest")
+os.environ.setdefault("AWS_REGION", "us-east-2")
+os.environ.setdefault("DYNAMODB_TABLE", "ClinicaLoadTest")
+os.environ.setdefault("S3_BUCKET_NAME", "clinica-loadtest-reports")
+os.environ.setdefault("NOTIFICATIONS_BACKEND", "fake")
+os.environ.setdefault("JWT_SECRET_KEY", "loadtest-secret")
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "loadtest.db"))
+
+from moto import mock_aws
+
+# Il mock deve essere attivo prima che src.main crei client e resource boto3
+aws_mock = mock_aws()
+aws_mock.start()
+
+import boto3
+import httpx
+
+from src import main, storage
+from src.auth import create_access_token
+from src.booking import HOLDING_STATUSES, appointment_lock_key
+from src.hashing import _hash
+from src.indexes import table_definition, with_index_keys
+
+PASSWORD = "password-loadtest"
+SPECIALIZATIONS = ["Cardiologia", "Dermatologia", "Ortopedia", "Neurologia", "Pediatria", "Oculistica"]
+SLOTS = [f"{h:02d}:{m}" for h in range(9, 18) for m in ("00", "30")]
+
+WORKLOAD = {
+    'login': 5,
+    'doctors': 20,
+    'availability': 20,
+    'book': 10,
+    'list_appointments': 15,
+    'list_reports': 10,
+    'upload': 5,
+    'download': 15,
+}
+# Risposte attese oltre al 200 (es. slot già preso durante la prenotazione)
+EXPECTED_STATUS = {'book': {200, 400}, 'doctors': {200, 304}}
+
+
+# ============================================
+# STIMA CAPACITÀ DYNAMODB
+# ============================================
+# run_io esegue le chiamate nel contesto del chiamante: l'endpoint arriva nei thread del pool
+current_endpoint = contextvars.ContextVar('current_endpoint', default='seed')
+
+
+def value_size(value) -> int:
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode()) + value_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 3 + sum(value_size(v) for v in value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        return len(str(value)) // 2 + 2
+    if isinstance(value, bytes):
+        return len(value)
+    return len(str(value).encode())
+
+
+def item_size(item: dict) -> int:
+    return sum(len(k.encode()) + value_size(v) for k, v in (item or {}).items())
+
+
+def read_units(size: int, consistent: bool) -> float:
+    units = max(1, math.ceil(size / 4096))
+    return units if consistent else units / 2
+
+
+def write_units(size: int) -> int:
+    return max(1, math.ceil(size / 1024))
+
+
+def estimate_units(op: str, kwargs: dict, result: dict):
+    """(RCU, WCU) stimate di una chiamata DynamoDB."""
+    consistent = bool(kwargs.get('ConsistentRead'))
+    if op == 'get_item':
+        return read_units(item_size(result.get('Item')), consistent), 0
+    if op in ('query', 'scan'):
+        return read_units(sum(item_size(i) for i in result.get('Items', [])), consistent), 0
+    if op == 'put_item':
+        return 0, write_units(item_size(kwargs['Item']))
+    if op == 'update_item':
+        return 0, write_units(item_size(result.get('Attributes')))
+    if op == 'delete_item':
+        return 0, 1
+    if op == 'transact_write_items':
+        wcu = 0
+        for entry in kwargs['TransactItems']:
+            put = entry.get('Put')
+            wcu += write_units(item_size(put['Item'])) if put else 1
+        return 0, 2 * wcu
+    return 0, 0
+
+
+class CapacityMeter:
+    def __init__(self):
+        self.units = defaultdict(lambda: {'rcu': 0.0, 'wcu': 0.0})
+
+    def add(self, endpoint: str, rcu: float, wcu: float):
+        # Chiamata dai thread del pool: += su float sotto GIL, sufficiente per una stima
+        self.units[endpoint]['rcu'] += rcu
+        self.units[endpoint]['wcu'] += wcu
+
+
+class MeteredTable:
+    """Proxy della Table dell'app che attribuisce le unità all'endpoint corrente.
+
+    Con serialize=True esegue una chiamata alla volta: moto non regge chiamate
+    concorrenti da più thread ("dictionary changed size during iteration").
+    """
+
+    def __init__(self, inner, meter: CapacityMeter, serialize: bool = False):
+        self._inner = inner
+        self._meter = meter
+        self._lock = threading.Lock() if serialize else contextlib.nullcontext()
+        self.name = inner.name
+
+    def __getattr__(self, op):
+        fn = getattr(self._inner, op)
+
+        def call(*args, **kwargs):
+            with self._lock:
+                result = fn(*args, **kwargs)
+            rcu, wcu = estimate_units(op, kwargs, result if isinstance(result, dict) else {})
+            self._meter.add(current_endpoint.get(), rcu, wcu)
+            return result
+        call.__name__ = op
+        return call
+
+
+# ============================================
+# DATI DI PARTENZA
+# ============================================
+def create_resources():
+    if storage.STORAGE_BACKEND == "dynamodb":
+        boto3.client('dynamodb', region_name=main.AWS_REGION).create_table(**table_definition(main.table.name))
+    boto3.client('s3', region_name=main.AWS_REGION).create_bucket(
+        Bucket=main.S3_BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': main.AWS_REGION}
+    )
+
+
+def seed(args) -> dict:
+    rng = random.Random(args.seed)
+    password_hash = _hash(PASSWORD)
+    s3 = boto3.client('s3', region_name=main.AWS_REGION)
+    report_body = os.urandom(args.report_bytes)
+    today = date.today()
+    data = {'doctors': [], 'patients': [], 'doctor_appointments': defaultdict(list), 'reports': []}
+
+    def profile(role: str, i: int) -> dict:
+        user_id = str(uuid.uuid4())
+        return {
+            'PK': f"USER#{user_id}", 'SK': 'PROFILE', 'user_id': user_id, 'email': f"{role}{i}@clinica.it",
+            'password_hash': password_hash, 'role': role, 'name': role.title(), 'surname': str(i),
+            'phone': '0', 'specialization': SPECIALIZATIONS[i % len(SPECIALIZATIONS)] if role == 'doctor' else None,
+            'token_version': 0,
+        }
+
+    with main.table.batch_writer() as batch:
+        for i in range(args.doctors):
+            doctor = profile('doctor', i)
+            batch.put_item(Item=doctor)
+            data['doctors'].append(doctor)
+        for i in range(args.patients):
+            patient = profile('patient', i)
+            batch.put_item(Item=patient)
+            data['patients'].append(patient)
+
+            # Storico passato: appuntamenti (con lock se attivi) e referti
+            for n in range(args.appointments_per_patient):
+                doctor = rng.choice(data['doctors'])
+                day = (today - timedelta(days=rng.randint(1, 720))).isoformat()
+                appt = {
+                    'PK': f"APPT#{uuid.uuid4()}", 'SK': 'APPT', 'patient_id': patient['user_id'],
+                    'patient_name': f"Patient {i}", 'doctor_id': doctor['user_id'],
+                    'doctor_name': f"Doctor {doctor['surname']}", 'date': day, 'time_slot': rng.choice(SLOTS),
+                    'reason': 'Controllo', 'status': 'completed' if n < args.reports_per_patient else 'confirmed',
+                }
+                appt['appointment_id'] = appt['PK'][len('APPT#'):]
+                batch.put_item(Item=with_index_keys(appt))
+                if appt['status'] in HOLDING_STATUSES:
+                    batch.put_item(Item={**appointment_lock_key(appt), 'appointment_ref': appt['appointment_id']})
+                data['doctor_appointments'][doctor['user_id']].append(appt['appointment_id'])
+                if n < args.reports_per_patient:
+                    report_id = str(uuid.uuid4())
+                    s3_key = f"reports/{patient['user_id']}/{report_id}_referto.pdf"
+                    s3.put_object(Bucket=main.S3_BUCKET_NAME, Key=s3_key, Body=report_body, ContentType='application/pdf')
+                    batch.put_item(Item=with_index_keys({
+                        'PK': f"REPORT#{report_id}", 'SK': 'METADATA', 'report_id': report_id,
+                        'appointment_id': appt['appointment_id'], 'patient_id': patient['user_id'],
+                        'doctor_id': doctor['user_id'], 'exam_type': 'Visita', 'exam_date': day,
+                        's3_key': s3_key, 'original_filename': 'referto.pdf', 'notes': None,
+                        'upload_date': day, 'last_updated': day,
+                    }))
+                    data['reports'].append((patient, report_id))
+
+    for user in data['doctors'] + data['patients']:
+        user['token'] = f"Bearer {create_access_token(user)}"
+    return data
+
+
+# ============================================
+# CARICO MISTO
+# ============================================
+def build_request(op: str, data: dict, rng: random.Random) -> dict:
+    today = date.today()
+    patient = rng.choice(data['patients'])
+    doctor = rng.choice(data['doctors'])
+    if op == 'login':
+        return {'method': 'POST', 'url': '/api/auth/login', 'json': {'email': patient['email'], 'password': PASSWORD}}
+    if op == 'doctors':
+        return {'method': 'GET', 'url': '/api/doctors', 'params': {'specialization': rng.choice(SPECIALIZATIONS)}}
+    if op == 'availability':
+        day = (today + timedelta(days=rng.randint(1, 30))).isoformat()
+        return {'method': 'GET', 'url': f"/api/doctors/{doctor['user_id']}/availability", 'params': {'date': day}}
+    if op == 'book':
+        day = (today + timedelta(days=rng.randint(1, 30))).isoformat()
+        return {'method': 'POST', 'url': '/api/appointments', 'headers': {'Authorization': patient['token']},
+                'json': {'doctor_id': doctor['user_id'], 'date': day, 'time_slot': rng.choice(SLOTS), 'reason': 'Visita'}}
+    if op == 'list_appointments':
+        user = patient if rng.random() < 0.7 else doctor
+        return {'method': 'GET', 'url': '/api/appointments/my', 'headers': {'Authorization': user['token']}}
+    if op == 'list_reports':
+        return {'method': 'GET', 'url': '/api/reports/my', 'headers': {'Authorization': patient['token']}}
+    if op == 'upload':
+        while not data['doctor_appointments'][doctor['user_id']]:
+            doctor = rng.choice(data['doctors'])
+        appointment_id = rng.choice(data['doctor_appointments'][doctor['user_id']])
+        return {'method': 'POST', 'url': '/api/reports/upload', 'headers': {'Authorization': doctor['token']},
+                'params': {'appointment_id': appointment_id, 'exam_type': 'Visita', 'exam_date': today.isoformat()},
+                'files': {'file': ('referto.pdf', data['upload_body'], 'application/pdf')}}
+    if op == 'download':
+        owner, report_id = rng.choice(data['reports'])
+        return {'method': 'GET', 'url': f"/api/reports/{report_id}/download",
+                'headers': {'Authorization': owner['token']}, 'params': {'redirect': 'false'}}
+    raise ValueError(op)
+
+
+async def virtual_user(client, data: dict, rng: random.Random, deadline: float, samples: dict):
+    ops, weights = zip(*WORKLOAD.items())
+    while time.perf_counter() < deadline:
+        op = rng.choices(ops, weights)[0]
+        request = build_request(op, data, rng)
+        token = current_endpoint.set(op)
+        start = time.perf_counter()
+        try:
+            response = await client.request(**request)
+            ok = response.status_code in EXPECTED_STATUS.get(op, {200})
+        except Exception:
+            ok = False
+        finally:
+            current_endpoint.reset(token)
+        samples[op].append((time.perf_counter() - start, ok))
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: dict, elapsed: float, meter: CapacityMeter) -> dict:
+    endpoints = {}
+    for op in WORKLOAD:
+        latencies = sorted(s[0] for s in samples[op])
+        if not latencies:
+            continue
+        units = meter.units[op]
+        endpoints[op] = {
+            'requests': len(latencies),
+            'errors': sum(1 for s in samples[op] if not s[1]),
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'rcu': round(units['rcu'], 1),
+            'wcu': round(units['wcu'], 1),
+            'rcu_per_request': round(units['rcu'] / len(latencies), 2),
+            'wcu_per_request': round(units['wcu'] / len(latencies), 2),
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    return {
+        'endpoints': endpoints,
+        'totals': {
+            'requests': total,
+            'errors': sum(e['errors'] for e in endpoints.values()),
+            'throughput_rps': round(total / elapsed, 2),
+            'rcu': round(sum(e['rcu'] for e in endpoints.values()), 1),
+            'wcu': round(sum(e['wcu'] for e in endpoints.values()), 1),
+        },
+    }
+
+
+def regressions(result: dict, baseline: dict, max_regression: float) -> list:
+    found = []
+    for op, current in result['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(op)
+        if previous and previous['p95_ms'] > 0 and current['p95_ms'] > previous['p95_ms'] * (1 + max_regression):
+            found.append(f"{op}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+    return found
+
+
+async def run(args) -> dict:
+    meter = CapacityMeter()
+    create_resources()
+    seed_start = time.perf_counter()
+    data = seed(args)
+    data['upload_body'] = os.urandom(args.report_bytes)
+    seed_seconds = time.perf_counter() - seed_start
+    main.table = MeteredTable(main.table, meter, serialize=storage.STORAGE_BACKEND == "dynamodb")
+
+    samples = defaultdict(list)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120) as client:
+        # Warm-up: processi di hashing, elenco medici in memoria
+        await client.post("/api/auth/login", json={'email': data['patients'][0]['email'], 'password': PASSWORD})
+        await client.get("/api/doctors")
+
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*[
+            virtual_user(client, data, random.Random(args.seed + i), deadline, samples) for i in range(args.users)
+        ])
+        elapsed = time.perf_counter() - start
+
+    main.password_hasher.shutdown()
+    result = summarize(samples, elapsed, meter)
+    result['config'] = {
+        'duration_s': args.duration, 'users': args.users, 'doctors': args.doctors, 'patients': args.patients,
+        'appointments_per_patient': args.appointments_per_patient, 'reports_per_patient': args.reports_per_patient,
+        'report_bytes': args.report_bytes, 'seed': args.seed, 'seed_seconds': round(seed_seconds, 1),
+        'storage': storage.STORAGE_BACKEND,
+        'capacity': 'stimata dalla dimensione degli item',
+    }
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test offline del backend con AWS simulato (moto)")
+    parser.add_argument("--duration", type=float, default=30, help="secondi di carico")
+    parser.add_argument("--users", type=int, default=50, help="utenti virtuali concorrenti")
+    parser.add_argument("--doctors", type=int, default=50)
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--appointments-per-patient", type=int, default=10)
+    parser.add_argument("--reports-per-patient", type=int, default=3)
+    parser.add_argument("--report-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="file JSON dei risultati")
+    parser.add_argument("--baseline", help="risultato precedente con cui confrontare il p95")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="aumento massimo ammesso del p95")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    aws_mock.stop()
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.max_regression)
+        if found:
+            print("REGRESSIONI:\n  " + "\n  ".join(found))
+            sys.exit(1)
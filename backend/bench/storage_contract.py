@@ -0,0 +1,256 @@
+# ============================================
+# VERIFICA DI COMPORTAMENTO DEI MOTORI DI STORAGE
+# ============================================
+# Le stesse verifiche eseguite su ogni motore selezionabile con
+# STORAGE_BACKEND: SQLite (sqlite_table.py) e DynamoDB, simulato da moto
+# oppure reale / DynamoDB Local con --endpoint. Coprono le operazioni usate
+# dall'app: tipi dei valori, scritture condizionali, espressioni di update,
+# transazioni, batch write/get, query sui GSI con ordinamento e paginazione,
+# filtri e scan.
+#
+# Uso (dalla cartella backend/):
+#   python -m bench.storage_contract
+#   python -m bench.storage_contract --engines sqlite
+#   python -m bench.storage_contract --engines dynamodb --endpoint http://localhost:8000
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import traceback
+from decimal import Decimal
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "contract")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "contract")
+
+import boto3
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+
+from src import indexes
+from src.booking import cancellation_reasons
+from src.indexes import table_definition, with_index_keys
+
+REGION = "us-east-2"
+
+
+def expect_error(code: str, fn, *args, **kwargs) -> ClientError:
+    try:
+        fn(*args, **kwargs)
+    except ClientError as e:
+        assert e.response['Error']['Code'] == code, e.response['Error']
+        return e
+    raise AssertionError(f"atteso {code}")
+
+
+# ============================================
+# VERIFICHE
+# ============================================
+def check_types(table):
+    item = {
+        'PK': 'TYPES#1', 'SK': 'X', 'n': 3, 'd': Decimal('2.5'), 'b': True, 'none': None, 's': 'testo',
+        'm': {'a': 1, 'nested': {'x': 'y'}}, 'l': [1, 'due', {'tre': 3}], 'ss': {'a', 'b'}, 'ns': {1, 2},
+        'bin': b'\x00\x01',
+    }
+    table.put_item(Item=item)
+    got = table.get_item(Key={'PK': 'TYPES#1', 'SK': 'X'})['Item']
+    assert got['n'] == Decimal(3) and isinstance(got['n'], Decimal), got['n']
+    assert got['d'] == Decimal('2.5') and got['b'] is True and got['none'] is None and got['s'] == 'testo'
+    assert got['m'] == {'a': Decimal(1), 'nested': {'x': 'y'}} and got['l'] == [Decimal(1), 'due', {'tre': Decimal(3)}]
+    assert got['ss'] == {'a', 'b'} and got['ns'] == {Decimal(1), Decimal(2)} and got['bin'].value == b'\x00\x01'
+    assert 'Item' not in table.get_item(Key={'PK': 'TYPES#missing', 'SK': 'X'})
+
+
+def check_conditional_writes(table):
+    key = {'PK': 'COND#1', 'SK': 'A'}
+    table.put_item(Item={**key, 'v': 1}, ConditionExpression="attribute_not_exists(PK)")
+    expect_error('ConditionalCheckFailedException', table.put_item,
+                 Item={**key, 'v': 2}, ConditionExpression="attribute_not_exists(PK)")
+    expect_error('ConditionalCheckFailedException', table.update_item, Key=key,
+                 UpdateExpression="set v = :n", ConditionExpression="v = :old",
+                 ExpressionAttributeValues={':n': 5, ':old': 9})
+    table.update_item(Key=key, UpdateExpression="set v = :n", ConditionExpression=Attr('v').eq(1),
+                      ExpressionAttributeValues={':n': 5})
+    assert table.get_item(Key=key)['Item']['v'] == 5
+    expect_error('ConditionalCheckFailedException', table.delete_item, Key=key,
+                 ConditionExpression="attribute_not_exists(PK) OR v = :x", ExpressionAttributeValues={':x': 1})
+    table.delete_item(Key=key, ConditionExpression="attribute_exists(PK)")
+    assert 'Item' not in table.get_item(Key=key)
+    # <> su un attributo mancante è vero
+    table.put_item(Item={**key}, ConditionExpression="attribute_not_exists(PK) OR #s <> :c",
+                   ExpressionAttributeNames={'#s': 'status'}, ExpressionAttributeValues={':c': 'x'})
+    table.put_item(Item={**key}, ConditionExpression="#s <> :c",
+                   ExpressionAttributeNames={'#s': 'status'}, ExpressionAttributeValues={':c': 'x'})
+
+
+def check_update_expressions(table):
+    key = {'PK': 'UPD#1', 'SK': 'A'}
+    res = table.update_item(Key=key, UpdateExpression="set offered = :m, version = if_not_exists(version, :zero) + :one",
+                            ExpressionAttributeValues={':m': 7, ':zero': 0, ':one': 1}, ReturnValues="ALL_NEW")
+    assert res['Attributes'] == {**key, 'offered': 7, 'version': 1}, res['Attributes']
+    table.update_item(Key=key, UpdateExpression="set version = if_not_exists(version, :zero) + :one",
+                      ExpressionAttributeValues={':zero': 0, ':one': 1})
+    table.update_item(Key=key, UpdateExpression="set parts = :empty", ExpressionAttributeValues={':empty': {}})
+    table.update_item(Key=key, UpdateExpression="set parts.#n = :p",
+                      ExpressionAttributeNames={'#n': '3'}, ExpressionAttributeValues={':p': {'etag': 'e3'}})
+    res = table.update_item(Key=key, UpdateExpression="set #n = :n, #u = :u",
+                            ExpressionAttributeNames={'#n': 'notes', '#u': 'last'},
+                            ExpressionAttributeValues={':n': 'nota', ':u': 'ora'}, ReturnValues="UPDATED_NEW")
+    assert res['Attributes'] == {'notes': 'nota', 'last': 'ora'}, res['Attributes']
+    table.update_item(Key=key, UpdateExpression="ADD #c :one, tags :t",
+                      ExpressionAttributeNames={'#c': 'counter'}, ExpressionAttributeValues={':one': 1, ':t': {'a'}})
+    table.update_item(Key=key, UpdateExpression="ADD #c :two REMOVE notes",
+                      ExpressionAttributeNames={'#c': 'counter'}, ExpressionAttributeValues={':two': 2})
+    item = table.get_item(Key=key)['Item']
+    assert item['version'] == 2 and item['parts'] == {'3': {'etag': 'e3'}}, item
+    assert item['counter'] == 3 and item['tags'] == {'a'} and 'notes' not in item, item
+    expect_error('ValidationException', table.update_item, Key=key,
+                 UpdateExpression="set missing.child = :v", ExpressionAttributeValues={':v': 1})
+
+
+def check_transactions(table):
+    client_items = [
+        {'Put': {'TableName': table.name, 'Item': {'PK': 'TX#lock', 'SK': 'LOCK', 'ref': 'a'},
+                 'ConditionExpression': "attribute_not_exists(PK)"}},
+        {'Put': {'TableName': table.name, 'Item': {'PK': 'TX#appt', 'SK': 'APPT', 'n': 1}}},
+    ]
+    table.transact_write_items(TransactItems=client_items)
+    e = expect_error('TransactionCanceledException', table.transact_write_items, TransactItems=[
+        {'Put': {'TableName': table.name, 'Item': {'PK': 'TX#other', 'SK': 'APPT'}}},
+        {'Put': {'TableName': table.name, 'Item': {'PK': 'TX#lock', 'SK': 'LOCK', 'ref': 'b'},
+                 'ConditionExpression': "attribute_not_exists(PK)"}},
+    ])
+    assert cancellation_reasons(e) == ['None', 'ConditionalCheckFailed'], cancellation_reasons(e)
+    assert 'Item' not in table.get_item(Key={'PK': 'TX#other', 'SK': 'APPT'}), "transazione non atomica"
+    table.transact_write_items(TransactItems=[
+        {'Update': {'TableName': table.name, 'Key': {'PK': 'TX#appt', 'SK': 'APPT'},
+                    'UpdateExpression': "set n = :n", 'ConditionExpression': "n = :old",
+                    'ExpressionAttributeValues': {':n': 2, ':old': 1}}},
+        {'Delete': {'TableName': table.name, 'Key': {'PK': 'TX#lock', 'SK': 'LOCK'},
+                    'ConditionExpression': "attribute_not_exists(PK) OR #r = :r",
+                    'ExpressionAttributeNames': {'#r': 'ref'}, 'ExpressionAttributeValues': {':r': 'a'}}},
+    ])
+    assert table.get_item(Key={'PK': 'TX#appt', 'SK': 'APPT'})['Item']['n'] == 2
+    assert 'Item' not in table.get_item(Key={'PK': 'TX#lock', 'SK': 'LOCK'})
+
+
+def check_batches(table):
+    table.put_item(Item={'PK': 'BATCH#old', 'SK': 'X'})
+    table.batch_write_item(RequestItems={table.name: [
+        {'PutRequest': {'Item': {'PK': f"BATCH#{i}", 'SK': 'X', 'n': i, 'tags': {'a', 'b'}}}} for i in range(3)
+    ] + [{'DeleteRequest': {'Key': {'PK': 'BATCH#old', 'SK': 'X'}}}]})
+    res = table.batch_get_item(RequestItems={table.name: {'Keys': [
+        {'PK': f"BATCH#{i}", 'SK': 'X'} for i in range(4)
+    ] + [{'PK': 'BATCH#old', 'SK': 'X'}], 'ConsistentRead': True}})
+    items = sorted(res['Responses'][table.name], key=lambda item: item['PK'])
+    assert [item['n'] for item in items] == [0, 1, 2], items
+    assert items[0]['tags'] == {'a', 'b'}, items[0]
+    assert not res.get('UnprocessedKeys'), res['UnprocessedKeys']
+
+
+def check_indexes(table):
+    with table.batch_writer() as batch:
+        batch.put_item(Item={'PK': 'USER#u1', 'SK': 'PROFILE', 'user_id': 'u1', 'email': 'u1@clinica.it', 'role': 'doctor'})
+        for i, day in enumerate(['2030-01-03', '2030-01-01', '2030-01-02', '2030-02-01']):
+            batch.put_item(Item=with_index_keys({
+                'PK': f"APPT#a{i}", 'SK': 'APPT', 'appointment_id': f"a{i}", 'patient_id': 'p1', 'doctor_id': 'd1',
+                'date': day, 'time_slot': '09:00', 'status': 'cancelled' if i == 2 else 'pending',
+            }))
+        batch.put_item(Item=with_index_keys({
+            'PK': 'REPORT#r1', 'SK': 'METADATA', 'report_id': 'r1', 'appointment_id': 'a0', 'patient_id': 'p1',
+            'doctor_id': 'd1', 'exam_date': '2030-01-03',
+        }))
+
+    assert indexes.find_user_by_email(table, 'u1@clinica.it')['user_id'] == 'u1'
+    assert indexes.find_user_by_email(table, 'nessuno@clinica.it') is None
+    dates = [a['date'] for a in indexes.appointments_for_doctor(table, 'd1')]
+    assert dates == ['2030-01-01', '2030-01-02', '2030-01-03', '2030-02-01'], dates
+    assert [a['appointment_id'] for a in indexes.appointments_for_doctor(table, 'd1', date='2030-01-01')] == ['a1']
+    assert [a['appointment_id'] for a in indexes.appointments_for_patient(table, 'p1')][0] == 'a1'
+    assert [r['report_id'] for r in indexes.reports_for_patient(table, 'p1')] == ['r1']
+    assert indexes.report_for_appointment(table, 'a0')['report_id'] == 'r1'
+
+    # Ordine inverso
+    query = indexes.history_query('doctor_id', 'd1', 'APPT#', descending=True)
+    dates = [a['date'] for a in table.query(**query)['Items']]
+    assert dates == ['2030-02-01', '2030-01-03', '2030-01-02', '2030-01-01'], dates
+
+    # Paginazione: Limit prima del filtro, LastEvaluatedKey
+    query = indexes.history_query('doctor_id', 'd1', 'APPT#')
+    query['FilterExpression'] = Attr('status').ne('cancelled')
+    seen, scanned, start = [], 0, None
+    while True:
+        kwargs = dict(query, Limit=2, **({'ExclusiveStartKey': start} if start else {}))
+        page = table.query(**kwargs)
+        seen += [a['date'] for a in page['Items']]
+        scanned += page['ScannedCount']
+        assert page['Count'] == len(page['Items'])
+        start = page.get('LastEvaluatedKey')
+        if not start:
+            break
+    assert seen == ['2030-01-01', '2030-01-03', '2030-02-01'] and scanned == 4, (seen, scanned)
+
+    between = table.query(KeyConditionExpression=Key('PK').eq('APPT#a0') & Key('SK').between('A', 'B'))
+    assert [i['SK'] for i in between['Items']] == ['APPT']
+
+
+def check_scan(table):
+    found, start = [], None
+    while True:
+        page = table.scan(FilterExpression=Attr('role').eq('doctor') & Attr('SK').eq('PROFILE'),
+                          **({'ExclusiveStartKey': start} if start else {}))
+        found += page['Items']
+        start = page.get('LastEvaluatedKey')
+        if not start:
+            break
+    assert [d['user_id'] for d in found] == ['u1'], found
+
+
+CHECKS = [check_types, check_conditional_writes, check_update_expressions, check_transactions,
+          check_batches, check_indexes, check_scan]
+
+
+# ============================================
+# MOTORI
+# ============================================
+def open_engine(engine: str, endpoint: str):
+    table_name = f"Contract{int(time.time() * 1000)}"
+    if engine == 'sqlite':
+        from src.sqlite_table import SqliteTable
+        return SqliteTable(table_name, path=os.path.join(tempfile.mkdtemp(), "contract.db")), None
+
+    from src.aws import ThreadLocalTable
+    mock = None
+    if not endpoint:
+        from moto import mock_aws
+        mock = mock_aws()
+        mock.start()
+    boto3.client('dynamodb', region_name=REGION, endpoint_url=endpoint).create_table(**table_definition(table_name))
+    return ThreadLocalTable(table_name, REGION, endpoint_url=endpoint), mock
+
+
+def run_engine(engine: str, endpoint: str) -> int:
+    table, mock = open_engine(engine, endpoint)
+    failures = 0
+    try:
+        for check in CHECKS:
+            try:
+                check(table)
+                print(f"  OK       {engine:9} {check.__name__}")
+            except Exception:
+                failures += 1
+                print(f"  FALLITO  {engine:9} {check.__name__}\n{traceback.format_exc()}")
+    finally:
+        if mock:
+            mock.stop()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica di comportamento dei motori di storage")
+    parser.add_argument("--engines", nargs="+", default=["sqlite", "dynamodb"], choices=["sqlite", "dynamodb"])
+    parser.add_argument("--endpoint", help="endpoint DynamoDB (es. DynamoDB Local); default: moto")
+    args = parser.parse_args()
+    failed = sum(run_engine(engine, args.endpoint) for engine in args.engines)
+    sys.exit(1 if failed else 0)
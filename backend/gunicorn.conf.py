@@ -0,0 +1,78 @@
+# ============================================
+# SERVER DI PRODUZIONE (GUNICORN + WORKER UVICORN)
+# ============================================
+# gunicorn fa il pre-fork di WEB_CONCURRENCY worker uvicorn (event loop
+# asincrono ciascuno), li riavvia se muoiono e li ferma con un drain ordinato.
+# Lo sviluppo resta su `uvicorn src.main:app --reload`.
+#
+#   WEB_CONCURRENCY     worker (default: core disponibili, quota cgroup compresa,
+#                       con EVENTS_BACKEND=redis; uno solo con il broker in memoria)
+#   PORT                porta HTTP
+#   KEEPALIVE_SECONDS   keep-alive HTTP; sopra l'idle timeout del load balancer
+#                       (60 s su ALB), così è sempre l'ALB a chiudere per primo
+#   WORKER_TIMEOUT      secondi senza heartbeat prima di riavviare un worker
+#   MAX_REQUESTS        riavvio dopo N richieste (0 = mai), con jitter
+#   DRAIN_SECONDS       attesa massima delle richieste in corso allo stop
+#                       (stream SSE compresi, vedi src/worker.py)
+#
+# preload_app resta False: ogni worker importa l'app dopo il fork e crea i
+# propri thread, pool di processi e client AWS (vedi aws.py).
+#
+# Uso (dalla cartella backend/):
+#   gunicorn src.main:app -c gunicorn.conf.py
+
+import math
+import os
+
+from src.worker import DRAIN_SECONDS
+
+
+def available_cpus() -> int:
+    """Core utilizzabili: affinità del processo e quota CPU del cgroup (container)."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:  # cgroup v2: "<quota> <periodo>" o "max <periodo>"
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        try:  # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                cpus = min(cpus, math.ceil(quota / period))
+        except (OSError, ValueError):
+            pass
+    return max(1, cpus)
+
+
+CPUS = available_cpus()
+
+# Con il broker eventi in memoria ogni worker vedrebbe solo le proprie scritture
+# (vedi src/events.py): più worker solo con Redis o se richiesti esplicitamente
+MEMORY_EVENTS = os.getenv("EVENTS_BACKEND", "memory") == "memory"
+workers = int(os.getenv("WEB_CONCURRENCY", "1" if MEMORY_EVENTS else str(CPUS)))
+worker_class = "src.worker.Worker"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+keepalive = int(os.getenv("KEEPALIVE_SECONDS", "75"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = DRAIN_SECONDS + 10   # margine per lo shutdown dell'app
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+preload_app = False
+accesslog = "-"
+errorlog = "-"
+
+# Pool di processi per worker (hash password, anteprime): divisi tra i worker
+# invece di N processi per worker su N core
+os.environ.setdefault("HASH_WORKERS", str(max(1, CPUS // workers)))
+
+if workers > 1 and not os.getenv("JWT_SECRET_KEY"):
+    # Con una chiave temporanea per worker i token di un worker non valgono sugli altri
+    raise SystemExit("JWT_SECRET_KEY obbligatoria con più worker")
+
+if workers > 1 and MEMORY_EVENTS:
+    # Più worker chiesti esplicitamente: gli stream degli altri worker perderebbero eventi
+    raise SystemExit("WEB_CONCURRENCY > 1 richiede EVENTS_BACKEND=redis (oppure WEB_CONCURRENCY=1)")
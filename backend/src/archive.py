@@ -0,0 +1,324 @@
+# ============================================
+# ARCHIVIO APPUNTAMENTI CHIUSI (HOT / COLD)
+# ============================================
+# Gli appuntamenti chiusi (completati, rifiutati, cancellati) più vecchi di
+# ARCHIVE_AFTER_DAYS escono da ClinicaDB e finiscono in segmenti JSONL gzip
+# nel bucket S3 dei referti; la tabella tiene solo i dati attivi, così liste,
+# dashboard e query del medico leggono poche centinaia di item invece di anni
+# di storico.
+#
+# Un segmento per mese (data dell'appuntamento) e per esecuzione:
+#
+#   archive/appointments/month=2024-03/<run_id>.jsonl.gz
+#
+# Il segmento è una concatenazione di membri gzip indipendenti, uno per
+# paziente e uno per medico (ogni appuntamento compare due volte), con le
+# righe dalla più recente. Per ogni membro la tabella tiene un piccolo item
+# indice con l'intervallo di byte:
+#
+#   ARCHIVE#<user_id> / APPT#<mese>#<run_id>   s3_key, offset, length, count,
+#                                               statuses (conteggi per stato,
+#                                               per la riconciliazione di stats.py),
+#                                               skipped (righe non archiviate)
+#
+# Lo storico di un utente si legge a pagine di `limit` appuntamenti
+# dall'indice (mesi dal più recente) con una GET ranged per mese, senza
+# scaricare i segmenti interi; il cursore è l'item indice più la riga del
+# membro da cui riprendere.
+# archive/appointments/manifest.json elenca i segmenti scritti (mese, item,
+# byte) per ispezione e ripristino.
+#
+# Ordine delle scritture: segmento, indice, poi cancellazione dalla tabella
+# con la condizione sullo stato letto (più eventuale lock dello slot). Le
+# righe la cui cancellazione fallisce (stato cambiato nel frattempo) restano
+# nel segmento ma escono dall'indice: l'item del membro viene riscritto con
+# count e statuses corretti e gli id in `skipped`, che la lettura salta. Un
+# errore a metà lascia al più un appuntamento sia nella tabella sia
+# nell'archivio, mai perso; la lettura dello storico scarta i duplicati
+# nella stessa pagina.
+#
+# Uso (dalla cartella backend/, con S3_BUCKET_NAME impostato):
+#   python -m src.archive --dry-run
+#   python -m src.archive --days 180 --segments 4
+#
+#   ARCHIVE_AFTER_DAYS       età minima (giorni dalla data della visita)
+#   ARCHIVE_PREFIX           prefisso dei segmenti nel bucket
+#   ARCHIVE_MAX_ITEMS        appuntamenti per esecuzione (memoria del job);
+#                            oltre il limite si rilancia il comando
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from typing import Optional, Tuple
+
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+from fastapi.encoders import jsonable_encoder
+
+from . import bulk, pagination
+from .aws import run_io
+from .booking import HOLDING_STATUSES, release_lock
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_PREFIX = os.getenv("ARCHIVE_PREFIX", "archive/appointments/")
+ARCHIVE_MAX_ITEMS = int(os.getenv("ARCHIVE_MAX_ITEMS", "50000"))
+
+CLOSED_STATUSES = ('completed', 'rejected', 'cancelled')
+MANIFEST_KEY = "manifest.json"
+
+
+def index_pk(user_id: str) -> str:
+    return f"ARCHIVE#{user_id}"
+
+
+def cutoff_day(days: int = ARCHIVE_AFTER_DAYS, today: Optional[date] = None) -> str:
+    """Primo giorno che resta nella tabella: si archivia solo prima di questa data."""
+    return ((today or date.today()) - timedelta(days=days)).isoformat()
+
+
+# ============================================
+# SEGMENTI
+# ============================================
+def _row(item: dict) -> bytes:
+    return (json.dumps(jsonable_encoder(item), separators=(',', ':'), sort_keys=True) + '\n').encode()
+
+
+def build_segment(items: list) -> Tuple[bytes, list]:
+    """Corpo del segmento e (user_id, offset, length, righe) per ogni membro gzip."""
+    owners = defaultdict(list)
+    for item in items:
+        owners[item['patient_id']].append(item)
+        owners[item['doctor_id']].append(item)
+    body, members = bytearray(), []
+    for user_id in sorted(owners):
+        rows = sorted(owners[user_id], key=lambda a: a['index_sk'], reverse=True)
+        member = gzip.compress(b''.join(_row(a) for a in rows), compresslevel=6, mtime=0)
+        members.append((user_id, len(body), len(member), rows))
+        body += member
+    return bytes(body), members
+
+
+def index_item(user_id: str, month: str, run_id: str, s3_key: str, offset: int, length: int,
+               rows: list, skipped: frozenset = frozenset()) -> dict:
+    """Item indice di un membro: conteggi solo delle righe archiviate davvero."""
+    kept = [a for a in rows if a['appointment_id'] not in skipped]
+    item = {
+        'PK': index_pk(user_id), 'SK': f"APPT#{month}#{run_id}",
+        's3_key': s3_key, 'offset': offset, 'length': length,
+        'count': len(kept), 'statuses': dict(Counter(a['status'] for a in kept)),
+    }
+    dropped = sorted(a['appointment_id'] for a in rows if a['appointment_id'] in skipped)
+    if dropped:
+        item['skipped'] = dropped
+    return item
+
+
+def member_rows(entry: dict) -> int:
+    """Righe del membro gzip di un item indice, comprese quelle saltate."""
+    return int(entry['count']) + len(entry.get('skipped', []))
+
+
+def read_member(data: bytes) -> list:
+    return [json.loads(line) for line in gzip.decompress(data).splitlines() if line]
+
+
+def _get_range(s3_client, bucket: str, key: str, offset: int, length: int) -> bytes:
+    obj = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}")
+    return obj['Body'].read()
+
+
+# ============================================
+# JOB DI ARCHIVIAZIONE
+# ============================================
+def _candidates_filter(cutoff: str):
+    return Attr('SK').eq('APPT') & Attr('status').is_in(list(CLOSED_STATUSES)) & Attr('date').lt(cutoff)
+
+
+async def find_candidates(table, cutoff: str, segments: int = 1, max_items: int = ARCHIVE_MAX_ITEMS) -> list:
+    """Appuntamenti chiusi prima di `cutoff`: scan parallelo per segmenti, al più max_items."""
+    found = []
+
+    async def scan_segment(segment: int):
+        kwargs = {'FilterExpression': _candidates_filter(cutoff)}
+        if segments > 1:
+            kwargs.update(Segment=segment, TotalSegments=segments)
+        async for page in pagination.iter_pages(table, scan=True, **kwargs):
+            found.extend(page)
+            if len(found) >= max_items:
+                return
+
+    await asyncio.gather(*[scan_segment(s) for s in range(segments)])
+    return sorted(found, key=lambda a: a['index_sk'])[:max_items]
+
+
+def delete_ops(table_name: str, appt: dict) -> list:
+    """Delete dell'appuntamento se lo stato non è cambiato, più il lock se lo slot era occupato."""
+    ops = [{'Delete': {
+        'TableName': table_name,
+        'Key': {'PK': appt['PK'], 'SK': 'APPT'},
+        'ConditionExpression': "#s = :s",
+        'ExpressionAttributeNames': {'#s': 'status'},
+        'ExpressionAttributeValues': {':s': appt['status']},
+    }}]
+    if appt['status'] in HOLDING_STATUSES:
+        ops.append(release_lock(table_name, appt))
+    return ops
+
+
+async def _load_manifest(s3_client, bucket: str, prefix: str) -> dict:
+    try:
+        obj = await run_io(s3_client.get_object, Bucket=bucket, Key=prefix + MANIFEST_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {'segments': []}
+        raise
+    return json.loads(await run_io(obj['Body'].read))
+
+
+async def archive_month(table, s3_client, bucket: str, prefix: str, month: str, items: list, run_id: str) -> dict:
+    """Scrive segmento e indice di un mese, poi toglie gli appuntamenti dalla tabella."""
+    body, members = build_segment(items)
+    s3_key = f"{prefix}month={month}/{run_id}.jsonl.gz"
+    await run_io(s3_client.put_object, Bucket=bucket, Key=s3_key, Body=body, ContentType='application/gzip')
+    await bulk.batch_write(table, [bulk.put_request(index_item(user_id, month, run_id, s3_key, offset, length, rows))
+                                   for user_id, offset, length, rows in members])
+    results = await bulk.transact_groups(table, [delete_ops(table.name, a) for a in items])
+    # Righe rimaste nella tabella: fuori dall'indice dei membri che le contengono
+    skipped = frozenset(a['appointment_id'] for a, r in zip(items, results) if r is not None)
+    if skipped:
+        fixed = [index_item(user_id, month, run_id, s3_key, offset, length, rows, skipped)
+                 for user_id, offset, length, rows in members
+                 if any(a['appointment_id'] in skipped for a in rows)]
+        await bulk.batch_write(table, [bulk.put_request(item) if item['count'] else
+                                       bulk.delete_request({'PK': item['PK'], 'SK': item['SK']}) for item in fixed])
+    return {
+        'month': month, 's3_key': s3_key, 'appointments': len(items) - len(skipped), 'members': len(members),
+        'bytes': len(body), 'conflicts': len(skipped),
+    }
+
+
+async def run_archive(table, s3_client, bucket: str, cutoff: str, prefix: str = ARCHIVE_PREFIX,
+                      segments: int = 1, max_items: int = ARCHIVE_MAX_ITEMS, dry_run: bool = False) -> dict:
+    """Archivia gli appuntamenti chiusi prima di `cutoff`; restituisce il riepilogo."""
+    candidates = await find_candidates(table, cutoff, segments, max_items)
+    by_month = defaultdict(list)
+    for appt in candidates:
+        by_month[appt['date'][:7]].append(appt)
+    summary = {'cutoff': cutoff, 'appointments': len(candidates), 'months': len(by_month),
+               'bytes': 0, 'conflicts': 0, 'segments': []}
+    if dry_run or not candidates:
+        return summary
+
+    run_id = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+    for month in sorted(by_month):
+        segment = await archive_month(table, s3_client, bucket, prefix, month, by_month[month], run_id)
+        summary['segments'].append(segment)
+        summary['bytes'] += segment['bytes']
+        summary['conflicts'] += segment['conflicts']
+    summary['appointments'] = sum(s['appointments'] for s in summary['segments'])
+
+    manifest = await _load_manifest(s3_client, bucket, prefix)
+    manifest['segments'].extend(
+        {**s, 'run_id': run_id, 'cutoff': cutoff, 'created_at': time.time()} for s in summary['segments']
+    )
+    await run_io(s3_client.put_object, Bucket=bucket, Key=prefix + MANIFEST_KEY,
+                 Body=json.dumps(manifest, indent=1).encode(), ContentType='application/json')
+    return summary
+
+
+# ============================================
+# LETTURA DELLO STORICO
+# ============================================
+def _decode_position(cursor: Optional[str]) -> Optional[dict]:
+    position = pagination.decode_cursor(cursor)
+    if position is None:
+        return None
+    if set(position) != {'SK', 'row'} or not position['SK'].startswith("APPT#") or not position['row'].isdigit():
+        raise pagination.InvalidCursor(cursor)
+    return position
+
+
+async def history_page(table, s3_client, bucket: str, user_id: str, limit: int, cursor: Optional[str] = None,
+                       hidden_statuses: tuple = ()) -> Tuple[list, Optional[str]]:
+    """Al più `limit` appuntamenti archiviati di un utente, dal più recente, e cursore della pagina dopo.
+
+    Si scaricano (GET ranged, in parallelo) solo i membri che servono a
+    riempire la pagina secondo i conteggi dell'indice; gli stati in
+    hidden_statuses non contano e non vengono restituiti.
+    """
+    position = _decode_position(cursor)
+    key = Key('PK').eq(index_pk(user_id))
+    key &= Key('SK').between("APPT#", position['SK']) if position else Key('SK').begins_with("APPT#")
+    items, seen = [], set()
+
+    def start_row(entry: dict) -> int:
+        return int(position['row']) if position and entry['SK'] == position['SK'] else 0
+
+    def visible(entry: dict) -> int:
+        return sum(int(n) for status, n in entry.get('statuses', {}).items() if status not in hidden_statuses)
+
+    async for page in pagination.iter_pages(table, KeyConditionExpression=key, ScanIndexForward=False, Limit=limit):
+        queue = [(e, start_row(e)) for e in page if start_row(e) < member_rows(e)]
+        while queue:
+            if len(items) >= limit:
+                entry, row = queue[0]
+                return items, pagination.encode_cursor({'SK': entry['SK'], 'row': str(row)})
+            wanted, expected = [], 0
+            while queue and (not wanted or expected < limit - len(items)):
+                wanted.append(queue.pop(0))
+                expected += visible(wanted[-1][0])
+            members = await asyncio.gather(*[
+                run_io(_get_range, s3_client, bucket, e['s3_key'], int(e['offset']), int(e['length'])) for e, _ in wanted
+            ])
+            for (entry, start), data in zip(wanted, members):
+                rows, skipped = read_member(data), set(entry.get('skipped', []))
+                for row in range(start, len(rows)):
+                    appt = rows[row]
+                    if appt['status'] in hidden_statuses or appt['appointment_id'] in skipped:
+                        continue
+                    if appt['appointment_id'] in seen:
+                        continue
+                    if len(items) >= limit:
+                        return items, pagination.encode_cursor({'SK': entry['SK'], 'row': str(row)})
+                    seen.add(appt['appointment_id'])
+                    items.append(appt)
+    return items, None
+
+
+def main():
+    from .aws import LazyClient
+    from .storage import open_table
+
+    parser = argparse.ArgumentParser(description="Archivia su S3 gli appuntamenti chiusi")
+    parser.add_argument("--table", default=os.getenv("DYNAMODB_TABLE", "ClinicaDB"))
+    parser.add_argument("--region", default=os.getenv("AWS_REGION", "us-east-2"))
+    parser.add_argument("--bucket", default=os.getenv("S3_BUCKET_NAME"))
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="età minima in giorni")
+    parser.add_argument("--segments", type=int, default=4, help="segmenti di scan paralleli")
+    parser.add_argument("--max-items", type=int, default=ARCHIVE_MAX_ITEMS)
+    parser.add_argument("--dry-run", action="store_true", help="conta soltanto, senza scrivere")
+    args = parser.parse_args()
+    if not args.bucket and not args.dry_run:
+        parser.error("S3_BUCKET_NAME (o --bucket) obbligatorio")
+
+    summary = asyncio.run(run_archive(
+        open_table(args.table, args.region), LazyClient('s3', args.region), args.bucket,
+        cutoff_day(args.days), segments=args.segments, max_items=args.max_items, dry_run=args.dry_run,
+    ))
+    action = "da archiviare" if args.dry_run else "archiviati"
+    print(f"Appuntamenti chiusi prima del {summary['cutoff']} {action}: {summary['appointments']} "
+          f"in {summary['months']} mesi")
+    for s in summary['segments']:
+        print(f"  {s['s3_key']}: {s['appointments']} appuntamenti, {s['bytes']} byte, conflitti {s['conflicts']}")
+    if summary['appointments'] >= args.max_items:
+        print(f"Raggiunto il limite di {args.max_items} appuntamenti: rilanciare per continuare")
+
+
+if __name__ == "__main__":
+    main()
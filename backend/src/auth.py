@@ -0,0 +1,123 @@
+# ============================================
+# TOKEN DI ACCESSO FIRMATI (JWT)
+# ============================================
+# Il token contiene user_id, ruolo e i dati anagrafici usati dagli endpoint,
+# quindi get_current_user lo verifica localmente senza leggere DynamoDB.
+#
+# Revoca: ogni profilo ha un `token_version` che viene incrementato al cambio
+# password e copiato nel claim `ver` dei token emessi. Le versioni minime
+# valide stanno in una partizione, un item per utente revocato
+# (AUTH#REVOCATIONS / USER#<user_id>), che ogni worker rilegge al massimo ogni
+# REVOCATION_REFRESH_SECONDS: una query ogni 30 s invece di una lettura per
+# richiesta. Gli item scadono via TTL (`expires_at`) insieme ai token che
+# revocano, quindi la partizione contiene solo le revoche ancora utili.
+# Le voci del vecchio item unico (SK VERSIONS) vengono ancora lette finché
+# scadono.
+#
+#   JWT_SECRET_KEY                 chiave HMAC (obbligatoria: senza, il processo non parte)
+#   JWT_DEV_TEMPORARY_KEY          =1 solo in sviluppo: senza JWT_SECRET_KEY usa una
+#                                  chiave casuale per processo (token persi a ogni riavvio)
+#   ACCESS_TOKEN_EXPIRE_MINUTES    durata dei token
+#   REVOCATION_REFRESH_SECONDS     intervallo di refresh delle revoche
+
+import logging
+import os
+import secrets
+import time
+from typing import Optional
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from jose import jwt, JWTError
+
+from .aws import run_io
+from .indexes import query_all
+
+JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "480"))
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+if not JWT_SECRET_KEY:
+    if os.getenv("JWT_DEV_TEMPORARY_KEY") != "1":
+        raise RuntimeError("JWT_SECRET_KEY non impostata (in sviluppo: JWT_DEV_TEMPORARY_KEY=1)")
+    # Chiave casuale: i token valgono solo per questo processo
+    JWT_SECRET_KEY = secrets.token_urlsafe(32)
+    logger.warning("JWT_SECRET_KEY non impostata, uso una chiave temporanea (JWT_DEV_TEMPORARY_KEY=1)")
+
+# Campi del profilo copiati nel token (niente password_hash)
+TOKEN_PROFILE_FIELDS = ('email', 'role', 'name', 'surname', 'phone', 'specialization')
+
+
+def create_access_token(user: dict) -> str:
+    now = int(time.time())
+    claims = {field: user.get(field) for field in TOKEN_PROFILE_FIELDS}
+    claims.update({
+        'sub': user['user_id'],
+        'ver': int(user.get('token_version', 0)),
+        'iat': now,
+        'exp': now + ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    })
+    return jwt.encode(claims, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+def decode_access_token(token: str) -> Optional[dict]:
+    """Claims del token se firma e scadenza sono valide, altrimenti None."""
+    try:
+        return jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        return None
+
+
+def user_from_claims(claims: dict) -> dict:
+    user = {field: claims.get(field) for field in TOKEN_PROFILE_FIELDS}
+    user['user_id'] = claims['sub']
+    user['token_version'] = claims.get('ver', 0)
+    return user
+
+
+class TokenRevocations:
+    """Versione minima valida dei token per utente, con cache locale a tempo."""
+
+    PK = 'AUTH#REVOCATIONS'
+    LEGACY_SK = 'VERSIONS'
+
+    def __init__(self, table, refresh_seconds: float = REVOCATION_REFRESH_SECONDS):
+        self._table = table
+        self._refresh_seconds = refresh_seconds
+        self._entries = {}  # user_id -> (versione minima, scadenza epoch)
+        self._loaded_at = None
+
+    async def refresh(self):
+        # Segna subito il refresh: le richieste concorrenti usano i dati correnti
+        self._loaded_at = time.monotonic()
+        try:
+            items = await run_io(query_all, self._table, KeyConditionExpression=Key('PK').eq(self.PK), ConsistentRead=True)
+        except ClientError as e:
+            print(f"Errore refresh revoche token: {e}")
+            return
+        entries = {}
+        for item in items:
+            if item['SK'] == self.LEGACY_SK:
+                for name, entry in item.items():
+                    if name.startswith('USER#'):
+                        entries.setdefault(name[len('USER#'):], (int(entry['v']), int(entry['until'])))
+            elif item['SK'].startswith('USER#'):
+                entries[item['SK'][len('USER#'):]] = (int(item['v']), int(item['until']))
+        self._entries = entries
+
+    async def min_version(self, user_id: str) -> int:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self._refresh_seconds:
+            await self.refresh()
+        version, until = self._entries.get(user_id, (0, 0))
+        return version if until > time.time() else 0
+
+    async def revoke_before(self, user_id: str, version: int):
+        """Invalida i token di `user_id` con versione < `version`."""
+        until = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        await run_io(self._table.put_item, Item={
+            'PK': self.PK, 'SK': f"USER#{user_id}", 'v': version, 'until': until, 'expires_at': until,
+        })
+        self._entries[user_id] = (version, until)
@@ -0,0 +1,226 @@
+# ============================================
+# CALENDARIO DISPONIBILITÀ (BITMAP PER GIORNO)
+# ============================================
+# Per ogni medico e giorno un item compatto con due bitmap sulla griglia di
+# mezz'ora della giornata (bit 0 = 00:00, bit 18 = 09:00, ... bit 47 = 23:30):
+#
+#   CAL#<doctor_id> / <date>   offered  slot offerti (default 09:00-17:30)
+#                              booked   slot occupati (pending / confirmed)
+#                              version  contatore per gli aggiornamenti ottimistici
+#
+# Le bitmap vengono aggiornate in modo incrementale da set_availability (anche
+# in blocco), prenotazione, cancellazione e cambio di stato, quindi la lettura
+# di un intervallo di date è una sola Query per medico, senza leggere
+# appuntamenti.
+# rebuild_day ricalcola un giorno dai dati sorgente (AVAIL# + appuntamenti).
+#
+# Le bitmap si aggiornano dopo la transazione della prenotazione o del cambio
+# di stato: l'allineamento di una cancellazione può arrivare dopo quello di
+# una nuova prenotazione dello stesso slot. Prima di spegnere un bit si
+# rilegge quindi il lock dello slot (vedi booking.py): se è di un altro
+# appuntamento il bit resta acceso. La lettura avviene dopo quella del
+# calendario, quindi un'accensione concorrente cambia `version` e la
+# scrittura condizionale riparte con il lock riletto.
+
+import asyncio
+from typing import Iterable, List, Optional
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+from .aws import run_io
+from .booking import lock_key
+from .bulk import batch_get
+from . import indexes
+
+SLOTS_PER_DAY = 48
+BOOKED_STATUSES = ('pending', 'confirmed')
+MAX_UPDATE_RETRIES = 10
+
+
+def slot_index(time_slot: str) -> int:
+    """Indice del bit di uno slot "HH:MM" (solo :00 e :30)."""
+    hours, minutes = time_slot.split(':')
+    h, m = int(hours), int(minutes)
+    if not 0 <= h < 24 or m not in (0, 30):
+        raise ValueError(f"Slot non valido: {time_slot}")
+    return h * 2 + m // 30
+
+
+def slot_label(index: int) -> str:
+    return f"{index // 2:02d}:{'30' if index % 2 else '00'}"
+
+
+def mask_from_slots(time_slots: Iterable[str]) -> int:
+    mask = 0
+    for slot in time_slots:
+        mask |= 1 << slot_index(slot)
+    return mask
+
+
+def slots_from_mask(mask: int) -> List[str]:
+    return [slot_label(i) for i in range(SLOTS_PER_DAY) if mask >> i & 1]
+
+
+DEFAULT_OFFERED = mask_from_slots(f"{h:02d}:{m}" for h in range(9, 18) for m in ["00", "30"])
+
+
+def calendar_key(doctor_id: str, date: str) -> dict:
+    return {'PK': f"CAL#{doctor_id}", 'SK': date}
+
+
+def available_mask(day: Optional[dict]) -> int:
+    if not day:
+        return DEFAULT_OFFERED
+    offered = int(day['offered']) if 'offered' in day else DEFAULT_OFFERED
+    return offered & ~int(day.get('booked', 0))
+
+
+# ============================================
+# LETTURA
+# ============================================
+async def get_day(table, doctor_id: str, date: str) -> Optional[dict]:
+    res = await run_io(table.get_item, Key=calendar_key(doctor_id, date))
+    return res.get('Item')
+
+
+async def get_range(table, doctor_id: str, start: str, end: str) -> dict:
+    """Giorni con un item calendario nell'intervallo [start, end], per data."""
+    items = await run_io(indexes.query_all, table,
+        KeyConditionExpression=Key('PK').eq(f"CAL#{doctor_id}") & Key('SK').between(start, end)
+    )
+    return {item['SK']: item for item in items}
+
+
+# ============================================
+# AGGIORNAMENTI INCREMENTALI
+# ============================================
+async def set_offered(table, doctor_id: str, date: str, time_slots: Iterable[str]):
+    await run_io(table.update_item,
+        Key=calendar_key(doctor_id, date),
+        UpdateExpression="set offered = :m, version = if_not_exists(version, :zero) + :one",
+        ExpressionAttributeValues={':m': mask_from_slots(time_slots), ':zero': 0, ':one': 1}
+    )
+
+
+def offered_update(table_name: str, doctor_id: str, date: str, time_slots: Iterable[str]) -> dict:
+    """Come set_offered, come elemento di una TransactWriteItems."""
+    return {'Update': {
+        'TableName': table_name,
+        'Key': calendar_key(doctor_id, date),
+        'UpdateExpression': "set offered = :m, version = if_not_exists(version, :zero) + :one",
+        'ExpressionAttributeValues': {':m': mask_from_slots(time_slots), ':zero': 0, ':one': 1},
+    }}
+
+
+async def set_booked(table, doctor_id: str, date: str, time_slot: str, booked: bool,
+                     appointment_id: Optional[str] = None):
+    """Accende o spegne il bit di uno slot (con appointment_id, vedi update_booked)."""
+    index = slot_index(time_slot)
+    owners = {index: appointment_id} if appointment_id else None
+    await update_booked(table, doctor_id, date, set_mask=0 if not booked else 1 << index,
+                        clear_mask=0 if booked else 1 << index, owners=owners)
+
+
+async def _locked_by_others(table, doctor_id: str, date: str, owners: dict, mask: int) -> int:
+    """Bit di mask il cui lock appartiene a un appuntamento diverso da owners[bit]."""
+    keys = [lock_key(doctor_id, date, slot_label(i)) for i in owners if mask >> i & 1]
+    if not keys:
+        return 0
+    locked = 0
+    for lock in await batch_get(table, keys, consistent=True):
+        index = slot_index(lock['PK'].rsplit('#', 1)[1])
+        if lock.get('appointment_ref') != owners[index]:
+            locked |= 1 << index
+    return locked
+
+
+async def update_booked(table, doctor_id: str, date: str, set_mask: int = 0, clear_mask: int = 0,
+                        owners: Optional[dict] = None):
+    """Accende e spegne più bit di un giorno (read-modify-write con versione).
+
+    owners (indice bit -> appointment_id) limita gli spegnimenti agli slot il
+    cui lock non è stato ripreso da un altro appuntamento.
+    """
+    key = calendar_key(doctor_id, date)
+    for _ in range(MAX_UPDATE_RETRIES):
+        res = await run_io(table.get_item, Key=key, ConsistentRead=True)
+        day = res.get('Item')
+        current = int(day.get('booked', 0)) if day else 0
+        clearing = clear_mask & current
+        if owners and clearing:
+            clearing &= ~await _locked_by_others(table, doctor_id, date, owners, clearing)
+        new = (current | set_mask) & ~clearing
+        if new == current:
+            return
+        try:
+            if day is None:
+                await run_io(table.put_item,
+                    Item={**key, 'offered': DEFAULT_OFFERED, 'booked': new, 'version': 1},
+                    ConditionExpression="attribute_not_exists(PK)"
+                )
+            else:
+                version = int(day.get('version', 0))
+                await run_io(table.update_item,
+                    Key=key,
+                    UpdateExpression="set booked = :b, version = :next",
+                    ConditionExpression="attribute_not_exists(version) OR version = :v",
+                    ExpressionAttributeValues={':b': new, ':v': version, ':next': version + 1}
+                )
+            return
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    raise RuntimeError(f"Aggiornamento calendario {doctor_id} {date} non riuscito")
+
+
+async def sync_appointment(table, appointment: dict):
+    """Allinea il bit dello slot di un appuntamento al suo stato attuale."""
+    await set_booked(table, appointment['doctor_id'], appointment['date'], appointment['time_slot'],
+                     appointment['status'] in BOOKED_STATUSES, appointment['appointment_id'])
+
+
+async def sync_appointments(table, appointments: Iterable[dict]):
+    """Come sync_appointment per molti appuntamenti: un aggiornamento per giorno."""
+    days = {}
+    for appt in appointments:
+        day = days.setdefault((appt['doctor_id'], appt['date']), [0, 0, {}])
+        index = slot_index(appt['time_slot'])
+        if appt['status'] in BOOKED_STATUSES:
+            day[0] |= 1 << index
+        else:
+            day[1] |= 1 << index
+            day[2][index] = appt['appointment_id']
+    await asyncio.gather(*[update_booked(table, doctor_id, date, set_mask, clear_mask, owners)
+                           for (doctor_id, date), (set_mask, clear_mask, owners) in days.items()])
+
+
+# ============================================
+# RICOSTRUZIONE
+# ============================================
+def rebuild_day(table, doctor_id: str, date: str) -> dict:
+    """Ricalcola (sincrono, per il backfill) l'item calendario dai dati sorgente."""
+    avail = table.get_item(Key={'PK': f"AVAIL#{doctor_id}#{date}", 'SK': 'SLOTS'}).get('Item')
+    offered = DEFAULT_OFFERED
+    if avail:
+        offered = 0
+        for slot in avail.get('time_slots', []):
+            try:
+                offered |= 1 << slot_index(slot)
+            except ValueError:
+                print(f"Slot fuori griglia ignorato: {doctor_id} {date} {slot}")
+    booked = 0
+    for appt in indexes.appointments_for_doctor(table, doctor_id, date=date):
+        if appt.get('status') in BOOKED_STATUSES:
+            try:
+                booked |= 1 << slot_index(appt['time_slot'])
+            except ValueError:
+                print(f"Appuntamento fuori griglia ignorato: {appt['appointment_id']}")
+    # Nuova versione: gli aggiornamenti concorrenti ripartono dai valori ricalcolati
+    res = table.update_item(
+        Key=calendar_key(doctor_id, date),
+        UpdateExpression="set offered = :o, booked = :b, version = if_not_exists(version, :zero) + :one",
+        ExpressionAttributeValues={':o': offered, ':b': booked, ':zero': 0, ':one': 1},
+        ReturnValues="ALL_NEW"
+    )
+    return res['Attributes']
@@ -0,0 +1,138 @@
+# ============================================
+# ACCESSO NON BLOCCANTE AI SERVIZI AWS
+# ============================================
+# boto3 è sincrono: ogni chiamata DynamoDB / S3 / SNS viene eseguita in un
+# pool di thread dedicato e dimensionato esplicitamente, così l'event loop di
+# uvicorn resta libero di servire le altre richieste durante l'attesa di rete.
+#
+#   AWS_IO_WORKERS              thread del pool (= chiamate AWS concorrenti per worker)
+#   AWS_MAX_POOL_CONNECTIONS    connessioni HTTP per client (default: AWS_IO_WORKERS)
+#   AWS_CONNECT_TIMEOUT         timeout di connessione (s)
+#   AWS_READ_TIMEOUT            timeout di lettura (s)
+#   AWS_MAX_ATTEMPTS            tentativi per chiamata, compreso il primo
+#   AWS_RETRY_MODE              standard | adaptive (rallenta da solo sotto throttling)
+#   DYNAMODB_ENDPOINT_URL       endpoint DynamoDB alternativo (es. DynamoDB Local)
+#
+# I client boto3 sono thread-safe e vengono condivisi, con un connection pool
+# grande quanto il pool di thread e keep-alive TCP. Le resource DynamoDB
+# invece non lo sono: ThreadLocalTable ne crea una per thread.
+#
+# Nessun client viene creato all'import: LazyClient e ThreadLocalTable li
+# creano alla prima chiamata, nei thread del pool. Con più worker (gunicorn)
+# ognuno ha i propri client creati dopo il fork, e l'avvio non si blocca sulla
+# risoluzione delle credenziali (vedi readiness.py per il warm-up).
+#
+# run_io esegue la funzione nel contesto (contextvars) del chiamante, così le
+# metriche di ogni chiamata AWS si attribuiscono alla richiesta (vedi metrics.py).
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+from .metrics import instrument_client
+
+AWS_IO_WORKERS = int(os.getenv("AWS_IO_WORKERS", "32"))
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", str(AWS_IO_WORKERS)))
+AWS_CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", "3"))
+AWS_READ_TIMEOUT = float(os.getenv("AWS_READ_TIMEOUT", "20"))
+AWS_MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", "5"))
+AWS_RETRY_MODE = os.getenv("AWS_RETRY_MODE", "adaptive")
+DYNAMODB_ENDPOINT_URL = os.getenv("DYNAMODB_ENDPOINT_URL")
+
+_executor = ThreadPoolExecutor(max_workers=AWS_IO_WORKERS, thread_name_prefix="aws-io")
+
+client_config = Config(
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    connect_timeout=AWS_CONNECT_TIMEOUT,
+    read_timeout=AWS_READ_TIMEOUT,
+    retries={'max_attempts': AWS_MAX_ATTEMPTS, 'mode': AWS_RETRY_MODE},
+    tcp_keepalive=True,
+)
+
+
+async def run_io(fn, *args, **kwargs):
+    """Esegue una chiamata boto3 (o una funzione che ne fa) nel pool AWS."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, fn, *args, **kwargs))
+
+
+class LazyClient:
+    """Client boto3 creato alla prima chiamata invece che all'import.
+
+    Come ThreadLocalTable, `client.get_object` restituisce un callable che
+    crea il client solo quando viene eseguito (quindi nel thread del pool).
+    Un client ereditato da un fork viene ricreato nel nuovo processo.
+    """
+
+    def __init__(self, service_name: str, region_name: str, endpoint_url: str = None):
+        self.service_name = service_name
+        self._region_name = region_name
+        self._endpoint_url = endpoint_url
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    session = boto3.session.Session()
+                    client = session.client(self.service_name, region_name=self._region_name,
+                                            endpoint_url=self._endpoint_url, config=client_config)
+                    self._client = instrument_client(client)
+                    self._pid = os.getpid()
+        return self._client
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            return getattr(self.client(), name)(*args, **kwargs)
+        call.__name__ = name
+        return call
+
+
+class ThreadLocalTable:
+    """Proxy di una Table DynamoDB con una resource boto3 per ogni thread.
+
+    `table.get_item` restituisce un callable che risolve la Table del thread
+    solo al momento della chiamata, quindi funziona anche quando il metodo
+    viene passato a `run_io` dall'event loop.
+    """
+
+    def __init__(self, table_name: str, region_name: str, endpoint_url: str = DYNAMODB_ENDPOINT_URL):
+        self.name = table_name
+        self._region_name = region_name
+        self._endpoint_url = endpoint_url
+        self._local = threading.local()
+
+    def _table(self):
+        table = getattr(self._local, 'table', None)
+        if table is None:
+            session = boto3.session.Session()
+            dynamodb = session.resource('dynamodb', region_name=self._region_name,
+                                        endpoint_url=self._endpoint_url, config=client_config)
+            instrument_client(dynamodb.meta.client)
+            table = self._local.table = dynamodb.Table(self.name)
+        return table
+
+    def transact_write_items(self, **kwargs):
+        # Il client della resource accetta valori Python nativi, come la Table
+        return self._table().meta.client.transact_write_items(**kwargs)
+
+    def batch_write_item(self, **kwargs):
+        return self._table().meta.client.batch_write_item(**kwargs)
+
+    def batch_get_item(self, **kwargs):
+        return self._table().meta.client.batch_get_item(**kwargs)
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            return getattr(self._table(), name)(*args, **kwargs)
+        call.__name__ = name
+        return call
@@ -0,0 +1,59 @@
+# ============================================
+# PRENOTAZIONE ATOMICA (LOCK DI SLOT)
+# ============================================
+# Ogni slot occupato ha un item lock deterministico:
+#
+#   LOCK#<doctor_id>#<date>#<time_slot> / LOCK   appointment_ref = id appuntamento
+#
+# La prenotazione scrive lock e appuntamento nella stessa TransactWriteItems
+# con `attribute_not_exists(PK)` sul lock: su richieste concorrenti per lo
+# stesso slot vince esattamente una transazione, senza letture preliminari.
+# Il lock viene rilasciato (nella stessa transazione del cambio di stato)
+# quando l'appuntamento è cancellato o rifiutato.
+
+from botocore.exceptions import ClientError
+
+# Stati che tengono occupato lo slot
+HOLDING_STATUSES = ('pending', 'confirmed', 'completed')
+
+
+def lock_key(doctor_id: str, date: str, time_slot: str) -> dict:
+    return {'PK': f"LOCK#{doctor_id}#{date}#{time_slot}", 'SK': 'LOCK'}
+
+
+def appointment_lock_key(appointment: dict) -> dict:
+    return lock_key(appointment['doctor_id'], appointment['date'], appointment['time_slot'])
+
+
+def claim_lock(table_name: str, appointment: dict, reclaim: bool = False) -> dict:
+    """Put del lock; con reclaim l'appuntamento può riprendersi il proprio lock."""
+    condition = "attribute_not_exists(PK)"
+    values = None
+    if reclaim:
+        condition += " OR appointment_ref = :id"
+        values = {':id': appointment['appointment_id']}
+    put = {
+        'TableName': table_name,
+        'Item': {**appointment_lock_key(appointment), 'appointment_ref': appointment['appointment_id']},
+        'ConditionExpression': condition,
+    }
+    if values:
+        put['ExpressionAttributeValues'] = values
+    return {'Put': put}
+
+
+def release_lock(table_name: str, appointment: dict) -> dict:
+    """Delete del lock solo se appartiene all'appuntamento (o non esiste, dati storici)."""
+    return {'Delete': {
+        'TableName': table_name,
+        'Key': appointment_lock_key(appointment),
+        'ConditionExpression': "attribute_not_exists(PK) OR appointment_ref = :id",
+        'ExpressionAttributeValues': {':id': appointment['appointment_id']},
+    }}
+
+
+def cancellation_reasons(e: ClientError) -> list:
+    """Codici di annullamento per ogni elemento di una transazione fallita."""
+    if e.response['Error']['Code'] != 'TransactionCanceledException':
+        return []
+    return [r.get('Code', 'None') for r in e.response.get('CancellationReasons', [])]
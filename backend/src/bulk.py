@@ -0,0 +1,153 @@
+# ============================================
+# SCRITTURE IN BLOCCO (BATCH E TRANSAZIONI)
+# ============================================
+# Le operazioni che toccano molti item in una sola richiesta HTTP (un mese di
+# disponibilità, la conferma di tutte le richieste di una mattina) non fanno
+# una chiamata DynamoDB per item ma raggruppano:
+#
+#   batch_write      BatchWriteItem a blocchi di 25 put/delete (senza
+#                    condizioni); gli UnprocessedItems vengono ritentati
+#   batch_get        BatchGetItem a blocchi di 100 chiavi; idem per le
+#                    UnprocessedKeys
+#   transact_groups  TransactWriteItems a blocchi. Un gruppo (le scritture di
+#                    una stessa entità, es. stato + lock di un appuntamento)
+#                    non viene mai diviso tra transazioni. Se una transazione
+#                    viene annullata per condizione fallita, i gruppi colpevoli
+#                    vengono scartati e gli altri riscritti; sui conflitti tra
+#                    transazioni si ritenta tutto il blocco.
+#
+# I blocchi sono indipendenti e vengono scritti in parallelo. Tra un
+# tentativo e l'altro backoff esponenziale con jitter.
+#
+#   BULK_MAX_ATTEMPTS   tentativi per gli elementi non elaborati / in conflitto
+
+import asyncio
+import os
+import random
+from typing import List, Optional
+
+from botocore.exceptions import ClientError
+
+from .aws import run_io
+from .booking import cancellation_reasons
+
+BULK_MAX_ATTEMPTS = int(os.getenv("BULK_MAX_ATTEMPTS", "8"))
+BULK_BACKOFF_BASE = 0.05
+BULK_BACKOFF_MAX = 2.0
+
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_GET_MAX_KEYS = 100
+# Limite storico di TransactWriteItems (oggi 100 su DynamoDB, 25 su DynamoDB Local)
+TRANSACT_MAX_ITEMS = 25
+
+
+async def _backoff(attempt: int):
+    delay = min(BULK_BACKOFF_BASE * 2 ** attempt, BULK_BACKOFF_MAX)
+    await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def _chunks(items: list, size: int) -> list:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# ============================================
+# BATCH WRITE / GET
+# ============================================
+def put_request(item: dict) -> dict:
+    return {'PutRequest': {'Item': item}}
+
+
+def delete_request(key: dict) -> dict:
+    return {'DeleteRequest': {'Key': key}}
+
+
+async def _write_chunk(table, requests: list):
+    for attempt in range(BULK_MAX_ATTEMPTS):
+        res = await run_io(table.batch_write_item, RequestItems={table.name: requests})
+        requests = res.get('UnprocessedItems', {}).get(table.name, [])
+        if not requests:
+            return
+        await _backoff(attempt)
+    raise RuntimeError(f"{len(requests)} scritture non elaborate dopo {BULK_MAX_ATTEMPTS} tentativi")
+
+
+async def batch_write(table, requests: list):
+    """Scrive put_request / delete_request (chiavi distinte) a blocchi di 25."""
+    await asyncio.gather(*[_write_chunk(table, chunk) for chunk in _chunks(requests, BATCH_WRITE_MAX_ITEMS)])
+
+
+async def _get_chunk(table, keys: list, consistent: bool) -> list:
+    items = []
+    for attempt in range(BULK_MAX_ATTEMPTS):
+        res = await run_io(table.batch_get_item,
+                           RequestItems={table.name: {'Keys': keys, 'ConsistentRead': consistent}})
+        items.extend(res.get('Responses', {}).get(table.name, []))
+        keys = res.get('UnprocessedKeys', {}).get(table.name, {}).get('Keys', [])
+        if not keys:
+            return items
+        await _backoff(attempt)
+    raise RuntimeError(f"{len(keys)} letture non elaborate dopo {BULK_MAX_ATTEMPTS} tentativi")
+
+
+async def batch_get(table, keys: list, consistent: bool = False) -> list:
+    """Item esistenti tra le chiavi (distinte) richieste, in ordine qualsiasi."""
+    chunks = await asyncio.gather(*[_get_chunk(table, chunk, consistent)
+                                    for chunk in _chunks(keys, BATCH_GET_MAX_KEYS)])
+    return [item for chunk in chunks for item in chunk]
+
+
+# ============================================
+# TRANSAZIONI A GRUPPI
+# ============================================
+def _pack(groups: List[list]) -> List[List[int]]:
+    """Indici dei gruppi per transazione, senza superare TRANSACT_MAX_ITEMS."""
+    blocks, current, size = [], [], 0
+    for i, group in enumerate(groups):
+        if len(group) > TRANSACT_MAX_ITEMS:
+            raise ValueError(f"Gruppo di {len(group)} scritture oltre il limite di {TRANSACT_MAX_ITEMS}")
+        if size + len(group) > TRANSACT_MAX_ITEMS:
+            blocks.append(current)
+            current, size = [], 0
+        current.append(i)
+        size += len(group)
+    if current:
+        blocks.append(current)
+    return blocks
+
+
+async def _transact_block(table, groups: List[list], block: List[int], results: list):
+    pending, last = list(block), {}
+    for attempt in range(BULK_MAX_ATTEMPTS):
+        try:
+            await run_io(table.transact_write_items,
+                         TransactItems=[op for i in pending for op in groups[i]])
+            return
+        except ClientError as e:
+            reasons = cancellation_reasons(e)
+            if not reasons:
+                raise
+        # Codici di annullamento ridistribuiti sui gruppi, nello stesso ordine
+        failed, offset = set(), 0
+        for i in pending:
+            codes = reasons[offset:offset + len(groups[i])]
+            offset += len(groups[i])
+            if 'ConditionalCheckFailed' in codes:
+                results[i] = codes
+                failed.add(i)
+            else:
+                last[i] = codes
+        pending = [i for i in pending if i not in failed]
+        if not pending:
+            return
+        if not failed:
+            await _backoff(attempt)  # conflitto con altre transazioni o throttling
+    for i in pending:
+        results[i] = last[i]
+
+
+async def transact_groups(table, groups: List[list]) -> List[Optional[list]]:
+    """Scrive gruppi di operazioni transazionali; per ogni gruppo None se scritto,
+    altrimenti i codici di annullamento dei suoi elementi (es. ConditionalCheckFailed)."""
+    results = [None] * len(groups)
+    await asyncio.gather(*[_transact_block(table, groups, block, results) for block in _pack(groups)])
+    return results
@@ -0,0 +1,106 @@
+# ============================================
+# ELENCO MEDICI IN MEMORIA
+# ============================================
+# L'elenco dei medici cambia di rado ma viene chiesto a ogni cambio di
+# specializzazione nella pagina di prenotazione. Ogni worker lo tiene in
+# memoria, indicizzato per specializzazione e già serializzato in JSON:
+#
+#   - ricaricato con uno scan alla scadenza del TTL (una sola ricarica anche
+#     con molte richieste concorrenti)
+#   - invalidato da register quando si iscrive un medico (gli altri worker
+#     si allineano al più entro il TTL)
+#   - ogni lista ha un ETag, così il client può rivalidare con If-None-Match
+#
+#   DOCTOR_DIRECTORY_TTL_SECONDS    durata dell'elenco in memoria
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+DOCTOR_DIRECTORY_TTL_SECONDS = float(os.getenv("DOCTOR_DIRECTORY_TTL_SECONDS", "300"))
+
+ALL = ''
+
+
+class DoctorDirectory:
+    def __init__(self, loader: Callable[[], Awaitable[list]], ttl: float = DOCTOR_DIRECTORY_TTL_SECONDS):
+        self._loader = loader
+        self.ttl = ttl
+        self._lock = None           # creato nell'event loop (Python 3.9 lo lega al loop)
+        self._entries = {}          # specializzazione -> (body JSON, etag)
+        self._doctors = []
+        self._loaded_at = None
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def _fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def _refresh(self):
+        generation = self._generation
+        doctors = await self._loader()
+        by_spec = {ALL: doctors}
+        for doc in doctors:
+            if doc.get('specialization'):
+                by_spec.setdefault(doc['specialization'], []).append(doc)
+        entries = {}
+        for spec, docs in by_spec.items():
+            body = json.dumps(jsonable_encoder(docs), separators=(',', ':'), sort_keys=True).encode()
+            entries[spec] = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+        self._entries, self._doctors = entries, doctors
+        # Invalidato durante lo scan: l'elenco potrebbe non avere il nuovo medico
+        self._loaded_at = time.monotonic() if generation == self._generation else None
+        self.refreshes += 1
+
+    async def _ensure_fresh(self):
+        if self._fresh():
+            self.hits += 1
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Un'altra richiesta può aver già ricaricato mentre si attendeva il lock
+            if self._fresh():
+                self.hits += 1
+                return
+            self.misses += 1
+            await self._refresh()
+
+    async def doctors(self, specialization: Optional[str] = None) -> list:
+        await self._ensure_fresh()
+        if not specialization:
+            return list(self._doctors)
+        return [d for d in self._doctors if d.get('specialization') == specialization]
+
+    async def get(self, specialization: Optional[str] = None) -> Tuple[bytes, str]:
+        """(lista JSON serializzata, ETag) dei medici di una specializzazione."""
+        await self._ensure_fresh()
+        spec = specialization or ALL
+        if spec not in self._entries:
+            body = b'[]'
+            return body, f'"{hashlib.sha1(body).hexdigest()}"'
+        return self._entries[spec]
+
+    def invalidate(self):
+        self._generation += 1
+        self._loaded_at = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'doctors': len(self._doctors),
+            'specializations': len(self._entries) - 1 if self._entries else 0,
+            'age_seconds': round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None,
+            'ttl_seconds': self.ttl,
+        }
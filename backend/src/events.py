@@ -0,0 +1,263 @@
+# ============================================
+# EVENTI IN TEMPO REALE (SERVER-SENT EVENTS)
+# ============================================
+# Gli endpoint di scrittura (prenotazione, cancellazione, cambio stato,
+# referti) pubblicano piccoli delta per gli utenti coinvolti; i client
+# connessi a /api/events/stream li ricevono subito, invece di ricaricare la
+# lista completa dopo ogni azione o di non vedere le nuove prenotazioni.
+#
+#   publish -> broker -> EventHub di ogni worker -> coda del singolo stream
+#
+# Il broker è intercambiabile:
+#
+#   memory   consegna nello stesso processo (default, un solo worker)
+#   redis    pub/sub Redis: ogni worker riceve tutti gli eventi e li inoltra
+#            solo agli utenti connessi a lui (obbligatorio con più worker:
+#            gunicorn.conf.py non parte con il broker in memoria)
+#
+# Gli eventi di prenotazione, cambio stato e nuovo referto portano anche
+# `stats`, le variazioni dei contatori del medico (stesse chiavi di
+# stats.py): la dashboard le somma ai contatori già letti invece di
+# rileggerli a ogni evento.
+#
+# Gli eventi sono best effort, come le notifiche: l'operazione è già salvata
+# e un client che si riconnette ricarica i dati. Ogni stream ha una coda
+# limitata: un client che non legge abbastanza in fretta riceve `resync` e
+# viene disconnesso invece di far crescere la memoria del worker.
+#
+#   EVENTS_BACKEND             memory | redis
+#   EVENTS_REDIS_URL           es. redis://localhost:6379/0
+#   EVENTS_CHANNEL             canale pub/sub Redis
+#   EVENTS_QUEUE_SIZE          eventi in attesa per stream
+#   EVENTS_HEARTBEAT_SECONDS   commento keep-alive (sotto l'idle timeout dell'ALB)
+#   EVENTS_MAX_STREAM_SECONDS  durata massima di uno stream: il client si
+#                              riconnette e il token viene riverificato
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from . import metrics
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # serve solo con EVENTS_BACKEND=redis
+    aioredis = None
+
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL", "redis://localhost:6379/0")
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "clinica:events")
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_MAX_STREAM_SECONDS = float(os.getenv("EVENTS_MAX_STREAM_SECONDS", "600"))
+
+# Tipi di evento
+APPOINTMENT_CREATED = "appointment.created"   # appuntamento completo
+APPOINTMENT_UPDATED = "appointment.updated"   # appointment_id + status (cancelled = rimosso)
+REPORT_SAVED = "report.saved"                 # referto nuovo o sostituito, o anteprima aggiornata
+READY = "ready"                               # primo evento di ogni stream
+RESYNC = "resync"                             # eventi persi: ricaricare i dati
+
+RETRY_MS = 3000
+
+
+# ============================================
+# BROKER
+# ============================================
+class MemoryBroker:
+    """Consegna diretta all'EventHub dello stesso processo."""
+
+    def __init__(self):
+        self._deliver = None
+
+    async def start(self, deliver: Callable[[dict], None]):
+        self._deliver = deliver
+
+    async def publish(self, message: dict):
+        if self._deliver is not None:
+            self._deliver(message)
+
+    async def stop(self):
+        self._deliver = None
+
+
+class RedisBroker:
+    """Pub/sub Redis: un canale condiviso, ogni worker è iscritto."""
+
+    def __init__(self, url: str = EVENTS_REDIS_URL, channel: str = EVENTS_CHANNEL):
+        if aioredis is None:
+            raise RuntimeError("EVENTS_BACKEND=redis richiede il pacchetto redis")
+        self._client = aioredis.from_url(url)
+        self._channel = channel
+        self._pubsub = None
+        self._task = None
+
+    async def start(self, deliver: Callable[[dict], None]):
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self._channel)
+        self._task = asyncio.create_task(self._listen(deliver))
+
+    async def _listen(self, deliver: Callable[[dict], None]):
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=EVENTS_HEARTBEAT_SECONDS)
+                if message is not None:
+                    deliver(json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Redis non raggiungibile: il pubsub si riconnette e si riscrive al canale
+                print(f"Errore broker eventi Redis: {e}")
+                await asyncio.sleep(1)
+
+    async def publish(self, message: dict):
+        await self._client.publish(self._channel, json.dumps(message, separators=(',', ':')))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub is not None:
+            await self._pubsub.reset()
+        await self._client.close()
+
+
+def create_broker(backend: str = EVENTS_BACKEND):
+    if backend == "redis":
+        return RedisBroker()
+    return MemoryBroker()
+
+
+# ============================================
+# HUB (UNO PER WORKER)
+# ============================================
+class Subscription:
+    def __init__(self, user_id: str, queue_size: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+
+def _frame(event_type: str, data: dict, ts: Optional[float] = None, event_id: Optional[str] = None,
+           stats: Optional[dict] = None) -> bytes:
+    """Frame SSE; `data` contiene sempre {type, data, ts} (ts = pubblicazione) e `stats` se presente."""
+    event = {'type': event_type, 'data': data, 'ts': ts or time.time()}
+    if stats:
+        event['stats'] = stats
+    payload = json.dumps(event, separators=(',', ':'))
+    lines = [f"id: {event_id}"] if event_id else []
+    lines += [f"event: {event_type}", f"data: {payload}"]
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+class EventHub:
+    def __init__(self, broker=None, queue_size: int = EVENTS_QUEUE_SIZE,
+                 heartbeat_seconds: float = EVENTS_HEARTBEAT_SECONDS,
+                 max_stream_seconds: float = EVENTS_MAX_STREAM_SECONDS):
+        self.broker = broker if broker is not None else MemoryBroker()
+        self._queue_size = queue_size
+        self._heartbeat_seconds = heartbeat_seconds
+        self._max_stream_seconds = max_stream_seconds
+        self._subscriptions = {}   # user_id -> set di Subscription
+        self._closing = False
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subs) for subs in self._subscriptions.values())
+
+    def _gauge(self):
+        metrics.registry.set('clinica_events_connections', {}, self.connections,
+                             "Stream di eventi aperti su questo worker")
+
+    async def publish(self, user_ids: Iterable[str], event_type: str, data: dict, stats: Optional[dict] = None):
+        """Pubblica un delta per gli utenti indicati (errori solo registrati)."""
+        message = {
+            'id': uuid.uuid4().hex,
+            'type': event_type,
+            'users': sorted({u for u in user_ids if u}),
+            'data': jsonable_encoder(data),
+            'ts': time.time(),
+        }
+        if stats:
+            message['stats'] = {attr: delta for attr, delta in stats.items() if delta}
+        try:
+            await self.broker.publish(message)
+            metrics.registry.inc('clinica_events_published_total', {'type': event_type}, 1, "Eventi pubblicati")
+        except Exception as e:
+            print(f"Errore pubblicazione evento {event_type}: {e}")
+
+    def dispatch(self, message: dict):
+        """Inoltra un messaggio del broker agli stream locali degli utenti destinatari."""
+        for user_id in message['users']:
+            for sub in self._subscriptions.get(user_id, ()):
+                if sub.overflowed:
+                    continue
+                try:
+                    sub.queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    sub.overflowed = True
+                    metrics.registry.inc('clinica_events_dropped_total', {}, 1,
+                                         "Stream chiusi perché il client non leggeva gli eventi")
+
+    def _subscribe(self, user_id: str) -> Subscription:
+        sub = Subscription(user_id, self._queue_size)
+        self._subscriptions.setdefault(user_id, set()).add(sub)
+        self._gauge()
+        return sub
+
+    def _unsubscribe(self, sub: Subscription):
+        subs = self._subscriptions.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscriptions[sub.user_id]
+        self._gauge()
+
+    async def stream(self, user_id: str) -> AsyncIterator[bytes]:
+        """Frame SSE per un utente finché il client resta connesso."""
+        sub = self._subscribe(user_id)
+        deadline = time.monotonic() + self._max_stream_seconds
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode() + _frame(READY, {'connections': self.connections})
+            while not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    message = await asyncio.wait_for(sub.queue.get(), timeout=min(self._heartbeat_seconds, remaining))
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield _frame(message['type'], message['data'], message['ts'], message['id'], message.get('stats'))
+                metrics.registry.observe('clinica_events_delivery_seconds', {}, time.time() - message['ts'],
+                                         "Tempo dalla pubblicazione all'invio sullo stream")
+                if sub.overflowed and sub.queue.empty():
+                    yield _frame(RESYNC, {})
+                    return
+        finally:
+            self._unsubscribe(sub)
+
+    async def start(self):
+        self._closing = False
+        await self.broker.start(self.dispatch)
+
+    async def stop(self):
+        """Chiude gli stream aperti (i client si riconnettono a un altro worker)."""
+        self._closing = True
+        for subs in self._subscriptions.values():
+            for sub in subs:
+                try:
+                    sub.queue.put_nowait(None)
+                except asyncio.QueueFull:
+                    sub.overflowed = True
+        await self.broker.stop()
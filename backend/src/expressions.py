@@ -0,0 +1,490 @@
+# ============================================
+# ESPRESSIONI DYNAMODB (VALUTAZIONE LOCALE)
+# ============================================
+# Interprete delle espressioni DynamoDB usate dall'app, per il motore
+# SQLite (vedi sqlite_table.py), che deve comportarsi come la Table boto3:
+#
+#   condizioni   ConditionExpression / FilterExpression / KeyConditionExpression
+#                (=, <>, <, <=, >, >=, BETWEEN, IN, AND, OR, NOT, attribute_exists,
+#                attribute_not_exists, attribute_type, begins_with, contains, size)
+#   update       SET (con +, -, if_not_exists, list_append), REMOVE, ADD, DELETE
+#
+# Le condizioni costruite con boto3 (Key / Attr) vengono prima convertite in
+# stringa con il ConditionExpressionBuilder di boto3, come fa il client.
+
+import re
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'REMOVE', 'ADD', 'DELETE'}
+COMPARATORS = {'=', '<>', '<', '<=', '>', '>='}
+
+_TOKEN = re.compile(r"\s*(?:(<>|<=|>=|[=<>(),.\[\]+\-])|(#\w+)|(:\w+)|(\d+)|([A-Za-z_]\w*))")
+
+MISSING = object()
+
+
+class ExpressionError(ValueError):
+    """Espressione non valida: DynamoDB risponderebbe ValidationException."""
+
+
+def native(value):
+    """Valore Python come lo restituirebbe boto3 (int -> Decimal, bytes -> Binary, Enum str -> str)."""
+    serialized = _serializer.serialize(value)
+    if 'S' in serialized:
+        return str.__str__(serialized['S'])
+    return _deserializer.deserialize(serialized)
+
+
+def build(expression, names: dict, values: dict, is_key_condition: bool = False):
+    """(stringa, nomi, valori) anche per le condizioni costruite con Key / Attr."""
+    names, values = dict(names or {}), dict(values or {})
+    if isinstance(expression, ConditionBase):
+        built = ConditionExpressionBuilder().build_expression(expression, is_key_condition=is_key_condition)
+        names.update(built.attribute_name_placeholders)
+        values.update(built.attribute_value_placeholders)
+        expression = built.condition_expression
+    return expression, names, {k: native(v) for k, v in values.items()}
+
+
+# ============================================
+# PARSER
+# ============================================
+class _Parser:
+    def __init__(self, text: str, names: dict, values: dict):
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+        self.names = names
+        self.values = values
+
+    @staticmethod
+    def _tokenize(text: str) -> list:
+        tokens, pos = [], 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _TOKEN.match(text, pos)
+            if not match or match.end() == pos:
+                raise ExpressionError(f"Carattere non valido in {text!r} alla posizione {pos}")
+            pos = match.end()
+            punct, name_ref, value_ref, number, word = match.groups()
+            if punct:
+                tokens.append(('op', punct))
+            elif name_ref:
+                tokens.append(('name_ref', name_ref))
+            elif value_ref:
+                tokens.append(('value_ref', value_ref))
+            elif number:
+                tokens.append(('number', number))
+            elif word.upper() in KEYWORDS:
+                tokens.append(('kw', word.upper()))
+            else:
+                tokens.append(('word', word))
+        return tokens
+
+    def peek(self, offset: int = 0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if (kind and token[0] != kind) or (text and token[1] != text):
+            raise ExpressionError(f"Atteso {text or kind}, trovato {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def accept(self, kind, text=None) -> bool:
+        token = self.peek()
+        if token[0] == kind and (text is None or token[1] == text):
+            self.pos += 1
+            return True
+        return False
+
+    def done(self) -> bool:
+        return self.pos >= len(self.tokens)
+
+    # --- operandi ---
+    def _name(self) -> str:
+        kind, text = self.take()
+        if kind == 'name_ref':
+            if text not in self.names:
+                raise ExpressionError(f"Nome non definito: {text}")
+            return self.names[text]
+        if kind == 'word':
+            return text
+        raise ExpressionError(f"Nome di attributo atteso, trovato {text!r}")
+
+    def path(self) -> tuple:
+        elements = [self._name()]
+        while True:
+            if self.accept('op', '.'):
+                elements.append(self._name())
+            elif self.accept('op', '['):
+                elements.append(int(self.take('number')[1]))
+                self.take('op', ']')
+            else:
+                return tuple(elements)
+
+    def value_ref(self):
+        text = self.take('value_ref')[1]
+        if text not in self.values:
+            raise ExpressionError(f"Valore non definito: {text}")
+        value = self.values[text]
+        return lambda item: value
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'value_ref':
+            return self.value_ref()
+        if kind == 'word' and self.peek(1) == ('op', '(') and text == 'size':
+            self.pos += 2
+            path = self.path()
+            self.take('op', ')')
+            return lambda item: _size(resolve(item, path))
+        path = self.path()
+        return lambda item: resolve(item, path)
+
+    # --- condizioni ---
+    def condition(self):
+        left = self._and()
+        while self.accept('kw', 'OR'):
+            right = self._and()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def _and(self):
+        left = self._not()
+        while self.accept('kw', 'AND'):
+            right = self._not()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def _not(self):
+        if self.accept('kw', 'NOT'):
+            inner = self._not()
+            return lambda item: not inner(item)
+        return self._primary()
+
+    def _primary(self):
+        if self.accept('op', '('):
+            inner = self.condition()
+            self.take('op', ')')
+            return inner
+        kind, text = self.peek()
+        if kind == 'word' and self.peek(1) == ('op', '(') and text != 'size':
+            return self._function()
+        left = self.operand()
+        kind, text = self.peek()
+        if kind == 'op' and text in COMPARATORS:
+            self.pos += 1
+            right = self.operand()
+            return lambda item: compare(text, left(item), right(item))
+        if self.accept('kw', 'BETWEEN'):
+            low = self.operand()
+            self.take('kw', 'AND')
+            high = self.operand()
+            return lambda item: compare('>=', left(item), low(item)) and compare('<=', left(item), high(item))
+        if self.accept('kw', 'IN'):
+            self.take('op', '(')
+            options = [self.operand()]
+            while self.accept('op', ','):
+                options.append(self.operand())
+            self.take('op', ')')
+            return lambda item: any(compare('=', left(item), option(item)) for option in options)
+        raise ExpressionError(f"Operatore atteso dopo l'operando, trovato {text!r}")
+
+    def _function(self):
+        name = self.take('word')[1]
+        self.take('op', '(')
+        if name in ('attribute_exists', 'attribute_not_exists'):
+            path = self.path()
+            self.take('op', ')')
+            if name == 'attribute_exists':
+                return lambda item: resolve(item, path) is not MISSING
+            return lambda item: resolve(item, path) is MISSING
+        if name == 'attribute_type':
+            path = self.path()
+            self.take('op', ',')
+            type_code = self.value_ref()
+            self.take('op', ')')
+            return lambda item: _type_code(resolve(item, path)) == type_code(item)
+        if name in ('begins_with', 'contains'):
+            first = self.operand()
+            self.take('op', ',')
+            second = self.operand()
+            self.take('op', ')')
+            check = _begins_with if name == 'begins_with' else _contains
+            return lambda item: check(first(item), second(item))
+        raise ExpressionError(f"Funzione non supportata: {name}")
+
+    # --- update ---
+    def update(self) -> list:
+        actions = []
+        while not self.done():
+            clause = self.take('kw')[1]
+            while True:
+                if clause == 'SET':
+                    path = self.path()
+                    self.take('op', '=')
+                    actions.append(('SET', path, self._set_value()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', self.path(), None))
+                elif clause in ('ADD', 'DELETE'):
+                    path = self.path()
+                    actions.append((clause, path, self.value_ref()))
+                else:
+                    raise ExpressionError(f"Clausola non valida: {clause}")
+                if not self.accept('op', ','):
+                    break
+        return actions
+
+    def _set_value(self):
+        left = self._set_operand()
+        if self.accept('op', '+'):
+            right = self._set_operand()
+            return lambda item: _arith(left(item), right(item), 1)
+        if self.accept('op', '-'):
+            right = self._set_operand()
+            return lambda item: _arith(left(item), right(item), -1)
+        return left
+
+    def _set_operand(self):
+        kind, text = self.peek()
+        if kind == 'word' and self.peek(1) == ('op', '('):
+            self.pos += 2
+            if text == 'if_not_exists':
+                path = self.path()
+                self.take('op', ',')
+                default = self._set_value()
+                self.take('op', ')')
+
+                def if_not_exists(item):
+                    current = resolve(item, path)
+                    return default(item) if current is MISSING else current
+                return if_not_exists
+            if text == 'list_append':
+                first = self._set_value()
+                self.take('op', ',')
+                second = self._set_value()
+                self.take('op', ')')
+                return lambda item: list(_require(first(item))) + list(_require(second(item)))
+            raise ExpressionError(f"Funzione non supportata in SET: {text}")
+        if kind == 'value_ref':
+            return self.value_ref()
+        path = self.path()
+        return lambda item: _require(resolve(item, path))
+
+
+def condition(expression, names: dict = None, values: dict = None, is_key_condition: bool = False):
+    """Funzione item -> bool per una condizione (stringa o Key/Attr di boto3)."""
+    text, names, values = build(expression, names, values, is_key_condition)
+    parser = _Parser(text, names, values)
+    check = parser.condition()
+    if not parser.done():
+        raise ExpressionError(f"Testo inatteso in {text!r}: {parser.peek()[1]!r}")
+    return check
+
+
+def key_condition_parts(expression, names: dict = None, values: dict = None) -> list:
+    """Condizioni elementari di una KeyConditionExpression: [(attributo, operatore, [valori])]."""
+    text, names, values = build(expression, names, values, is_key_condition=True)
+    parser = _Parser(text, names, values)
+    parts = _key_parts(parser)
+    if not parser.done():
+        raise ExpressionError(f"Testo inatteso in {text!r}: {parser.peek()[1]!r}")
+    return parts
+
+
+def _key_parts(parser: _Parser) -> list:
+    parts = []
+    while True:
+        if parser.accept('op', '('):
+            parts.extend(_key_parts(parser))
+            parser.take('op', ')')
+        elif parser.peek() == ('word', 'begins_with'):
+            parser.pos += 2
+            attr = parser.path()[0]
+            parser.take('op', ',')
+            parts.append((attr, 'begins_with', [parser.value_ref()(None)]))
+            parser.take('op', ')')
+        else:
+            attr = parser.path()[0]
+            if parser.accept('kw', 'BETWEEN'):
+                low = parser.value_ref()(None)
+                parser.take('kw', 'AND')
+                parts.append((attr, 'BETWEEN', [low, parser.value_ref()(None)]))
+            else:
+                op = parser.take('op')[1]
+                if op not in COMPARATORS or op == '<>':
+                    raise ExpressionError(f"Operatore non ammesso nella condizione di chiave: {op}")
+                parts.append((attr, op, [parser.value_ref()(None)]))
+        if not parser.accept('kw', 'AND'):
+            return parts
+
+
+def apply_update(item: dict, expression: str, names: dict = None, values: dict = None) -> tuple:
+    """(nuovo item, attributi di primo livello modificati) dopo un UpdateExpression."""
+    text, names, values = build(expression, names, values)
+    parser = _Parser(text, names, values)
+    actions = parser.update()
+    # Come DynamoDB: tutti i valori si calcolano sull'item prima dell'update
+    computed = [(action, path, value(item) if value else None) for action, path, value in actions]
+    new = _copy(item)
+    touched = set()
+    for action, path, value in computed:
+        touched.add(path[0])
+        if action == 'SET':
+            _set_path(new, path, value)
+        elif action == 'REMOVE':
+            _remove_path(new, path)
+        elif action == 'ADD':
+            current = resolve(new, path)
+            if current is MISSING:
+                _set_path(new, path, value)
+            elif isinstance(current, Decimal) and isinstance(value, Decimal):
+                _set_path(new, path, current + value)
+            elif isinstance(current, set) and isinstance(value, set):
+                _set_path(new, path, current | value)
+            else:
+                raise ExpressionError("ADD richiede un numero o un set dello stesso tipo")
+        elif action == 'DELETE':
+            current = resolve(new, path)
+            if current is MISSING:
+                continue
+            if not isinstance(current, set) or not isinstance(value, set):
+                raise ExpressionError("DELETE richiede un set")
+            remaining = current - value
+            if remaining:
+                _set_path(new, path, remaining)
+            else:
+                _remove_path(new, path)
+    return new, touched
+
+
+# ============================================
+# SEMANTICA DEI VALORI
+# ============================================
+def resolve(item: dict, path: tuple):
+    current = item
+    for element in path:
+        if isinstance(element, int):
+            if not isinstance(current, list) or element >= len(current):
+                return MISSING
+        elif not isinstance(current, dict) or element not in current:
+            return MISSING
+        current = current[element]
+    return current
+
+
+def _ordering_key(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, Decimal):
+        return ('N', value)
+    if isinstance(value, str):
+        return ('S', value)
+    if isinstance(value, Binary):
+        return ('B', value.value)
+    return None
+
+
+def compare(op: str, left, right) -> bool:
+    if left is MISSING or right is MISSING:
+        return op == '<>'
+    if op in ('=', '<>'):
+        # Tipi diversi non sono mai uguali (anche True e 1)
+        equal = type(left) is type(right) and left == right
+        return equal == (op == '=')
+    a, b = _ordering_key(left), _ordering_key(right)
+    if a is None or b is None or a[0] != b[0]:
+        return False
+    return {'<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b}[op]
+
+
+def _begins_with(value, prefix) -> bool:
+    if isinstance(value, str) and isinstance(prefix, str):
+        return value.startswith(prefix)
+    if isinstance(value, Binary) and isinstance(prefix, Binary):
+        return value.value.startswith(prefix.value)
+    return False
+
+
+def _contains(value, operand) -> bool:
+    if isinstance(value, str) and isinstance(operand, str):
+        return operand in value
+    if isinstance(value, (set, list)):
+        return operand in value
+    return False
+
+
+def _size(value):
+    if value is MISSING:
+        return MISSING
+    if isinstance(value, Binary):
+        return Decimal(len(value.value))
+    if isinstance(value, str):
+        return Decimal(len(value.encode()))
+    if isinstance(value, (set, list, dict)):
+        return Decimal(len(value))
+    return MISSING
+
+
+def _type_code(value):
+    if value is MISSING:
+        return MISSING
+    return next(iter(_serializer.serialize(value)))
+
+
+def _require(value):
+    if value is MISSING:
+        raise ExpressionError("L'operando dell'update fa riferimento a un attributo inesistente")
+    return value
+
+
+def _arith(left, right, sign: int):
+    if not isinstance(_require(left), Decimal) or not isinstance(_require(right), Decimal):
+        raise ExpressionError("Operandi non numerici in un'espressione aritmetica")
+    return left + sign * right
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+
+def _set_path(item: dict, path: tuple, value):
+    target = item
+    for element in path[:-1]:
+        target = resolve(target, (element,))
+        if target is MISSING or not isinstance(target, (dict, list)):
+            raise ExpressionError("Il percorso del documento nell'update non è valido")
+    last = path[-1]
+    if isinstance(last, int):
+        if not isinstance(target, list):
+            raise ExpressionError("Il percorso del documento nell'update non è valido")
+        if last >= len(target):
+            target.append(value)
+        else:
+            target[last] = value
+    else:
+        if not isinstance(target, dict):
+            raise ExpressionError("Il percorso del documento nell'update non è valido")
+        target[last] = value
+
+
+def _remove_path(item: dict, path: tuple):
+    target = resolve(item, path[:-1]) if len(path) > 1 else item
+    last = path[-1]
+    if isinstance(target, dict):
+        target.pop(last, None)
+    elif isinstance(target, list) and isinstance(last, int) and last < len(target):
+        target.pop(last)
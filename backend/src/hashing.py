@@ -0,0 +1,88 @@
+# ============================================
+# HASH PASSWORD IN UN POOL DI PROCESSI
+# ============================================
+# pbkdf2 costa decine/centinaia di ms di CPU e tiene il GIL: eseguito dentro
+# un handler async blocca l'intero worker. Hash e verifica girano quindi in un
+# ProcessPoolExecutor limitato; oltre HASH_MAX_PENDING operazioni in coda la
+# richiesta viene rifiutata (503) invece di accumulare latenza.
+#
+#   HASH_WORKERS        processi del pool (0 = hash inline, solo per benchmark)
+#   HASH_MAX_PENDING    operazioni massime in coda o in esecuzione
+#   PBKDF2_ROUNDS       costo dell'hash; gli hash con meno round vengono
+#                       aggiornati al login (rehash trasparente)
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(max(HASH_WORKERS, 1) * 8)))
+PBKDF2_ROUNDS = int(os.getenv("PBKDF2_ROUNDS", "29000"))
+
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=PBKDF2_ROUNDS,
+    pbkdf2_sha256__min_rounds=PBKDF2_ROUNDS,
+)
+
+
+# Funzioni eseguite nei processi del pool (devono essere top-level)
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+class HasherBusy(Exception):
+    """Coda del pool piena: il chiamante deve rispondere 503."""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = HASH_WORKERS, max_pending: int = HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn: il worker uvicorn ha già thread attivi (pool AWS), fork non è sicuro
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def _submit(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if self.pending >= self.max_pending:
+            raise HasherBusy()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_pool(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        ok, _ = await self._submit(_verify_and_update, password, password_hash)
+        return ok
+
+    async def verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        """(password corretta, nuovo hash se quello salvato usa parametri superati)."""
+        return await self._submit(_verify_and_update, password, password_hash)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
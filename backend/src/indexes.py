@@ -0,0 +1,172 @@
+# ============================================
+# INDICI SECONDARI (GSI) DI ClinicaDB
+# ============================================
+# Ogni lookup degli endpoint passa da una Query su un indice dedicato invece
+# che da uno scan dell'intera tabella, così il costo cresce con il risultato
+# e non con la dimensione di ClinicaDB.
+#
+#   EmailIndex        email                       -> profilo utente
+#   PatientIndex      patient_id + index_sk       -> appuntamenti / referti del paziente
+#   DoctorIndex       doctor_id  + index_sk       -> appuntamenti / referti del medico
+#                                                    (dottore+data con begins_with)
+#   AppointmentIndex  appointment_id + SK         -> referto di un appuntamento
+#
+# Gli indici usano gli attributi già presenti sugli item; l'unico attributo
+# nuovo è `index_sk`, scritto su appuntamenti e referti (vedi migrate_indexes.py
+# per il backfill dei dati esistenti).
+
+from typing import Optional
+
+from boto3.dynamodb.conditions import Key, Attr
+
+EMAIL_INDEX = "EmailIndex"
+PATIENT_INDEX = "PatientIndex"
+DOCTOR_INDEX = "DoctorIndex"
+APPOINTMENT_INDEX = "AppointmentIndex"
+
+INDEX_SK = "index_sk"
+
+
+def appointment_index_sk(date: str, time_slot: str, appointment_id: str) -> str:
+    return f"APPT#{date}#{time_slot}#{appointment_id}"
+
+
+def report_index_sk(exam_date: str, report_id: str) -> str:
+    return f"REPORT#{exam_date}#{report_id}"
+
+
+def expected_index_sk(item: dict) -> Optional[str]:
+    """Valore di `index_sk` atteso per un item, None se l'item non è indicizzato."""
+    if item.get('SK') == 'APPT':
+        return appointment_index_sk(item['date'], item['time_slot'], item['appointment_id'])
+    if item.get('SK') == 'METADATA' and str(item.get('PK', '')).startswith('REPORT#'):
+        return report_index_sk(item.get('exam_date', ''), item['report_id'])
+    return None
+
+
+def with_index_keys(item: dict) -> dict:
+    """Aggiunge a un item (appuntamento o referto) le chiavi degli indici."""
+    index_sk = expected_index_sk(item)
+    if index_sk:
+        item[INDEX_SK] = index_sk
+    return item
+
+
+def query_all(table, **kwargs) -> list:
+    """Query completa: segue LastEvaluatedKey oltre il limite di 1 MB per pagina."""
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return items
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+# ============================================
+# LOOKUP
+# ============================================
+def find_user_by_email(table, email: str) -> Optional[dict]:
+    items = query_all(
+        table,
+        IndexName=EMAIL_INDEX,
+        KeyConditionExpression=Key('email').eq(email),
+        FilterExpression=Attr('SK').eq('PROFILE'),
+    )
+    return items[0] if items else None
+
+
+def appointments_for_doctor(table, doctor_id: str, date: str = None, time_slot: str = None) -> list:
+    """Appuntamenti di un medico, opzionalmente ristretti a un giorno o a uno slot."""
+    key_exp = Key('doctor_id').eq(doctor_id)
+    if date and time_slot:
+        key_exp = key_exp & Key(INDEX_SK).begins_with(f"APPT#{date}#{time_slot}#")
+    elif date:
+        key_exp = key_exp & Key(INDEX_SK).begins_with(f"APPT#{date}#")
+    else:
+        key_exp = key_exp & Key(INDEX_SK).begins_with("APPT#")
+    return query_all(table, IndexName=DOCTOR_INDEX, KeyConditionExpression=key_exp)
+
+
+def appointments_for_patient(table, patient_id: str) -> list:
+    return query_all(
+        table,
+        IndexName=PATIENT_INDEX,
+        KeyConditionExpression=Key('patient_id').eq(patient_id) & Key(INDEX_SK).begins_with("APPT#"),
+    )
+
+
+def reports_for_doctor(table, doctor_id: str) -> list:
+    return query_all(
+        table,
+        IndexName=DOCTOR_INDEX,
+        KeyConditionExpression=Key('doctor_id').eq(doctor_id) & Key(INDEX_SK).begins_with("REPORT#"),
+    )
+
+
+def reports_for_patient(table, patient_id: str) -> list:
+    return query_all(
+        table,
+        IndexName=PATIENT_INDEX,
+        KeyConditionExpression=Key('patient_id').eq(patient_id) & Key(INDEX_SK).begins_with("REPORT#"),
+    )
+
+
+def history_query(owner: str, owner_id: str, prefix: str, descending: bool = False) -> dict:
+    """Parametri della Query sullo storico ("APPT#" / "REPORT#") di un paziente o medico, ordinato per data.
+
+    `owner` è 'patient_id' o 'doctor_id'; pensato per la paginazione (vedi pagination.py).
+    """
+    return {
+        'IndexName': PATIENT_INDEX if owner == 'patient_id' else DOCTOR_INDEX,
+        'KeyConditionExpression': Key(owner).eq(owner_id) & Key(INDEX_SK).begins_with(prefix),
+        'ScanIndexForward': not descending,
+    }
+
+
+def appointments_window_query(owner: str, owner_id: str, date_from: Optional[str] = None,
+                              date_to: Optional[str] = None) -> dict:
+    """Come history_query per gli appuntamenti, ristretta ai giorni tra date_from e date_to (inclusi, opzionali)."""
+    query = history_query(owner, owner_id, "APPT#")
+    if date_from or date_to:
+        lower = f"APPT#{date_from}" if date_from else "APPT#"
+        upper = f"APPT#{date_to}#\uffff" if date_to else "APPT#\uffff"
+        query['KeyConditionExpression'] = Key(owner).eq(owner_id) & Key(INDEX_SK).between(lower, upper)
+    return query
+
+
+def report_for_appointment(table, appointment_id: str) -> Optional[dict]:
+    items = query_all(
+        table,
+        IndexName=APPOINTMENT_INDEX,
+        KeyConditionExpression=Key('appointment_id').eq(appointment_id) & Key('SK').eq('METADATA'),
+    )
+    return items[0] if items else None
+
+
+# ============================================
+# DEFINIZIONE TABELLA (per ambienti locali / benchmark)
+# ============================================
+def table_definition(table_name: str) -> dict:
+    """Parametri di create_table equivalenti a main.tf (on-demand invece che provisioned)."""
+    string_attrs = ['PK', 'SK', 'email', 'patient_id', 'doctor_id', 'appointment_id', INDEX_SK]
+
+    def gsi(name, hash_key, range_key=None):
+        schema = [{'AttributeName': hash_key, 'KeyType': 'HASH'}]
+        if range_key:
+            schema.append({'AttributeName': range_key, 'KeyType': 'RANGE'})
+        return {'IndexName': name, 'KeySchema': schema, 'Projection': {'ProjectionType': 'ALL'}}
+
+    return {
+        'TableName': table_name,
+        'BillingMode': 'PAY_PER_REQUEST',
+        'KeySchema': [{'AttributeName': 'PK', 'KeyType': 'HASH'}, {'AttributeName': 'SK', 'KeyType': 'RANGE'}],
+        'AttributeDefinitions': [{'AttributeName': a, 'AttributeType': 'S'} for a in string_attrs],
+        'GlobalSecondaryIndexes': [
+            gsi(EMAIL_INDEX, 'email'),
+            gsi(PATIENT_INDEX, 'patient_id', INDEX_SK),
+            gsi(DOCTOR_INDEX, 'doctor_id', INDEX_SK),
+            gsi(APPOINTMENT_INDEX, 'appointment_id', 'SK'),
+        ],
+    }
@@ -1,19 +1,40 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header, Query, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, RedirectResponse, Response
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, date as date_type, timedelta
 from enum import Enum
+from collections import Counter
 import uuid
 import os
-import io
+import asyncio
 
 #  SDK
-import boto3
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key, Attr
-from passlib.context import CryptContext
+
+from . import indexes
+from .aws import run_io, LazyClient
+from . import storage
+from . import metrics
+from .auth import create_access_token, decode_access_token, user_from_claims, TokenRevocations
+from .hashing import PasswordHasher, HasherBusy
+from . import notifications
+from .notifications import NotificationOutbox, SnsPublisher, FakeSNS
+from . import uploads
+from . import previews
+from .previews import PreviewPipeline
+from . import events
+from .events import EventHub
+from . import availability
+from . import archive
+from . import booking
+from . import pagination
+from . import bulk
+from . import stats
+from .directory import DoctorDirectory
+from .readiness import Readiness
 
 app = FastAPI(title="Clinica API - Enterprise Edition", version="4.8.0")
 
@@ -23,19 +44,75 @@ S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 # 👇 ARN DEL TUO TOPIC (NON TOCCARE)
 SNS_TOPIC_ARN = "arn:aws:sns:us-east-2:763835214385:Clinica-Notifiche-Topic"
 
+# Tutte le chiamate AWS passano da run_io (pool di thread dedicato, vedi aws.py);
+# i client vengono creati alla prima chiamata, dopo il fork del worker
 # 1. Client S3
-s3_client = boto3.client('s3', region_name=AWS_REGION)
+s3_client = LazyClient('s3', AWS_REGION)
 
-# 2. Risorsa DynamoDB
-dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+# 2. Tabella: DynamoDB (una resource per thread del pool) o SQLite locale, vedi storage.py
 table_name = os.getenv("DYNAMODB_TABLE", "ClinicaDB")
-table = dynamodb.Table(table_name)
+table = storage.open_table(table_name, AWS_REGION)
 
 # 3. Client SNS
-sns_client = boto3.client('sns', region_name=AWS_REGION)
+sns_client = LazyClient('sns', AWS_REGION)
+
+# /ready per il load balancer: client creati e tabella raggiungibile (vedi readiness.py)
+readiness = Readiness(table, [s3_client, sns_client])
+
+# Download referti: streaming a blocchi da S3 oppure redirect a URL prefirmato
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+DOWNLOAD_REDIRECT = os.getenv("DOWNLOAD_REDIRECT", "false").lower() == "true"
+PRESIGNED_URL_EXPIRES = int(os.getenv("PRESIGNED_URL_EXPIRES", "300"))
+
+# Sicurezza Password (pbkdf2 in un pool di processi, vedi hashing.py)
+password_hasher = PasswordHasher()
+
+# Revoca token (cache locale delle versioni minime, vedi auth.py)
+token_revocations = TokenRevocations(table)
+
+# Notifiche email: outbox su DynamoDB + dispatcher in background (vedi notifications.py)
+if notifications.NOTIFICATIONS_BACKEND == "fake":
+    notification_publisher = FakeSNS()
+else:
+    notification_publisher = SnsPublisher(sns_client, SNS_TOPIC_ARN)
+notification_outbox = NotificationOutbox(table, notification_publisher)
+
+# Anteprime dei referti: render della prima pagina in background (vedi previews.py);
+# a ogni cambio di stato dell'anteprima il referto ripubblicato aggiorna i client
+preview_pipeline = PreviewPipeline(table, s3_client, S3_BUCKET_NAME, on_change=lambda report: publish_report(report))
 
-# Sicurezza Password
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Eventi in tempo reale per i client connessi (SSE, broker in memoria o Redis, vedi events.py)
+event_hub = EventHub(events.create_broker())
+
+@app.exception_handler(HasherBusy)
+async def hasher_busy_handler(request: Request, exc: HasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Servizio occupato, riprovare"}, headers={"Retry-After": "1"})
+
+background_tasks = []
+
+@app.on_event("startup")
+async def start_background_workers():
+    background_tasks.append(asyncio.create_task(readiness.warm_up()))
+    notification_outbox.start()
+    try:
+        await event_hub.start()
+    except Exception as e:
+        print(f"Errore avvio broker eventi: {e}")
+    if S3_BUCKET_NAME:
+        background_tasks.append(asyncio.create_task(uploads.gc_loop(s3_client, S3_BUCKET_NAME)))
+        preview_pipeline.start()
+    if storage.STORAGE_BACKEND == "sqlite":
+        background_tasks.append(asyncio.create_task(storage.ttl_loop(table)))
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    readiness.draining = True
+    await event_hub.stop()
+    for task in background_tasks:
+        task.cancel()
+    await notification_outbox.stop()
+    await preview_pipeline.stop()
+    password_hasher.shutdown()
 
 # --- CORS ---
 app.add_middleware(
@@ -46,6 +123,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- METRICHE (latenza per route + chiamate AWS della richiesta, vedi metrics.py) ---
+# Aggiunto dopo CORS: è il middleware più esterno e misura anche le risposte in streaming
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 # ============================================
 # MODELS
 # ============================================
@@ -96,6 +181,12 @@ class LoginResponse(BaseModel):
     token: str
     user: UserResponse
 
+class DashboardResponse(BaseModel):
+    profile: UserResponse
+    appointments: list
+    reports: list
+    counts: dict
+
 class AppointmentRequest(BaseModel):
     doctor_id: str
     date: str
@@ -107,21 +198,74 @@ class AvailabilityRequest(BaseModel):
     time_slots: List[str]
     is_available: bool
 
+# --- MODELLI PER OPERAZIONI IN BLOCCO ---
+class WeekdayTemplate(BaseModel):
+    weekday: int  # 0 = lunedì ... 6 = domenica
+    time_slots: List[str]
+
+class BulkAvailabilityRequest(BaseModel):
+    start_date: str
+    end_date: str
+    templates: List[WeekdayTemplate]
+    is_available: bool = True
+
+class BulkStatusRequest(BaseModel):
+    appointment_ids: List[str]
+    status: AppointmentStatus
+
+# --- MODELLO PER UPLOAD REFERTO A BLOCCHI ---
+class UploadInitRequest(BaseModel):
+    appointment_id: str
+    exam_type: str
+    exam_date: str
+    notes: Optional[str] = None
+    filename: str
+    content_type: str = "application/pdf"
+    size: int
+
 # ============================================
 # AUTHENTICATION HELPERS
 # ============================================
-def get_current_user(authorization: str = Header(None)):
+async def get_current_user(authorization: str = Header(None)):
+    # Verifica locale del token firmato: nessuna lettura DynamoDB per richiesta
     if not authorization:
         raise HTTPException(status_code=401, detail="Non autenticato")
-    user_id = authorization.replace("Bearer ", "")
+    claims = decode_access_token(authorization.replace("Bearer ", ""))
+    if not claims:
+        raise HTTPException(status_code=401, detail="Token non valido o scaduto")
+    if claims.get('ver', 0) < await token_revocations.min_version(claims['sub']):
+        raise HTTPException(status_code=401, detail="Token revocato")
+    return user_from_claims(claims)
+
+async def notify(event_type: str, payload: dict):
+    # L'operazione principale è già salvata: un errore dell'outbox non la annulla
+    try:
+        await notification_outbox.enqueue(event_type, payload)
+    except Exception as e:
+        print(f"Errore accodamento notifica {event_type}: {e}")
+
+async def sync_calendar(appointment: dict):
+    # Le bitmap sono derivate: in caso di errore si riallineano con rebuild_day
+    try:
+        await availability.sync_appointment(table, appointment)
+    except Exception as e:
+        print(f"Errore aggiornamento calendario {appointment.get('appointment_id')}: {e}")
+
+async def sync_calendar_many(appointments: list):
+    try:
+        await availability.sync_appointments(table, appointments)
+    except Exception as e:
+        print(f"Errore aggiornamento calendario ({len(appointments)} appuntamenti): {e}")
+
+async def load_profile(user_id: str) -> dict:
     try:
-        response = table.get_item(Key={'PK': f"USER#{user_id}", 'SK': 'PROFILE'})
-        user = response.get('Item')
-        if not user:
-            raise HTTPException(status_code=401, detail="Utente non trovato")
-        return user
+        response = await run_io(table.get_item, Key={'PK': f"USER#{user_id}", 'SK': 'PROFILE'})
     except ClientError:
         raise HTTPException(status_code=500, detail="Errore Database")
+    user = response.get('Item')
+    if not user:
+        raise HTTPException(status_code=401, detail="Utente non trovato")
+    return user
 
 # ============================================
 # ENDPOINTS
@@ -129,12 +273,11 @@ def get_current_user(authorization: str = Header(None)):
 
 @app.post("/api/auth/register")
 async def register(data: RegisterRequest):
-    scan = table.scan(FilterExpression=Attr('email').eq(data.email) & Attr('SK').eq('PROFILE'))
-    if scan['Count'] > 0:
+    if await run_io(indexes.find_user_by_email, table, data.email):
         raise HTTPException(status_code=400, detail="Email già registrata")
     
     user_id = str(uuid.uuid4())
-    hashed_password = pwd_context.hash(data.password)
+    hashed_password = await password_hasher.hash(data.password)
     
     item = {
         'PK': f"USER#{user_id}", 'SK': 'PROFILE',
@@ -143,99 +286,268 @@ async def register(data: RegisterRequest):
         'phone': data.phone, 'specialization': data.specialization if data.role == UserRole.DOCTOR else None,
         'created_at': datetime.now().isoformat()
     }
-    table.put_item(Item=item)
+    await run_io(table.put_item, Item=item)
+    if data.role == UserRole.DOCTOR:
+        doctor_directory.invalidate()
     return {"user_id": user_id, "message": "Registrazione completata"}
 
 @app.post("/api/auth/login", response_model=LoginResponse) # 🔒 Filtra via la password
 async def login(data: LoginRequest):
-    scan = table.scan(FilterExpression=Attr('email').eq(data.email) & Attr('SK').eq('PROFILE'))
-    if scan['Count'] == 0:
+    user = await run_io(indexes.find_user_by_email, table, data.email)
+    if not user:
         raise HTTPException(status_code=401, detail="Credenziali non valide")
-    user = scan['Items'][0]
-    if not pwd_context.verify(data.password, user['password_hash']):
+    valid, new_hash = await password_hasher.verify_and_update(data.password, user['password_hash'])
+    if not valid:
         raise HTTPException(status_code=401, detail="Credenziali non valide")
+
+    # Rehash trasparente se l'hash salvato usa parametri superati
+    if new_hash:
+        try:
+            await run_io(table.update_item,
+                Key={'PK': f"USER#{user['user_id']}", 'SK': 'PROFILE'},
+                UpdateExpression="set #p = :new",
+                ConditionExpression="#p = :old",
+                ExpressionAttributeNames={'#p': 'password_hash'},
+                ExpressionAttributeValues={':new': new_hash, ':old': user['password_hash']}
+            )
+        except ClientError as e:
+            print(f"Rehash password non salvato: {e}")
     
     return {
-        "token": f"Bearer {user['user_id']}",
+        "token": f"Bearer {create_access_token(user)}",
         "user": user # Pydantic pulirà questo oggetto rimuovendo password_hash
     }
 
 @app.get("/api/users/me", response_model=UserResponse)
 async def get_my_profile(current_user: dict = Depends(get_current_user)):
-    return current_user
+    return await load_profile(current_user['user_id'])
 
 @app.post("/api/users/change-password")
 async def change_password(data: ChangePasswordRequest, current_user: dict = Depends(get_current_user)):
     # 1. Recupera l'utente dal DB
-    response = table.get_item(Key={'PK': f"USER#{current_user['user_id']}", 'SK': 'PROFILE'})
+    response = await run_io(table.get_item, Key={'PK': f"USER#{current_user['user_id']}", 'SK': 'PROFILE'})
     user_record = response.get('Item')
 
     if not user_record:
         raise HTTPException(status_code=404, detail="Utente non trovato")
 
     # 2. Verifica vecchia password
-    if not pwd_context.verify(data.old_password, user_record['password_hash']):
+    if not await password_hasher.verify(data.old_password, user_record['password_hash']):
         raise HTTPException(status_code=400, detail="La vecchia password non è corretta")
 
-    # 3. Aggiorna password
-    new_hashed_password = pwd_context.hash(data.new_password)
-    table.update_item(
+    # 3. Aggiorna password e versione dei token (invalida le sessioni precedenti)
+    new_hashed_password = await password_hasher.hash(data.new_password)
+    updated = await run_io(table.update_item,
         Key={'PK': f"USER#{current_user['user_id']}", 'SK': 'PROFILE'},
-        UpdateExpression="set #p = :p",
-        ExpressionAttributeNames={'#p': 'password_hash'},
-        ExpressionAttributeValues={':p': new_hashed_password}
+        UpdateExpression="set #p = :p, #v = if_not_exists(#v, :zero) + :one",
+        ExpressionAttributeNames={'#p': 'password_hash', '#v': 'token_version'},
+        ExpressionAttributeValues={':p': new_hashed_password, ':zero': 0, ':one': 1},
+        ReturnValues="ALL_NEW"
     )
+    user_record = updated['Attributes']
+    await token_revocations.revoke_before(current_user['user_id'], int(user_record['token_version']))
 
-    return {"message": "Password aggiornata con successo"}
+    # 4. Nuovo token per la sessione corrente
+    return {"message": "Password aggiornata con successo", "token": f"Bearer {create_access_token(user_record)}"}
 
-@app.get("/api/doctors")
-async def get_doctors(specialization: Optional[str] = None):
+def doctors_filter(specialization: Optional[str] = None):
     filter_exp = Attr('role').eq(UserRole.DOCTOR) & Attr('SK').eq('PROFILE')
     if specialization:
         filter_exp = filter_exp & Attr('specialization').eq(specialization)
-    response = table.scan(FilterExpression=filter_exp)
+    return filter_exp
+
+def public_doctor(doc: dict) -> dict:
+    doc.pop('password_hash', None)
+    return doc
+
+async def list_doctors(specialization: Optional[str] = None) -> list:
     doctors = []
-    for doc in response['Items']:
-        doc.pop('password_hash', None)
-        doctors.append(doc)
+    async for page in pagination.iter_pages(table, scan=True, FilterExpression=doctors_filter(specialization)):
+        doctors.extend(public_doctor(doc) for doc in page)
     return doctors
 
+# Elenco in memoria per worker, ricaricato da list_doctors (vedi directory.py)
+doctor_directory = DoctorDirectory(list_doctors)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match: lista di ETag separati da virgola (confronto debole, W/ ignorato) o `*`."""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+@app.get("/api/doctors")
+async def get_doctors(request: Request, specialization: Optional[str] = None):
+    body, etag = await doctor_directory.get(specialization)
+    # no-cache: il browser rivalida sempre, ma con ETag invariato riceve un 304 vuoto
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/doctors/directory/stats")
+async def get_doctor_directory_stats():
+    return doctor_directory.stats()
+
+# --- LISTE PAGINATE (cursore) E IN STREAMING (NDJSON), vedi pagination.py ---
+async def read_page(limit: int, cursor: Optional[str], **kwargs) -> dict:
+    try:
+        items, next_cursor = await pagination.fetch_page(table, limit, cursor, **kwargs)
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Cursore non valido")
+    except ClientError as e:
+        # DynamoDB rifiuta un ExclusiveStartKey che non appartiene alla query
+        if cursor and e.response['Error']['Code'] == 'ValidationException':
+            raise HTTPException(status_code=400, detail="Cursore non valido")
+        raise
+    return {'items': items, 'next_cursor': next_cursor}
+
+async def stream_items(transform=None, **kwargs):
+    """Item delle pagine DynamoDB man mano che arrivano, con trasformazione per pagina."""
+    async for page in pagination.iter_pages(table, **kwargs):
+        if transform:
+            page = await transform(page)
+        for item in page:
+            yield item
+
+def ndjson_response(items) -> StreamingResponse:
+    return StreamingResponse(pagination.ndjson(items), media_type="application/x-ndjson")
+
+async def public_doctors(page: list) -> list:
+    return [public_doctor(doc) for doc in page]
+
+@app.get("/api/doctors/page")
+async def get_doctors_page(specialization: Optional[str] = None, limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE), cursor: Optional[str] = None):
+    page = await read_page(limit, cursor, scan=True, FilterExpression=doctors_filter(specialization))
+    page['items'] = await public_doctors(page['items'])
+    return page
+
+@app.get("/api/doctors/stream")
+async def stream_doctors(specialization: Optional[str] = None):
+    return ndjson_response(stream_items(public_doctors, scan=True, FilterExpression=doctors_filter(specialization)))
+
+# --- CALENDARIO DISPONIBILITÀ (bitmap per medico/giorno, vedi availability.py) ---
+CALENDAR_MAX_DAYS = 62
+
+@app.get("/api/doctors/calendar")
+async def get_availability_calendar(
+    start: str, end: str, doctor_id: Optional[str] = None, specialization: Optional[str] = None
+):
+    try:
+        start_day, end_day = date_type.fromisoformat(start), date_type.fromisoformat(end)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Date non valide (formato YYYY-MM-DD)")
+    n_days = (end_day - start_day).days + 1
+    if not 1 <= n_days <= CALENDAR_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Intervallo non valido (massimo {CALENDAR_MAX_DAYS} giorni)")
+    if doctor_id:
+        doctor_ids = [doctor_id]
+    elif specialization:
+        doctor_ids = [d['user_id'] for d in await doctor_directory.doctors(specialization)]
+    else:
+        raise HTTPException(status_code=422, detail="Indicare doctor_id o specialization")
+
+    # Una Query per medico, tutte in parallelo
+    ranges = await asyncio.gather(*[availability.get_range(table, d, start, end) for d in doctor_ids])
+    dates = [(start_day + timedelta(days=i)).isoformat() for i in range(n_days)]
+    return {
+        'start': start,
+        'end': end,
+        'doctors': [
+            {
+                'doctor_id': d,
+                'days': {day: availability.slots_from_mask(availability.available_mask(days.get(day))) for day in dates}
+            }
+            for d, days in zip(doctor_ids, ranges)
+        ]
+    }
+
+# Statistiche del medico da un solo get_item (contatori atomici, vedi stats.py)
+@app.get("/api/doctors/me/stats")
+async def get_my_doctor_stats(day: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Solo medici")
+    day = parse_day(day, "day") or date_type.today().isoformat()
+    res = await run_io(table.get_item, Key=stats.stats_key(current_user['user_id']))
+    return stats.summary(res.get('Item', {}), day, date_type.today().isoformat()[:7])
+
 @app.get("/api/doctors/{doctor_id}/availability")
 async def get_doctor_availability(doctor_id: str, date: str):
-    pk_avail = f"AVAIL#{doctor_id}#{date}"
-    response = table.get_item(Key={'PK': pk_avail, 'SK': 'SLOTS'})
-    avail_item = response.get('Item')
-    slots = avail_item.get('time_slots', []) if avail_item else [f"{h:02d}:{m}" for h in range(9, 18) for m in ["00", "30"]]
-    
-    scan_appt = table.scan(FilterExpression=Attr('doctor_id').eq(doctor_id) & Attr('date').eq(date) & Attr('SK').eq('APPT'))
-    booked_slots = [a['time_slot'] for a in scan_appt['Items'] if a['status'] in ['confirmed', 'pending']]
-    
-    return {'doctor_id': doctor_id, 'date': date, 'available_slots': [s for s in slots if s not in booked_slots]}
+    day = await availability.get_day(table, doctor_id, date)
+    return {'doctor_id': doctor_id, 'date': date, 'available_slots': availability.slots_from_mask(availability.available_mask(day))}
 
 @app.post("/api/doctors/availability")
 async def set_availability(data: AvailabilityRequest, current_user: dict = Depends(get_current_user)):
     if current_user['role'] != UserRole.DOCTOR:
         raise HTTPException(status_code=403, detail="Non autorizzato")
+    try:
+        availability.mask_from_slots(data.time_slots)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     item = {'PK': f"AVAIL#{current_user['user_id']}#{data.date}", 'SK': 'SLOTS', 'doctor_id': current_user['user_id'], 'date': data.date, 'time_slots': data.time_slots, 'is_available': data.is_available}
-    table.put_item(Item=item)
+    await run_io(table.put_item, Item=item)
+    await availability.set_offered(table, current_user['user_id'], data.date, data.time_slots)
     return {"message": "Disponibilità salvata"}
 
+# --- DISPONIBILITÀ IN BLOCCO (modelli per giorno della settimana, vedi bulk.py) ---
+AVAILABILITY_BULK_MAX_DAYS = 92
+
+@app.post("/api/doctors/availability/bulk")
+async def set_availability_bulk(data: BulkAvailabilityRequest, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Non autorizzato")
+    try:
+        start_day, end_day = date_type.fromisoformat(data.start_date), date_type.fromisoformat(data.end_date)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Date non valide (formato YYYY-MM-DD)")
+    n_days = (end_day - start_day).days + 1
+    if not 1 <= n_days <= AVAILABILITY_BULK_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Intervallo non valido (massimo {AVAILABILITY_BULK_MAX_DAYS} giorni)")
+    templates = {}
+    for template in data.templates:
+        if not 0 <= template.weekday <= 6 or template.weekday in templates:
+            raise HTTPException(status_code=400, detail=f"Giorno della settimana non valido o ripetuto: {template.weekday}")
+        try:
+            availability.mask_from_slots(template.time_slots)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        templates[template.weekday] = template.time_slots
+
+    # I giorni senza modello restano invariati
+    doctor_id = current_user['user_id']
+    days = [start_day + timedelta(days=i) for i in range(n_days)]
+    days = [(d.isoformat(), templates[d.weekday()]) for d in days if d.weekday() in templates]
+    try:
+        # Dati sorgente con BatchWriteItem, bitmap (che conservano i prenotati) con TransactWriteItems
+        await bulk.batch_write(table, [bulk.put_request({
+            'PK': f"AVAIL#{doctor_id}#{day}", 'SK': 'SLOTS', 'doctor_id': doctor_id, 'date': day,
+            'time_slots': slots, 'is_available': data.is_available
+        }) for day, slots in days])
+        failed = await bulk.transact_groups(table, [
+            [availability.offered_update(table.name, doctor_id, day, slots)] for day, slots in days
+        ])
+    except (ClientError, RuntimeError) as e:
+        print(f"ERRORE DB disponibilità in blocco: {e}")
+        raise HTTPException(status_code=500, detail="Errore Database")
+    if any(failed):
+        print(f"ERRORE DB disponibilità in blocco: {[f for f in failed if f]}")
+        raise HTTPException(status_code=500, detail="Errore Database")
+    return {"message": "Disponibilità salvata", "dates": [day for day, _ in days]}
+
 @app.post("/api/appointments")
 async def create_appointment(data: AppointmentRequest, current_user: dict = Depends(get_current_user)):
     if current_user['role'] != UserRole.PATIENT:
         raise HTTPException(status_code=403, detail="Solo pazienti")
     
-    # 1. Verifica slot
-    scan = table.scan(FilterExpression=Attr('doctor_id').eq(data.doctor_id) & Attr('date').eq(data.date) & Attr('time_slot').eq(data.time_slot) & Attr('SK').eq('APPT'))
-    active_appts = [a for a in scan['Items'] if a.get('status') != AppointmentStatus.CANCELLED]
-    
-    if len(active_appts) > 0:
-        raise HTTPException(status_code=400, detail="Slot occupato")
+    # 1. Verifica formato slot (l'occupazione la garantisce il lock, vedi booking.py)
+    try:
+        availability.slot_index(data.time_slot)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     # 2. Recupero dati Dottore
-    doc_res = table.get_item(Key={'PK': f"USER#{data.doctor_id}", 'SK': 'PROFILE'})
+    doc_res = await run_io(table.get_item, Key={'PK': f"USER#{data.doctor_id}", 'SK': 'PROFILE'})
     doctor_data = doc_res.get('Item', {})
-    doctor_email = doctor_data.get('email')
     
     doctor_name = f"Dr. {doctor_data.get('name', 'N/A')} {doctor_data.get('surname', 'N/A')}"
     doctor_spec = doctor_data.get('specialization', 'Generico')
@@ -255,47 +567,79 @@ async def create_appointment(data: AppointmentRequest, current_user: dict = Depe
         'reason': data.reason, 
         'created_at': datetime.now().isoformat()
     }
-    table.put_item(Item=item)
 
-    # 🔔 NOTIFICA SNS RICCA AL DOTTORE
-    if doctor_email:
-        try:
-            subj = f"Richiesta Appuntamento: {current_user['name']} {current_user['surname']}"
-            msg_text = (
-                f"Gentile Dr. {doctor_data.get('surname', '')},\n\n"
-                f"È stata richiesta una nuova prenotazione.\n"
-                f"------------------------------------------------\n"
-                f"PAZIENTE: {current_user['name']} {current_user['surname']}\n"
-                f"DATA: {data.date}\n"
-                f"ORA: {data.time_slot}\n"
-                f"MOTIVO: {data.reason}\n"
-                f"CONTATTO PAZIENTE: {current_user.get('phone', 'N/A')}\n"
-                f"------------------------------------------------\n\n"
-                f"Acceda alla Dashboard Medici per confermare o rifiutare la richiesta."
-            )
-            sns_client.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Message=msg_text,
-                Subject=subj,
-                MessageAttributes={'email': {'DataType': 'String', 'StringValue': doctor_email}}
-            )
-        except Exception as e:
-            print(f"Errore invio SNS Dottore: {e}")
+    # 3. Lock dello slot + appuntamento + notifica al dottore in un'unica transazione:
+    #    su prenotazioni concorrenti dello stesso slot ne vince esattamente una
+    event = notification_outbox.event_item(notifications.APPOINTMENT_REQUESTED, {'appointment_id': appt_id})
+    try:
+        await run_io(table.transact_write_items, TransactItems=[
+            booking.claim_lock(table.name, item),
+            {'Put': {'TableName': table.name, 'Item': indexes.with_index_keys(item), 'ConditionExpression': "attribute_not_exists(PK)"}},
+            {'Put': {'TableName': table.name, 'Item': event}},
+        ])
+    except ClientError as e:
+        if booking.cancellation_reasons(e)[:1] == ['ConditionalCheckFailed']:
+            raise HTTPException(status_code=400, detail="Slot occupato")
+        print(f"ERRORE DB prenotazione: {e}")
+        raise HTTPException(status_code=500, detail="Errore Database")
+    notification_outbox.wake()
+    deltas = stats.appointment_deltas(item, new_status=AppointmentStatus.PENDING)
+    await stats.apply(table, data.doctor_id, deltas)
+    await sync_calendar(item)
+    await event_hub.publish([item['patient_id'], item['doctor_id']], events.APPOINTMENT_CREATED, item, stats=deltas)
 
     return item
 
 @app.get("/api/appointments/my")
 async def get_my_appointments(current_user: dict = Depends(get_current_user)):
     user_id = current_user['user_id']
-    role = current_user['role']
-    filter_exp = Attr('patient_id').eq(user_id) if role == UserRole.PATIENT else Attr('doctor_id').eq(user_id)
-    filter_exp = filter_exp & Attr('status').ne(AppointmentStatus.CANCELLED)
-    response = table.scan(FilterExpression=filter_exp & Attr('SK').eq('APPT'))
-    return response['Items']
+    if current_user['role'] == UserRole.PATIENT:
+        appts = await run_io(indexes.appointments_for_patient, table, user_id)
+    else:
+        appts = await run_io(indexes.appointments_for_doctor, table, user_id)
+    return [a for a in appts if a.get('status') != AppointmentStatus.CANCELLED]
+
+def history_owner(current_user: dict) -> str:
+    return 'patient_id' if current_user['role'] == UserRole.PATIENT else 'doctor_id'
+
+def appointments_query(current_user: dict, descending: bool) -> dict:
+    query = indexes.history_query(history_owner(current_user), current_user['user_id'], "APPT#", descending)
+    query['FilterExpression'] = Attr('status').ne(AppointmentStatus.CANCELLED)
+    return query
+
+@app.get("/api/appointments/my/page")
+async def get_my_appointments_page(
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE), cursor: Optional[str] = None, descending: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    return await read_page(limit, cursor, **appointments_query(current_user, descending))
+
+# Storico archiviato su S3 (appuntamenti chiusi da più di ARCHIVE_AFTER_DAYS, vedi archive.py)
+@app.get("/api/appointments/my/archive")
+async def get_my_archived_appointments(
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE), cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if not S3_BUCKET_NAME:
+        return {'items': [], 'next_cursor': None}
+    try:
+        items, next_cursor = await archive.history_page(table, s3_client, S3_BUCKET_NAME, current_user['user_id'], limit, cursor,
+                                                        hidden_statuses=(AppointmentStatus.CANCELLED.value,))
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Cursore non valido")
+    except ClientError as e:
+        if cursor and e.response['Error']['Code'] == 'ValidationException':
+            raise HTTPException(status_code=400, detail="Cursore non valido")
+        raise
+    return {'items': items, 'next_cursor': next_cursor}
+
+@app.get("/api/appointments/my/stream")
+async def stream_my_appointments(descending: bool = False, current_user: dict = Depends(get_current_user)):
+    return ndjson_response(stream_items(**appointments_query(current_user, descending)))
 
 @app.delete("/api/appointments/{appointment_id}")
 async def delete_appointment(appointment_id: str, current_user: dict = Depends(get_current_user)):
-    res = table.get_item(Key={'PK': f"APPT#{appointment_id}", 'SK': 'APPT'})
+    res = await run_io(table.get_item, Key={'PK': f"APPT#{appointment_id}", 'SK': 'APPT'})
     appt = res.get('Item')
     
     if not appt:
@@ -307,14 +651,59 @@ async def delete_appointment(appointment_id: str, current_user: dict = Depends(g
     if not (is_patient or is_doctor):
         raise HTTPException(status_code=403, detail="Non autorizzato")
 
-    table.update_item(
-        Key={'PK': f"APPT#{appointment_id}", 'SK': 'APPT'},
-        UpdateExpression="set #s = :s",
-        ExpressionAttributeNames={'#s': 'status'},
-        ExpressionAttributeValues={':s': AppointmentStatus.CANCELLED},
-    )
+    await change_appointment_status(appt, AppointmentStatus.CANCELLED)
     return {"message": "Appuntamento cancellato"}
 
+def status_change_ops(appt: dict, new_status: str) -> list:
+    """Update dello stato (primo elemento) ed eventuale operazione sul lock dello slot."""
+    update = {
+        'TableName': table.name,
+        'Key': {'PK': appt['PK'], 'SK': 'APPT'},
+        'UpdateExpression': "set #s = :s",
+        # Lo stato letto non deve essere cambiato nel frattempo
+        'ConditionExpression': "#s = :old",
+        'ExpressionAttributeNames': {'#s': 'status'},
+        'ExpressionAttributeValues': {':s': new_status, ':old': appt['status']},
+    }
+    was_holding = appt['status'] in booking.HOLDING_STATUSES
+    holds = new_status in booking.HOLDING_STATUSES
+    ops = [{'Update': update}]
+    if was_holding and not holds:
+        ops.append(booking.release_lock(table.name, appt))
+    elif holds and not was_holding:
+        ops.append(booking.claim_lock(table.name, appt, reclaim=True))
+    return ops
+
+async def change_appointment_status(appt: dict, new_status: str) -> dict:
+    """Cambia stato e lock dello slot insieme: rifiuto/cancellazione liberano lo slot."""
+    ops = status_change_ops(appt, new_status)
+    try:
+        if len(ops) > 1:
+            await run_io(table.transact_write_items, TransactItems=ops)
+        else:
+            update = dict(ops[0]['Update'])
+            update.pop('TableName')
+            await run_io(table.update_item, **update)
+    except ClientError as e:
+        reasons = booking.cancellation_reasons(e)
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException' or reasons[:1] == ['ConditionalCheckFailed']:
+            raise HTTPException(status_code=409, detail="Appuntamento modificato da un'altra richiesta, riprovare")
+        if reasons[1:2] == ['ConditionalCheckFailed']:
+            raise HTTPException(status_code=400, detail="Slot occupato")
+        print(f"ERRORE DB: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    updated = {**appt, 'status': new_status}
+    deltas = stats.appointment_deltas(appt, appt['status'], new_status)
+    await stats.apply(table, appt['doctor_id'], deltas)
+    await sync_calendar(updated)
+    await publish_status(updated, deltas)
+    return updated
+
+async def publish_status(appt: dict, deltas: Optional[Counter] = None):
+    await event_hub.publish([appt['patient_id'], appt['doctor_id']], events.APPOINTMENT_UPDATED,
+                            {'appointment_id': appt['appointment_id'], 'status': appt['status']}, stats=deltas)
+
 # 🔥 AGGIORNAMENTO STATO + NOTIFICA PAZIENTE (Aggiornato Catania) 🔥
 @app.api_route("/api/appointments/{appointment_id}/status", methods=["POST", "PUT", "PATCH"])
 async def universal_status_update(
@@ -333,142 +722,282 @@ async def universal_status_update(
     
     if not final_status:
          raise HTTPException(status_code=422, detail="Parametro 'status' mancante")
-
+    # Lo stato guida lock dello slot, calendario e statistiche: solo valori noti
     try:
-        updated_res = table.update_item(
-            Key={'PK': f"APPT#{appointment_id}", 'SK': 'APPT'},
-            UpdateExpression="set #s = :s",
-            ExpressionAttributeNames={'#s': 'status'},
-            ExpressionAttributeValues={':s': final_status},
-            ReturnValues="ALL_NEW"
-        )
-        
-        appointment = updated_res.get('Attributes')
-
-        # 🔔 NOTIFICA SNS AL PAZIENTE (Solo se CONFERMATO)
-        if final_status == AppointmentStatus.CONFIRMED and appointment:
-            patient_id = appointment['patient_id']
-            pat_res = table.get_item(Key={'PK': f"USER#{patient_id}", 'SK': 'PROFILE'})
-            patient_data = pat_res.get('Item', {})
-            patient_email = patient_data.get('email')
-
-            if patient_email:
-                subj = "CONFERMA PRENOTAZIONE - Clinica San Marco"
-                msg_text = (
-                    f"Gentile {patient_data.get('name', 'Paziente')},\n\n"
-                    f"Siamo lieti di confermare il tuo appuntamento.\n"
-                    f"------------------------------------------------\n"
-                    f"MEDICO: {appointment.get('doctor_name')}\n"
-                    f"SPECIALIZZAZIONE: {appointment.get('doctor_specialization', 'Specialistica')}\n"
-                    f"QUANDO: {appointment.get('date')} alle ore {appointment.get('time_slot')}\n"
-                    f"DOVE: Clinica San Marco, Via Etnea 200, Catania\n"
-                    f"------------------------------------------------\n\n"
-                    f"Si prega di presentarsi in accettazione 10 minuti prima dell'orario indicato.\n"
-                    f"Cordiali Saluti,\n"
-                    f"Lo Staff di Clinica San Marco"
-                )
-                sns_client.publish(
-                    TopicArn=SNS_TOPIC_ARN,
-                    Message=msg_text,
-                    Subject=subj,
-                    MessageAttributes={'email': {'DataType': 'String', 'StringValue': patient_email}}
-                )
+        final_status = AppointmentStatus(final_status).value
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Stato non valido: usare {', '.join(s.value for s in AppointmentStatus)}")
 
-    except Exception as e:
-        print(f"ERRORE DB/SNS: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    res = await run_io(table.get_item, Key={'PK': f"APPT#{appointment_id}", 'SK': 'APPT'})
+    appointment = res.get('Item')
+    if not appointment:
+        raise HTTPException(status_code=404, detail="Appuntamento non trovato")
+
+    await change_appointment_status(appointment, final_status)
+
+    # 🔔 NOTIFICA AL PAZIENTE (Solo se CONFERMATO)
+    if final_status == AppointmentStatus.CONFIRMED:
+        await notify(notifications.APPOINTMENT_CONFIRMED, {'appointment_id': appointment_id})
 
     return {"message": "Stato aggiornato", "status": final_status}
 
+# --- CONFERMA / RIFIUTO IN BLOCCO ---
+BULK_STATUS_MAX = 100
+BULK_STATUSES = (AppointmentStatus.CONFIRMED, AppointmentStatus.REJECTED)
+
+@app.post("/api/appointments/status/bulk")
+async def bulk_status_update(data: BulkStatusRequest, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Solo i dottori possono gestire appuntamenti")
+    if data.status not in BULK_STATUSES:
+        raise HTTPException(status_code=400, detail="Stato non ammesso: usare confirmed o rejected")
+    appointment_ids = list(dict.fromkeys(data.appointment_ids))
+    if not 1 <= len(appointment_ids) <= BULK_STATUS_MAX:
+        raise HTTPException(status_code=400, detail=f"Indicare da 1 a {BULK_STATUS_MAX} appuntamenti")
+
+    # 1. Lettura con BatchGetItem
+    try:
+        found = await bulk.batch_get(table, [{'PK': f"APPT#{i}", 'SK': 'APPT'} for i in appointment_ids])
+    except (ClientError, RuntimeError) as e:
+        print(f"ERRORE DB: {e}")
+        raise HTTPException(status_code=500, detail="Errore Database")
+    by_id = {a['appointment_id']: a for a in found}
+
+    results, changes = {}, []
+    for appointment_id in appointment_ids:
+        appt = by_id.get(appointment_id)
+        if not appt:
+            results[appointment_id] = "not_found"
+        elif appt['doctor_id'] != current_user['user_id']:
+            results[appointment_id] = "forbidden"
+        elif appt['status'] == data.status:
+            results[appointment_id] = "unchanged"
+        else:
+            changes.append(appt)
+
+    # 2. Stato + lock di ogni appuntamento nella stessa transazione, più appuntamenti per transazione
+    try:
+        failures = await bulk.transact_groups(table, [status_change_ops(a, data.status) for a in changes])
+    except ClientError as e:
+        print(f"ERRORE DB: {e}")
+        raise HTTPException(status_code=500, detail="Errore Database")
+    updated = []
+    for appt, codes in zip(changes, failures):
+        if codes is None:
+            results[appt['appointment_id']] = "updated"
+            updated.append({**appt, 'status': data.status})
+        elif codes[:1] == ['ConditionalCheckFailed']:
+            results[appt['appointment_id']] = "conflict"
+        elif codes[1:2] == ['ConditionalCheckFailed']:
+            results[appt['appointment_id']] = "slot_taken"
+        else:
+            results[appt['appointment_id']] = "error"
+
+    # Contatori: un solo ADD con le variazioni di tutti gli appuntamenti aggiornati
+    deltas = Counter()
+    for appt in updated:
+        stats.appointment_deltas(appt, by_id[appt['appointment_id']]['status'], data.status, deltas)
+    await stats.apply(table, current_user['user_id'], deltas)
+
+    await sync_calendar_many(updated)
+    await asyncio.gather(*[publish_status(appt, stats.appointment_deltas(appt, by_id[appt['appointment_id']]['status'], data.status))
+                           for appt in updated])
+
+    # 3. 🔔 Una sola notifica per paziente con tutte le sue conferme
+    if data.status == AppointmentStatus.CONFIRMED and updated:
+        by_patient = {}
+        for appt in updated:
+            by_patient.setdefault(appt['patient_id'], []).append(appt['appointment_id'])
+        try:
+            await bulk.batch_write(table, [bulk.put_request(notification_outbox.event_item(
+                notifications.APPOINTMENTS_CONFIRMED, {'appointment_ids': ids}
+            )) for ids in by_patient.values()])
+            notification_outbox.wake()
+        except Exception as e:
+            print(f"Errore accodamento notifiche in blocco: {e}")
+
+    return {"message": "Stato aggiornato", "status": data.status, "updated": len(updated), "results": results}
+
 # --- UPLOAD REFERTO INTELLIGENTE + NOTIFICA RICCA (Aggiornato Catania) ---
-@app.post("/api/reports/upload")
-async def upload_report(
-    file: UploadFile, appointment_id: str, exam_type: str, exam_date: str,
-    notes: Optional[str] = None, current_user: dict = Depends(get_current_user)
-):
+async def load_appointment_for_report(appointment_id: str, current_user: dict) -> dict:
     if current_user['role'] != UserRole.DOCTOR:
         raise HTTPException(status_code=403, detail="Non autorizzato")
 
-    res = table.get_item(Key={'PK': f"APPT#{appointment_id}", 'SK': 'APPT'})
+    res = await run_io(table.get_item, Key={'PK': f"APPT#{appointment_id}", 'SK': 'APPT'})
     appointment = res.get('Item')
     if not appointment:
         raise HTTPException(status_code=404, detail="Appuntamento non trovato")
-
-    existing_report_scan = table.scan(
-        FilterExpression=Attr('appointment_id').eq(appointment_id) & Attr('SK').eq('METADATA')
-    )
-    existing_reports = existing_report_scan.get('Items', [])
-    
-    is_update = False
-    
-    if len(existing_reports) > 0:
-        old_report = existing_reports[0]
-        report_id = old_report['report_id']
-        s3_key = old_report['s3_key'] 
-        is_update = True
-    else:
-        report_id = str(uuid.uuid4())
-        s3_key = f"reports/{appointment['patient_id']}/{report_id}_{file.filename}"
-        is_update = False
-
-    try:
-        await file.seek(0)
-        s3_client.upload_fileobj(file.file, S3_BUCKET_NAME, s3_key, ExtraArgs={'ContentType': file.content_type})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Errore S3")
-
+    return appointment
+
+async def resolve_report_target(appointment: dict, filename: str):
+    """(report_id, s3_key, is_update): un nuovo upload per lo stesso appuntamento sovrascrive il referto."""
+    old_report = await run_io(indexes.report_for_appointment, table, appointment['appointment_id'])
+    if old_report:
+        return old_report['report_id'], old_report['s3_key'], True
+    report_id = str(uuid.uuid4())
+    return report_id, f"reports/{appointment['patient_id']}/{report_id}_{filename}", False
+
+async def save_report(report_id: str, appointment: dict, doctor_id: str, exam_type: str, exam_date: str,
+                      s3_key: str, filename: str, notes: Optional[str], is_update: bool):
     item = {
         'PK': f"REPORT#{report_id}", 'SK': 'METADATA',
         'report_id': report_id, 
-        'appointment_id': appointment_id,
+        'appointment_id': appointment['appointment_id'],
         'patient_id': appointment['patient_id'], 
-        'doctor_id': current_user['user_id'],
+        'doctor_id': doctor_id,
         'exam_type': exam_type, 
         'exam_date': exam_date, 
         's3_key': s3_key,
-        'original_filename': file.filename, 
+        'original_filename': filename, 
         'notes': notes, 
         'upload_date': datetime.now().isoformat(),
-        'last_updated': datetime.now().isoformat()
+        'last_updated': datetime.now().isoformat(),
+        # Anche su un nuovo upload (stessa s3_key) l'anteprima va rigenerata
+        'preview_status': previews.PENDING
     }
-    table.put_item(Item=item)
-
-    # 🔔 NOTIFICA SNS RICCA AL PAZIENTE (Solo se NUOVO)
+    await run_io(table.put_item, Item=indexes.with_index_keys(item))
+    deltas = None if is_update else stats.report_deltas(item['upload_date'])
+    if deltas:
+        await stats.apply(table, doctor_id, deltas)
+    preview_pipeline.enqueue(report_id)
+    await publish_report(item, deltas)
+
+    # 🔔 NOTIFICA AL PAZIENTE (Solo se NUOVO)
     if not is_update:
-        try:
-            pat_res = table.get_item(Key={'PK': f"USER#{appointment['patient_id']}", 'SK': 'PROFILE'})
-            patient_data = pat_res.get('Item')
-            
-            if patient_data and patient_data.get('email'):
-                patient_email = patient_data['email']
-                doctor_surname = current_user.get('surname', 'Medico')
-                notes_text = f"NOTE MEDICO: {notes}\n" if notes else ""
-
-                subj = f"NUOVO REFERTO DISPONIBILE: {exam_type}"
-                msg_text = (
-                    f"Gentile {patient_data.get('name', 'Paziente')},\n\n"
-                    f"Il Dr. {doctor_surname} ha appena caricato un nuovo referto medico.\n"
-                    f"------------------------------------------------\n"
-                    f"TIPOLOGIA ESAME: {exam_type}\n"
-                    f"DATA ESECUZIONE: {exam_date}\n"
-                    f"{notes_text}"
-                    f"------------------------------------------------\n\n"
-                    f"Il documento PDF è pronto per il download.\n"
-                    f"Accedi alla tua Area Riservata per scaricarlo in sicurezza.\n\n"
-                    f"Clinica San Marco - Servizio Referti Digitali"
-                )
-
-                sns_client.publish(
-                    TopicArn=SNS_TOPIC_ARN,
-                    Message=msg_text,
-                    Subject=subj,
-                    MessageAttributes={'email': {'DataType': 'String', 'StringValue': patient_email}}
-                )
-        except Exception as e:
-            print(f"Errore notifica Referto: {e}")
+        await notify(notifications.REPORT_UPLOADED, {'report_id': report_id})
 
+async def publish_report(item: dict, deltas: Optional[Counter] = None):
+    # Stessi campi di /api/reports/my; senza nome del medico il delta parte comunque
+    report = dict(item)
+    try:
+        await add_doctor_names([report], {})
+    except Exception as e:
+        print(f"Errore nome medico per l'evento referto {item['report_id']}: {e}")
+    await event_hub.publish([item['patient_id'], item['doctor_id']], events.REPORT_SAVED, report, stats=deltas)
+
+@app.post("/api/reports/upload")
+async def upload_report(
+    file: UploadFile, appointment_id: str, exam_type: str, exam_date: str,
+    notes: Optional[str] = None, current_user: dict = Depends(get_current_user)
+):
+    appointment = await load_appointment_for_report(appointment_id, current_user)
+    if file.size is not None and file.size > uploads.REPORT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="File troppo grande")
+
+    report_id, s3_key, is_update = await resolve_report_target(appointment, file.filename)
+
+    try:
+        await file.seek(0)
+        await run_io(s3_client.upload_fileobj, file.file, S3_BUCKET_NAME, s3_key, ExtraArgs={'ContentType': file.content_type})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Errore S3")
+
+    await save_report(report_id, appointment, current_user['user_id'], exam_type, exam_date,
+                      s3_key, file.filename, notes, is_update)
     return {"message": "Referto aggiornato" if is_update else "Referto caricato"}
 
+# --- UPLOAD REFERTO A BLOCCHI (initiate -> parts -> complete, vedi uploads.py) ---
+async def load_upload_session(upload_id: str, current_user: dict) -> dict:
+    session = await uploads.get_session(table, upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Sessione di upload non trovata o scaduta")
+    if session['owner_id'] != current_user['user_id']:
+        raise HTTPException(status_code=403, detail="Non autorizzato")
+    return session
+
+def upload_status(session: dict) -> dict:
+    total_parts = uploads.part_count(session)
+    received = sorted(int(n) for n in session['parts'])
+    return {
+        "upload_id": session['upload_id'],
+        "status": session['status'],
+        "size": int(session['size']),
+        "part_size": int(session['part_size']),
+        "part_count": total_parts,
+        "received_parts": received,
+        "missing_parts": [n for n in range(1, total_parts + 1) if n not in set(received)],
+        "expires_at": int(session['expires_at']),
+    }
+
+@app.post("/api/reports/uploads")
+async def initiate_report_upload(data: UploadInitRequest, current_user: dict = Depends(get_current_user)):
+    appointment = await load_appointment_for_report(data.appointment_id, current_user)
+    if data.size <= 0:
+        raise HTTPException(status_code=400, detail="Dimensione file non valida")
+    if data.size > uploads.REPORT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="File troppo grande")
+
+    report_id, s3_key, is_update = await resolve_report_target(appointment, data.filename)
+    meta = {
+        'exam_type': data.exam_type, 'exam_date': data.exam_date, 'notes': data.notes,
+        'original_filename': data.filename, 'content_type': data.content_type, 'size': data.size,
+    }
+    try:
+        session = await uploads.create_session(table, s3_client, S3_BUCKET_NAME, current_user['user_id'],
+                                               appointment, report_id, s3_key, is_update, meta)
+    except ClientError:
+        raise HTTPException(status_code=500, detail="Errore S3")
+    return upload_status(session)
+
+@app.get("/api/reports/uploads/{upload_id}")
+async def get_report_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
+    return upload_status(await load_upload_session(upload_id, current_user))
+
+@app.put("/api/reports/uploads/{upload_id}/parts/{part_number}")
+async def upload_report_part(
+    upload_id: str, part_number: int, request: Request,
+    content_md5: Optional[str] = Header(None), current_user: dict = Depends(get_current_user)
+):
+    session = await load_upload_session(upload_id, current_user)
+    if not 1 <= part_number <= uploads.part_count(session):
+        raise HTTPException(status_code=400, detail="Numero blocco non valido")
+
+    # Il blocco resta in memoria (al massimo UPLOAD_PART_SIZE byte)
+    expected = uploads.expected_part_size(session, part_number)
+    data = bytearray()
+    async for chunk in request.stream():
+        data.extend(chunk)
+        if len(data) > expected:
+            raise HTTPException(status_code=413, detail="Blocco troppo grande")
+    if len(data) != expected:
+        raise HTTPException(status_code=400, detail=f"Dimensione blocco errata: attesi {expected} byte")
+    if content_md5 and content_md5 != uploads.content_md5(bytes(data)):
+        raise HTTPException(status_code=400, detail="Checksum blocco non valido")
+
+    try:
+        part = await uploads.upload_part(table, s3_client, S3_BUCKET_NAME, session, part_number, bytes(data))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise HTTPException(status_code=409, detail="Upload già completato")
+        raise HTTPException(status_code=500, detail="Errore S3")
+    return {"part_number": part_number, "etag": part['etag'], "md5": part['md5']}
+
+@app.post("/api/reports/uploads/{upload_id}/complete")
+async def complete_report_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
+    session = await load_upload_session(upload_id, current_user)
+    status = upload_status(session)
+    if status['missing_parts']:
+        raise HTTPException(status_code=400, detail=f"Blocchi mancanti: {status['missing_parts']}")
+
+    try:
+        await uploads.complete_session(table, s3_client, S3_BUCKET_NAME, session)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise HTTPException(status_code=409, detail="Upload già completato")
+        raise HTTPException(status_code=500, detail="Errore S3")
+
+    appointment = {'appointment_id': session['appointment_ref'], 'patient_id': session['patient_ref']}
+    await save_report(session['report_id'], appointment, current_user['user_id'], session['exam_type'],
+                      session['exam_date'], session['s3_key'], session['original_filename'],
+                      session.get('notes'), session['is_update'])
+    return {"message": "Referto aggiornato" if session['is_update'] else "Referto caricato", "report_id": session['report_id']}
+
+@app.delete("/api/reports/uploads/{upload_id}")
+async def abort_report_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
+    session = await load_upload_session(upload_id, current_user)
+    await uploads.abort_session(table, s3_client, S3_BUCKET_NAME, session)
+    return {"message": "Upload annullato"}
+
 @app.patch("/api/reports/{report_id}")
 async def update_report_notes(
     report_id: str, 
@@ -478,7 +1007,7 @@ async def update_report_notes(
     if current_user['role'] != UserRole.DOCTOR:
         raise HTTPException(status_code=403, detail="Non autorizzato")
 
-    response = table.get_item(Key={'PK': f"REPORT#{report_id}", 'SK': 'METADATA'})
+    response = await run_io(table.get_item, Key={'PK': f"REPORT#{report_id}", 'SK': 'METADATA'})
     report = response.get('Item')
 
     if not report:
@@ -488,7 +1017,7 @@ async def update_report_notes(
         raise HTTPException(status_code=403, detail="Non puoi modificare referti altrui")
 
     try:
-        table.update_item(
+        await run_io(table.update_item,
             Key={'PK': f"REPORT#{report_id}", 'SK': 'METADATA'},
             UpdateExpression="set #n = :n, #u = :u",
             ExpressionAttributeNames={'#n': 'notes', '#u': 'last_updated'},
@@ -507,35 +1036,237 @@ async def update_report_notes(
 async def get_my_reports(current_user: dict = Depends(get_current_user)):
     user_id = current_user['user_id']
     if current_user['role'] == UserRole.PATIENT:
-        res = table.scan(FilterExpression=Attr('patient_id').eq(user_id) & Attr('SK').eq('METADATA'))
+        reports = await run_io(indexes.reports_for_patient, table, user_id)
     else:
-        res = table.scan(FilterExpression=Attr('doctor_id').eq(user_id) & Attr('SK').eq('METADATA'))
-    
-    reports = res['Items']
+        reports = await run_io(indexes.reports_for_doctor, table, user_id)
+    return await add_doctor_names(reports, {})
+
+async def add_doctor_names(reports: list, doctors: dict) -> list:
+    # `doctors` fa da cache dei profili, condivisa tra le pagine di uno stream;
+    # i profili mancanti arrivano con una sola batch_get
+    missing = {r['doctor_id'] for r in reports} - doctors.keys()
+    if missing:
+        found = await bulk.batch_get(table, [{'PK': f"USER#{d}", 'SK': 'PROFILE'} for d in missing])
+        doctors.update(dict.fromkeys(missing))
+        doctors.update({doc['user_id']: doc for doc in found})
     for r in reports:
-        doc_res = table.get_item(Key={'PK': f"USER#{r['doctor_id']}", 'SK': 'PROFILE'})
-        if 'Item' in doc_res:
-             r['doctor_name'] = f"Dr. {doc_res['Item'].get('surname')}"
+        if doctors[r['doctor_id']]:
+             r['doctor_name'] = f"Dr. {doctors[r['doctor_id']].get('surname')}"
     return reports
 
+@app.get("/api/reports/my/page")
+async def get_my_reports_page(
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE), cursor: Optional[str] = None, descending: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    query = indexes.history_query(history_owner(current_user), current_user['user_id'], "REPORT#", descending)
+    page = await read_page(limit, cursor, **query)
+    page['items'] = await add_doctor_names(page['items'], {})
+    return page
+
+@app.get("/api/reports/my/stream")
+async def stream_my_reports(descending: bool = False, current_user: dict = Depends(get_current_user)):
+    query = indexes.history_query(history_owner(current_user), current_user['user_id'], "REPORT#", descending)
+    doctors = {}
+    return ndjson_response(stream_items(lambda page: add_doctor_names(page, doctors), **query))
+
 @app.get("/api/reports/{report_id}/download")
-async def download_report(report_id: str, current_user: dict = Depends(get_current_user)):
-    res = table.get_item(Key={'PK': f"REPORT#{report_id}", 'SK': 'METADATA'})
+async def download_report(
+    report_id: str,
+    request: Request,
+    redirect: Optional[bool] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    res = await run_io(table.get_item, Key={'PK': f"REPORT#{report_id}", 'SK': 'METADATA'})
     report = res.get('Item')
     if not report:
         raise HTTPException(status_code=404, detail="Referto non trovato")
+    disposition = f"attachment; filename={report['original_filename']}"
+
+    # Modalità redirect: i byte arrivano al client direttamente da S3
+    if redirect if redirect is not None else DOWNLOAD_REDIRECT:
+        url = await run_io(s3_client.generate_presigned_url, 'get_object',
+            Params={'Bucket': S3_BUCKET_NAME, 'Key': report['s3_key'], 'ResponseContentDisposition': disposition},
+            ExpiresIn=PRESIGNED_URL_EXPIRES
+        )
+        return RedirectResponse(url, status_code=307)
+
+    # Range / If-None-Match vengono girati a S3, che risponde con 206 / 304
+    get_args = {'Bucket': S3_BUCKET_NAME, 'Key': report['s3_key']}
+    if request.headers.get('range'):
+        get_args['Range'] = request.headers['range']
+    if request.headers.get('if-none-match'):
+        get_args['IfNoneMatch'] = request.headers['if-none-match']
     try:
-        file_stream = io.BytesIO()
-        s3_client.download_fileobj(S3_BUCKET_NAME, report['s3_key'], file_stream)
-        file_stream.seek(0)
-        return StreamingResponse(file_stream, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename={report['original_filename']}"})
-    except Exception:
+        obj = await run_io(s3_client.get_object, **get_args)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('304', 'NotModified'):
+            return Response(status_code=304, headers={'ETag': request.headers['if-none-match']})
+        if code == 'InvalidRange':
+            size = e.response['Error'].get('ActualObjectSize', '*')
+            return Response(status_code=416, headers={'Content-Range': f"bytes */{size}"})
+        if code in ('NoSuchKey', '404'):
+            raise HTTPException(status_code=404, detail="File referto non trovato")
         raise HTTPException(status_code=500, detail="Errore Download")
 
+    headers = {
+        'Content-Disposition': disposition,
+        'Content-Length': str(obj['ContentLength']),
+        'ETag': obj['ETag'],
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache',
+    }
+    if obj.get('ContentRange'):
+        headers['Content-Range'] = obj['ContentRange']
+    body = obj['Body']
+
+    async def stream_body():
+        # Un blocco alla volta: memoria limitata e primo byte subito
+        try:
+            while True:
+                chunk = await run_io(body.read, DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    return StreamingResponse(
+        stream_body(),
+        status_code=206 if obj.get('ContentRange') else 200,
+        media_type=obj.get('ContentType') or "application/pdf",
+        headers=headers
+    )
+
+# --- ANTEPRIMA REFERTO (JPEG della prima pagina, vedi previews.py) ---
+PREVIEW_CACHE_SECONDS = 365 * 24 * 3600
+
+@app.get("/api/reports/{report_id}/preview")
+async def get_report_preview(
+    report_id: str,
+    request: Request,
+    v: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    res = await run_io(table.get_item, Key={'PK': f"REPORT#{report_id}", 'SK': 'METADATA'})
+    report = res.get('Item')
+    if not report:
+        raise HTTPException(status_code=404, detail="Referto non trovato")
+    status = report.get('preview_status')
+    if status in (previews.UNSUPPORTED, previews.FAILED):
+        raise HTTPException(status_code=404, detail="Anteprima non disponibile per questo referto")
+    if status != previews.READY:
+        # Referti precedenti alla pipeline o job perso in un riavvio: si riaccoda
+        preview_pipeline.enqueue(report_id)
+        raise HTTPException(status_code=404, detail="Anteprima in preparazione", headers={'Retry-After': '5'})
+
+    # URL con la versione corrente: immutabile; senza versione si rivalida con l'ETag
+    version = report['preview_version']
+    headers = {
+        'ETag': f'"{version}"',
+        'Cache-Control': f"private, max-age={PREVIEW_CACHE_SECONDS}, immutable" if v == version else "private, no-cache",
+    }
+    if etag_matches(request.headers.get('if-none-match'), headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    try:
+        obj = await run_io(s3_client.get_object, Bucket=S3_BUCKET_NAME, Key=report['preview_key'])
+        body = await run_io(obj['Body'].read)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            raise HTTPException(status_code=404, detail="Anteprima non trovata")
+        raise HTTPException(status_code=500, detail="Errore Download")
+    return Response(body, media_type="image/jpeg", headers=headers)
+
+# ============================================
+# DASHBOARD (UNA RICHIESTA PER IL CARICAMENTO DELLA PAGINA)
+# ============================================
+# Profilo, appuntamenti, referti recenti e conteggi in una risposta: token
+# verificato una volta e letture indipendenti in parallelo, quindi la
+# latenza è circa quella della query più lenta invece della somma.
+DASHBOARD_REPORTS_MAX = 50
+
+def parse_day(value: Optional[str], name: str) -> Optional[str]:
+    if value is None:
+        return None
+    try:
+        return date_type.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"{name} non valida (formato YYYY-MM-DD)")
+
+async def appointment_stats(current_user: dict) -> list:
+    # Solo stato e data di tutti gli appuntamenti, per i conteggi
+    query = indexes.appointments_window_query(history_owner(current_user), current_user['user_id'])
+    query.update(ProjectionExpression="#s, #d", ExpressionAttributeNames={'#s': 'status', '#d': 'date'})
+    return [item async for item in stream_items(**query)]
+
+@app.get("/api/dashboard", response_model=DashboardResponse)
+async def get_dashboard(
+    date_from: Optional[str] = None, date_to: Optional[str] = None,
+    reports_limit: int = Query(5, ge=0, le=DASHBOARD_REPORTS_MAX),
+    current_user: dict = Depends(get_current_user)
+):
+    date_from, date_to = parse_day(date_from, "date_from"), parse_day(date_to, "date_to")
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="Intervallo non valido")
+    owner, user_id = history_owner(current_user), current_user['user_id']
+    windowed = bool(date_from or date_to)
+
+    async def appointments():
+        query = indexes.appointments_window_query(owner, user_id, date_from, date_to)
+        query['FilterExpression'] = Attr('status').ne(AppointmentStatus.CANCELLED)
+        return [item async for item in stream_items(**query)]
+
+    async def recent_reports():
+        if reports_limit == 0:
+            return []
+        return (await read_page(reports_limit, None, **indexes.history_query(owner, user_id, "REPORT#", True)))['items']
+
+    reads = [
+        load_profile(user_id),
+        appointments(),
+        recent_reports(),
+        pagination.count_items(table, **indexes.history_query(owner, user_id, "REPORT#")),
+    ]
+    if windowed:
+        reads.append(appointment_stats(current_user))
+    profile, appts, reports, reports_count, *window = await asyncio.gather(*reads)
+    reports = await add_doctor_names(reports, {})
+
+    # Senza finestra i conteggi si calcolano sugli stessi appuntamenti
+    today = date_type.today().isoformat()
+    active = [a for a in (window[0] if windowed else appts) if a.get('status') != AppointmentStatus.CANCELLED]
+    by_status = {}
+    for a in active:
+        by_status[a['status']] = by_status.get(a['status'], 0) + 1
+    return {
+        'profile': profile,
+        'appointments': appts,
+        'reports': reports,
+        'counts': {
+            'appointments': len(active),
+            'by_status': by_status,
+            'today': sum(1 for a in active if a.get('date') == today),
+            'upcoming': sum(1 for a in active if a.get('date', '') >= today),
+            'reports': reports_count,
+        },
+    }
+
+# --- EVENTI IN TEMPO REALE (SSE) ---
+@app.get("/api/events/stream")
+async def stream_events(current_user: dict = Depends(get_current_user)):
+    return StreamingResponse(event_hub.stream(current_user['user_id']), media_type="text/event-stream",
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.get("/health")
 async def health():
     return {"status": "ok", "cloud": "active", "version": "4.8.0"}
 
+@app.get("/ready")
+async def ready():
+    status = await readiness.status()
+    return JSONResponse(status_code=200 if status['ready'] else 503, content=status)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
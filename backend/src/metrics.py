@@ -0,0 +1,283 @@
+# ============================================
+# METRICHE DI PERFORMANCE (FORMATO PROMETHEUS)
+# ============================================
+# Due livelli di misura, esposti in formato testo Prometheus su /metrics:
+#
+#   richieste HTTP   latenza per route (template, non URL), metodo e status;
+#                    per route anche capacità DynamoDB e item letti/restituiti
+#   chiamate AWS     conteggio, errori e latenza per servizio e operazione;
+#                    per DynamoDB la capacità consumata (ReturnConsumedCapacity
+#                    aggiunto automaticamente) e ScannedCount vs Count, che
+#                    mette subito in evidenza gli endpoint che fanno scan
+#
+# Le chiamate AWS vengono misurate con gli eventi di botocore
+# (instrument_client), quindi valgono per client e resource senza wrapper.
+# run_io propaga il contesto della richiesta nei thread del pool: ogni
+# chiamata si somma anche alla RequestTrace della richiesta che l'ha fatta,
+# usata dal log delle richieste lente.
+#
+#   METRICS_SLOW_REQUEST_MS   soglia del log richieste lente (0 = disattivato)
+#
+# Le metriche sono per processo: con più worker ogni worker ha le sue.
+
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+METRICS_SLOW_REQUEST_MS = float(os.getenv("METRICS_SLOW_REQUEST_MS", "0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Operazioni DynamoDB che accettano ReturnConsumedCapacity
+CAPACITY_OPERATIONS = {
+    'GetItem', 'PutItem', 'UpdateItem', 'DeleteItem', 'Query', 'Scan',
+    'BatchGetItem', 'BatchWriteItem', 'TransactGetItems', 'TransactWriteItems',
+}
+
+
+class RequestTrace:
+    """Tempo e costo delle chiamate AWS fatte da una richiesta."""
+
+    def __init__(self):
+        self.calls = {}             # "servizio.Operazione" -> [numero, secondi]
+        self.capacity = 0.0
+        self.scanned = 0
+        self.returned = 0
+        self._lock = threading.Lock()
+
+    def add_call(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.calls.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    @property
+    def backend_seconds(self) -> float:
+        return sum(seconds for _, seconds in self.calls.values())
+
+    def breakdown(self) -> str:
+        calls = sorted(self.calls.items(), key=lambda kv: -kv[1][1])
+        parts = [f"{name} x{count} {seconds * 1000:.0f} ms" for name, (count, seconds) in calls]
+        return (f"backend {self.backend_seconds * 1000:.0f} ms [{', '.join(parts)}] "
+                f"capacità {self.capacity:g} - item letti {self.scanned} / restituiti {self.returned}")
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar('current_trace', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}       # (nome, etichette) -> Histogram
+        self._counters = {}         # (nome, etichette) -> valore (contatori e gauge)
+        self._help = {}
+
+    def observe(self, name: str, labels: dict, value: float, help: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help[name] = ('histogram', help)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, labels: dict, value: float, help: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help[name] = ('counter', help)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, labels: dict, value: float, help: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help[name] = ('gauge', help)
+            self._counters[key] = value
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {k: (list(h.counts), h.total, h.sum, h.buckets) for k, h in self._histograms.items()}
+            counters = dict(self._counters)
+            help_texts = dict(self._help)
+
+        lines = []
+        for name in sorted(help_texts):
+            kind, text = help_texts[name]
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'histogram':
+                for (metric, labels), (counts, total, value_sum, buckets) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets, counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}")
+                    lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {total}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(value_sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {total}")
+            else:
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels: tuple, **extra) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+registry = Registry()
+
+
+# ============================================
+# CHIAMATE AWS (eventi botocore)
+# ============================================
+def _consumed_units(parsed: dict) -> float:
+    consumed = parsed.get('ConsumedCapacity')
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return sum(float(c.get('CapacityUnits', 0)) for c in consumed or [])
+
+
+def _before_parameter_build(params, model, **kwargs):
+    if model.name in CAPACITY_OPERATIONS:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+
+def _before_call(context, **kwargs):
+    context['metrics_start'] = time.perf_counter()
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    start = context.get('metrics_start')
+    if start is None:
+        return
+    seconds = time.perf_counter() - start
+    service = model.service_model.service_name
+    labels = {'service': service, 'operation': model.name}
+    registry.observe('clinica_aws_call_duration_seconds', labels, seconds, "Latenza delle chiamate AWS")
+    if http_response.status_code >= 400:
+        registry.inc('clinica_aws_call_errors_total', labels, 1, "Chiamate AWS fallite")
+
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_call(f"{service}.{model.name}", seconds)
+    if service != 'dynamodb':
+        return
+
+    units = _consumed_units(parsed)
+    if units:
+        registry.inc('clinica_dynamodb_consumed_capacity_total', {'operation': model.name}, units,
+                     "Unità di capacità DynamoDB consumate")
+    scanned, returned = parsed.get('ScannedCount'), parsed.get('Count')
+    if scanned is not None:
+        registry.inc('clinica_dynamodb_items_scanned_total', {'operation': model.name}, scanned,
+                     "Item letti da Query/Scan (prima dei filtri)")
+        registry.inc('clinica_dynamodb_items_returned_total', {'operation': model.name}, returned or 0,
+                     "Item restituiti da Query/Scan (dopo i filtri)")
+    if trace is not None:
+        with trace._lock:
+            trace.capacity += units
+            trace.scanned += scanned or 0
+            trace.returned += returned or 0
+
+
+def _after_call_error(event_name, **kwargs):
+    # Errori di rete / timeout: nessuna risposta da misurare, solo il conteggio
+    _, service, operation = event_name.split('.', 2)
+    registry.inc('clinica_aws_call_errors_total', {'service': service, 'operation': operation}, 1,
+                 "Chiamate AWS fallite")
+
+
+def instrument_client(client):
+    """Registra le metriche sugli eventi di un client boto3 (anche resource.meta.client)."""
+    events = client.meta.events
+    events.register('before-parameter-build.dynamodb', _before_parameter_build)
+    events.register('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call_error)
+    return client
+
+
+# ============================================
+# RICHIESTE HTTP
+# ============================================
+def observe_request(method: str, route: str, status: int, seconds: float, trace: RequestTrace):
+    labels = {'method': method, 'route': route, 'status': str(status)}
+    registry.observe('clinica_http_request_duration_seconds', labels, seconds, "Latenza delle richieste HTTP")
+    route_labels = {'method': method, 'route': route}
+    registry.inc('clinica_http_backend_seconds_total', route_labels, trace.backend_seconds,
+                 "Tempo passato in chiamate AWS per route")
+    registry.inc('clinica_http_consumed_capacity_total', route_labels, trace.capacity,
+                 "Capacità DynamoDB consumata per route")
+    registry.inc('clinica_http_items_scanned_total', route_labels, trace.scanned,
+                 "Item DynamoDB letti per route")
+    registry.inc('clinica_http_items_returned_total', route_labels, trace.returned,
+                 "Item DynamoDB restituiti per route")
+
+    if METRICS_SLOW_REQUEST_MS and seconds * 1000 >= METRICS_SLOW_REQUEST_MS:
+        print(f"RICHIESTA LENTA {method} {route} {status} {seconds * 1000:.0f} ms - {trace.breakdown()}")
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: la richiesta si misura fino all'ultimo chunk del corpo.
+
+    A differenza di un middleware con call_next, la RequestTrace resta attiva
+    mentre una StreamingResponse produce il corpo, quindi le chiamate AWS
+    fatte durante lo streaming vanno alla route giusta.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        start = time.perf_counter()
+        status, end = 500, None
+
+        async def send_measured(message):
+            nonlocal status, end
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body' and not message.get('more_body', False):
+                end = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_measured)
+        finally:
+            current_trace.reset(token)
+            # Template della route (es. /api/reports/{report_id}/download), non l'URL
+            route = scope.get('route')
+            observe_request(scope['method'], route.path if route else "unmatched", status,
+                            (end or time.perf_counter()) - start, trace)
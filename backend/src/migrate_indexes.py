@@ -0,0 +1,188 @@
+# ============================================
+# BACKFILL INDICI (one-shot)
+# ============================================
+# Scrive `index_sk` su appuntamenti e referti creati prima degli indici
+# secondari, così compaiono in PatientIndex / DoctorIndex.
+#
+# Uso (dalla cartella backend/):
+#   python -m src.migrate_indexes --dry-run
+#   python -m src.migrate_indexes --segments 4
+#
+# Lo scan è parallelo per segmenti e idempotente: gli item già allineati
+# vengono saltati, quindi il comando si può rilanciare senza effetti.
+#
+# Con --calendars ricostruisce anche le bitmap del calendario (CAL#) per ogni
+# giorno che ha disponibilità o appuntamenti:
+#   python -m src.migrate_indexes --calendars
+#
+# Con --locks crea il lock di slot (LOCK#, vedi booking.py) per ogni
+# appuntamento attivo creato prima della prenotazione atomica; gli slot con
+# più appuntamenti attivi vengono segnalati come conflitti da risolvere a mano:
+#   python -m src.migrate_indexes --locks
+#
+# Con --create-table crea la tabella con gli indici (es. su DynamoDB Local,
+# con DYNAMODB_ENDPOINT_URL) prima del backfill.
+
+import argparse
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+from .availability import rebuild_day
+from .booking import HOLDING_STATUSES, appointment_lock_key
+from .indexes import (
+    EMAIL_INDEX, PATIENT_INDEX, DOCTOR_INDEX, APPOINTMENT_INDEX, INDEX_SK, expected_index_sk, table_definition,
+)
+
+REQUIRED_INDEXES = {EMAIL_INDEX, PATIENT_INDEX, DOCTOR_INDEX, APPOINTMENT_INDEX}
+
+
+def check_indexes(table):
+    existing = {gsi['IndexName'] for gsi in (table.global_secondary_indexes or [])}
+    missing = REQUIRED_INDEXES - existing
+    if missing:
+        print(f"ATTENZIONE: indici mancanti su {table.name}: {', '.join(sorted(missing))} (applicare main.tf)")
+
+
+def calendar_day(item: dict):
+    """(doctor_id, date) di un item che contribuisce al calendario, altrimenti None."""
+    if item.get('SK') == 'SLOTS' and str(item.get('PK', '')).startswith('AVAIL#'):
+        return item['doctor_id'], item['date']
+    if item.get('SK') == 'APPT':
+        return item['doctor_id'], item['date']
+    return None
+
+
+def backfill_lock(table, item: dict, dry_run: bool, stats: dict):
+    """Crea il lock di slot di un appuntamento attivo, se lo slot è libero."""
+    if item.get('SK') != 'APPT' or item.get('status') not in HOLDING_STATUSES:
+        return
+    key = appointment_lock_key(item)
+    existing = table.get_item(Key=key, ConsistentRead=True).get('Item')
+    if existing:
+        if existing['appointment_ref'] != item['appointment_id']:
+            stats['conflicts'] += 1
+            print(f"Conflitto slot {key['PK']}: {existing['appointment_ref']} / {item['appointment_id']}")
+        return
+    if dry_run:
+        stats['locks'] += 1
+        return
+    try:
+        table.put_item(
+            Item={**key, 'appointment_ref': item['appointment_id']},
+            ConditionExpression="attribute_not_exists(PK)",
+        )
+        stats['locks'] += 1
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # Preso nel frattempo da un altro segmento o da una prenotazione
+        stats['conflicts'] += 1
+        print(f"Conflitto slot {key['PK']}: {item['appointment_id']}")
+
+
+def backfill_segment(table, segment: int, total_segments: int, dry_run: bool, days: set,
+                     locks: bool = False) -> dict:
+    stats = {'scanned': 0, 'updated': 0, 'errors': 0, 'locks': 0, 'conflicts': 0}
+    kwargs = {'Segment': segment, 'TotalSegments': total_segments}
+    while True:
+        page = table.scan(**kwargs)
+        for item in page.get('Items', []):
+            stats['scanned'] += 1
+            day = calendar_day(item)
+            if day:
+                days.add(day)
+            if locks:
+                try:
+                    backfill_lock(table, item, dry_run, stats)
+                except ClientError as e:
+                    stats['errors'] += 1
+                    print(f"Errore lock {item['PK']}: {e}")
+            index_sk = expected_index_sk(item)
+            if not index_sk or item.get(INDEX_SK) == index_sk:
+                continue
+            if dry_run:
+                stats['updated'] += 1
+                continue
+            try:
+                table.update_item(
+                    Key={'PK': item['PK'], 'SK': item['SK']},
+                    UpdateExpression="set #i = :i",
+                    ConditionExpression="attribute_exists(PK)",
+                    ExpressionAttributeNames={'#i': INDEX_SK},
+                    ExpressionAttributeValues={':i': index_sk},
+                )
+                stats['updated'] += 1
+            except ClientError as e:
+                stats['errors'] += 1
+                print(f"Errore aggiornamento {item['PK']}/{item['SK']}: {e}")
+        last_key = page.get('LastEvaluatedKey')
+        if not last_key:
+            return stats
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill degli indici secondari di ClinicaDB")
+    parser.add_argument("--table", default=os.getenv("DYNAMODB_TABLE", "ClinicaDB"))
+    parser.add_argument("--region", default=os.getenv("AWS_REGION", "us-east-2"))
+    parser.add_argument("--segments", type=int, default=4, help="segmenti di scan paralleli")
+    parser.add_argument("--dry-run", action="store_true", help="conta gli item senza scrivere")
+    parser.add_argument("--calendars", action="store_true", help="ricostruisce le bitmap del calendario")
+    parser.add_argument("--locks", action="store_true", help="crea i lock di slot degli appuntamenti attivi")
+    parser.add_argument("--create-table", action="store_true", help="crea la tabella se non esiste")
+    args = parser.parse_args()
+    endpoint_url = os.getenv("DYNAMODB_ENDPOINT_URL")
+
+    def open_table():
+        # Le resource boto3 non sono thread-safe: una sessione per segmento
+        dynamodb = boto3.session.Session().resource('dynamodb', region_name=args.region, endpoint_url=endpoint_url)
+        return dynamodb.Table(args.table)
+
+    if args.create_table:
+        client = boto3.client('dynamodb', region_name=args.region, endpoint_url=endpoint_url)
+        try:
+            client.create_table(**table_definition(args.table))
+            client.get_waiter('table_exists').wait(TableName=args.table)
+            print(f"Tabella {args.table} creata")
+        except client.exceptions.ResourceInUseException:
+            print(f"Tabella {args.table} già esistente")
+
+    check_indexes(open_table())
+
+    days = set()
+    with ThreadPoolExecutor(max_workers=args.segments) as pool:
+        results = list(pool.map(
+            lambda seg: backfill_segment(open_table(), seg, args.segments, args.dry_run, days, args.locks),
+            range(args.segments),
+        ))
+
+    totals = {k: sum(r[k] for r in results) for k in ('scanned', 'updated', 'errors', 'locks', 'conflicts')}
+    action = "da aggiornare" if args.dry_run else "aggiornati"
+    print(f"Item letti: {totals['scanned']} - {action}: {totals['updated']} - errori: {totals['errors']}")
+    if args.locks:
+        action = "da creare" if args.dry_run else "creati"
+        print(f"Lock di slot {action}: {totals['locks']} - conflitti: {totals['conflicts']}")
+
+    # Le bitmap si leggono da DoctorIndex: vanno ricostruite dopo il backfill di index_sk
+    if args.calendars and not args.dry_run:
+        local = threading.local()
+
+        def rebuild(day):
+            # Una sessione per thread del pool, riusata per tutti i suoi giorni
+            if not hasattr(local, 'table'):
+                local.table = open_table()
+            return rebuild_day(local.table, *day)
+
+        with ThreadPoolExecutor(max_workers=args.segments) as pool:
+            list(pool.map(rebuild, sorted(days)))
+        print(f"Giorni calendario ricostruiti: {len(days)}")
+    elif args.calendars:
+        print(f"Giorni calendario da ricostruire: {len(days)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+# ============================================
+# OUTBOX NOTIFICHE (SNS ASINCRONO)
+# ============================================
+# Gli handler non chiamano più SNS: accodano un evento compatto (tipo + id)
+# nell'outbox su DynamoDB e rispondono subito. Un dispatcher in background
+# legge l'outbox, compone i testi delle email, pubblica su SNS con
+# concorrenza limitata e ritenta con backoff esponenziale. Dopo
+# OUTBOX_MAX_ATTEMPTS tentativi l'evento viene parcheggiato nella dead-letter.
+#
+#   OUTBOX#<shard> / <timestamp>#<event_id>   evento in attesa
+#   OUTBOX#DLQ     / <timestamp>#<event_id>   evento fallito definitivamente
+#
+# Con più worker i dispatcher si coordinano con un lease condizionale
+# (`lease_until`), quindi ogni evento viene pubblicato da un solo processo.
+# Ogni lotto legge da ogni shard al massimo la sua quota del lotto, a partire
+# da uno shard diverso a ogni passata: un arretrato su uno shard non blocca
+# gli eventi degli altri.
+#
+#   NOTIFICATIONS_BACKEND   sns | fake (FakeSNS in memoria, per test e benchmark)
+#   OUTBOX_SHARDS           partizioni dell'outbox
+#   OUTBOX_BATCH_SIZE       eventi per lotto (divisi tra gli shard)
+#   OUTBOX_CONCURRENCY      pubblicazioni SNS in parallelo
+#   OUTBOX_MAX_ATTEMPTS     tentativi prima della dead-letter
+#   OUTBOX_POLL_SECONDS     intervallo di polling quando non arrivano eventi locali
+
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+
+from .aws import run_io
+
+NOTIFICATIONS_BACKEND = os.getenv("NOTIFICATIONS_BACKEND", "sns")
+OUTBOX_SHARDS = int(os.getenv("OUTBOX_SHARDS", "1"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "25"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_BACKOFF_BASE = 2.0
+OUTBOX_BACKOFF_MAX = 300.0
+
+DLQ_PK = "OUTBOX#DLQ"
+
+# Tipi di evento
+APPOINTMENT_REQUESTED = "appointment_requested"
+APPOINTMENT_CONFIRMED = "appointment_confirmed"
+APPOINTMENTS_CONFIRMED = "appointments_confirmed"   # conferme in blocco, un evento per paziente
+REPORT_UPLOADED = "report_uploaded"
+
+Message = namedtuple('Message', ['email', 'subject', 'body'])
+
+
+# ============================================
+# PUBLISHER
+# ============================================
+class SnsPublisher:
+    def __init__(self, sns_client, topic_arn: str):
+        self._client = sns_client
+        self._topic_arn = topic_arn
+
+    async def publish(self, message: Message):
+        await run_io(self._client.publish,
+            TopicArn=self._topic_arn,
+            Message=message.body,
+            Subject=message.subject,
+            MessageAttributes={'email': {'DataType': 'String', 'StringValue': message.email}}
+        )
+
+
+class FakeSNS:
+    """SNS in memoria: registra i messaggi e può simulare errori."""
+
+    def __init__(self, fail_times: int = 0, delay: float = 0.0):
+        self.sent = []
+        self.fail_times = fail_times
+        self.delay = delay
+
+    async def publish(self, message: Message):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise RuntimeError("FakeSNS: errore simulato")
+        self.sent.append(message)
+
+
+# ============================================
+# TEMPLATE
+# ============================================
+async def _get(table, pk: str, sk: str) -> dict:
+    res = await run_io(table.get_item, Key={'PK': pk, 'SK': sk})
+    return res.get('Item') or {}
+
+
+async def render_appointment_requested(table, payload: dict) -> list:
+    appt = await _get(table, f"APPT#{payload['appointment_id']}", 'APPT')
+    if not appt:
+        return []
+    doctor = await _get(table, f"USER#{appt['doctor_id']}", 'PROFILE')
+    patient = await _get(table, f"USER#{appt['patient_id']}", 'PROFILE')
+    if not doctor.get('email'):
+        return []
+    body = (
+        f"Gentile Dr. {doctor.get('surname', '')},\n\n"
+        f"È stata richiesta una nuova prenotazione.\n"
+        f"------------------------------------------------\n"
+        f"PAZIENTE: {appt.get('patient_name')}\n"
+        f"DATA: {appt.get('date')}\n"
+        f"ORA: {appt.get('time_slot')}\n"
+        f"MOTIVO: {appt.get('reason')}\n"
+        f"CONTATTO PAZIENTE: {patient.get('phone', 'N/A')}\n"
+        f"------------------------------------------------\n\n"
+        f"Acceda alla Dashboard Medici per confermare o rifiutare la richiesta."
+    )
+    return [Message(doctor['email'], f"Richiesta Appuntamento: {appt.get('patient_name')}", body)]
+
+
+async def render_appointment_confirmed(table, payload: dict) -> list:
+    appt = await _get(table, f"APPT#{payload['appointment_id']}", 'APPT')
+    if not appt:
+        return []
+    patient = await _get(table, f"USER#{appt['patient_id']}", 'PROFILE')
+    if not patient.get('email'):
+        return []
+    body = (
+        f"Gentile {patient.get('name', 'Paziente')},\n\n"
+        f"Siamo lieti di confermare il tuo appuntamento.\n"
+        f"------------------------------------------------\n"
+        f"MEDICO: {appt.get('doctor_name')}\n"
+        f"SPECIALIZZAZIONE: {appt.get('doctor_specialization', 'Specialistica')}\n"
+        f"QUANDO: {appt.get('date')} alle ore {appt.get('time_slot')}\n"
+        f"DOVE: Clinica San Marco, Via Etnea 200, Catania\n"
+        f"------------------------------------------------\n\n"
+        f"Si prega di presentarsi in accettazione 10 minuti prima dell'orario indicato.\n"
+        f"Cordiali Saluti,\n"
+        f"Lo Staff di Clinica San Marco"
+    )
+    return [Message(patient['email'], "CONFERMA PRENOTAZIONE - Clinica San Marco", body)]
+
+
+async def render_appointments_confirmed(table, payload: dict) -> list:
+    """Un solo messaggio per tutte le conferme di un paziente in un'operazione in blocco."""
+    ids = payload['appointment_ids']
+    if len(ids) == 1:
+        return await render_appointment_confirmed(table, {'appointment_id': ids[0]})
+    appts = await asyncio.gather(*[_get(table, f"APPT#{i}", 'APPT') for i in ids])
+    appts = sorted((a for a in appts if a), key=lambda a: (a.get('date', ''), a.get('time_slot', '')))
+    if not appts:
+        return []
+    patient = await _get(table, f"USER#{appts[0]['patient_id']}", 'PROFILE')
+    if not patient.get('email'):
+        return []
+    lines = "".join(
+        f"- {a.get('date')} alle ore {a.get('time_slot')}: {a.get('doctor_name')} "
+        f"({a.get('doctor_specialization', 'Specialistica')})\n"
+        for a in appts
+    )
+    body = (
+        f"Gentile {patient.get('name', 'Paziente')},\n\n"
+        f"Siamo lieti di confermare i tuoi appuntamenti.\n"
+        f"------------------------------------------------\n"
+        f"{lines}"
+        f"DOVE: Clinica San Marco, Via Etnea 200, Catania\n"
+        f"------------------------------------------------\n\n"
+        f"Si prega di presentarsi in accettazione 10 minuti prima dell'orario indicato.\n"
+        f"Cordiali Saluti,\n"
+        f"Lo Staff di Clinica San Marco"
+    )
+    return [Message(patient['email'], f"CONFERMA {len(appts)} PRENOTAZIONI - Clinica San Marco", body)]
+
+
+async def render_report_uploaded(table, payload: dict) -> list:
+    report = await _get(table, f"REPORT#{payload['report_id']}", 'METADATA')
+    if not report:
+        return []
+    patient = await _get(table, f"USER#{report['patient_id']}", 'PROFILE')
+    doctor = await _get(table, f"USER#{report['doctor_id']}", 'PROFILE')
+    if not patient.get('email'):
+        return []
+    notes_text = f"NOTE MEDICO: {report['notes']}\n" if report.get('notes') else ""
+    body = (
+        f"Gentile {patient.get('name', 'Paziente')},\n\n"
+        f"Il Dr. {doctor.get('surname', 'Medico')} ha appena caricato un nuovo referto medico.\n"
+        f"------------------------------------------------\n"
+        f"TIPOLOGIA ESAME: {report.get('exam_type')}\n"
+        f"DATA ESECUZIONE: {report.get('exam_date')}\n"
+        f"{notes_text}"
+        f"------------------------------------------------\n\n"
+        f"Il documento PDF è pronto per il download.\n"
+        f"Accedi alla tua Area Riservata per scaricarlo in sicurezza.\n\n"
+        f"Clinica San Marco - Servizio Referti Digitali"
+    )
+    return [Message(patient['email'], f"NUOVO REFERTO DISPONIBILE: {report.get('exam_type')}", body)]
+
+
+RENDERERS = {
+    APPOINTMENT_REQUESTED: render_appointment_requested,
+    APPOINTMENT_CONFIRMED: render_appointment_confirmed,
+    APPOINTMENTS_CONFIRMED: render_appointments_confirmed,
+    REPORT_UPLOADED: render_report_uploaded,
+}
+
+
+# ============================================
+# OUTBOX + DISPATCHER
+# ============================================
+class NotificationOutbox:
+    def __init__(self, table, publisher, concurrency: int = OUTBOX_CONCURRENCY,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, poll_seconds: float = OUTBOX_POLL_SECONDS):
+        self._table = table
+        self.publisher = publisher
+        self._concurrency = concurrency
+        self._max_attempts = max_attempts
+        self._poll_seconds = poll_seconds
+        self._wakeup = None
+        self._task = None
+        self._next_shard = 0
+
+    def event_item(self, event_type: str, payload: dict) -> dict:
+        """Item outbox di un evento, da scrivere anche dentro una transazione."""
+        now = time.time()
+        event_id = str(uuid.uuid4())
+        return {
+            'PK': f"OUTBOX#{random.randrange(OUTBOX_SHARDS)}",
+            'SK': f"{int(now * 1000):013d}#{event_id}",
+            'event_id': event_id,
+            'event_type': event_type,
+            'payload': payload,
+            'attempts': 0,
+            'next_attempt_at': int(now * 1000),
+            'lease_until': 0,
+            'created_at': datetime.now().isoformat(),
+        }
+
+    def wake(self):
+        """Sveglia il dispatcher locale dopo aver scritto un evento."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def enqueue(self, event_type: str, payload: dict):
+        """Accoda un evento: unica scrittura sul percorso della richiesta."""
+        await run_io(self._table.put_item, Item=self.event_item(event_type, payload))
+        self.wake()
+
+    async def _due_shard(self, shard: int, budget: int, now_ms: int, skip: int = 0) -> list:
+        kwargs = {
+            'KeyConditionExpression': Key('PK').eq(f"OUTBOX#{shard}"),
+            'FilterExpression': Attr('next_attempt_at').lte(now_ms) & Attr('lease_until').lte(now_ms),
+        }
+        due = []
+        while len(due) < skip + budget:
+            # Limit conta gli item letti prima del filtro: si continua a paginare
+            res = await run_io(self._table.query, Limit=skip + budget - len(due), **kwargs)
+            due.extend(res.get('Items', []))
+            if 'LastEvaluatedKey' not in res:
+                break
+            kwargs['ExclusiveStartKey'] = res['LastEvaluatedKey']
+        return due[skip:skip + budget]
+
+    async def _due_events(self) -> list:
+        now_ms = int(time.time() * 1000)
+        quota = max(1, OUTBOX_BATCH_SIZE // OUTBOX_SHARDS)
+        # Rotazione: con più shard che posti nel lotto nessuno resta sempre escluso
+        start, self._next_shard = self._next_shard, (self._next_shard + 1) % OUTBOX_SHARDS
+        shards = [(start + i) % OUTBOX_SHARDS for i in range(OUTBOX_SHARDS)]
+        results = await asyncio.gather(*[self._due_shard(shard, quota, now_ms) for shard in shards])
+        due = [event for events in results for event in events][:OUTBOX_BATCH_SIZE]
+        # Posti lasciati liberi dagli shard quasi vuoti: agli shard con arretrato, nello stesso ordine
+        for shard, events in zip(shards, results):
+            if len(due) >= OUTBOX_BATCH_SIZE:
+                break
+            if len(events) == quota:
+                due += await self._due_shard(shard, OUTBOX_BATCH_SIZE - len(due), now_ms, skip=quota)
+        return due
+
+    async def _claim(self, event: dict) -> bool:
+        now_ms = int(time.time() * 1000)
+        try:
+            await run_io(self._table.update_item,
+                Key={'PK': event['PK'], 'SK': event['SK']},
+                UpdateExpression="set lease_until = :lease",
+                ConditionExpression="lease_until = :seen",
+                ExpressionAttributeValues={':lease': now_ms + OUTBOX_LEASE_SECONDS * 1000, ':seen': event['lease_until']},
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False  # preso da un altro worker
+            raise
+
+    async def _deliver(self, event: dict):
+        renderer = RENDERERS.get(event['event_type'])
+        if renderer is None:
+            raise ValueError(f"Tipo evento sconosciuto: {event['event_type']}")
+        for message in await renderer(self._table, event['payload']):
+            await self.publisher.publish(message)
+
+    async def _handle(self, event: dict, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            if not await self._claim(event):
+                return
+            key = {'PK': event['PK'], 'SK': event['SK']}
+            try:
+                await self._deliver(event)
+            except Exception as e:
+                attempts = int(event['attempts']) + 1
+                print(f"Errore notifica {event['event_type']} ({attempts}/{self._max_attempts}): {e}")
+                if attempts >= self._max_attempts:
+                    dead = dict(event, PK=DLQ_PK, attempts=attempts, last_error=str(e)[:1000])
+                    await run_io(self._table.put_item, Item=dead)
+                    await run_io(self._table.delete_item, Key=key)
+                    return
+                delay = min(OUTBOX_BACKOFF_BASE ** attempts, OUTBOX_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+                await run_io(self._table.update_item,
+                    Key=key,
+                    UpdateExpression="set attempts = :a, next_attempt_at = :n, lease_until = :z, last_error = :err",
+                    ExpressionAttributeValues={
+                        ':a': attempts, ':n': int((time.time() + delay) * 1000), ':z': 0, ':err': str(e)[:1000],
+                    },
+                )
+                return
+            await run_io(self._table.delete_item, Key=key)
+
+    async def dispatch_once(self) -> int:
+        """Elabora un lotto di eventi scaduti; restituisce quanti ne ha trovati."""
+        events = await self._due_events()
+        semaphore = asyncio.Semaphore(self._concurrency)
+        await asyncio.gather(*[self._handle(e, semaphore) for e in events])
+        return len(events)
+
+    async def run_forever(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                if await self.dispatch_once() >= OUTBOX_BATCH_SIZE:
+                    continue  # arretrato: prossimo lotto subito
+            except Exception as e:
+                print(f"Errore dispatcher outbox: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def dead_letters(self) -> list:
+        res = await run_io(self._table.query, KeyConditionExpression=Key('PK').eq(DLQ_PK))
+        return res.get('Items', [])
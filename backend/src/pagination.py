@@ -0,0 +1,102 @@
+# ============================================
+# PAGINAZIONE A CURSORE E STREAMING NDJSON
+# ============================================
+# Le liste (appuntamenti, referti, medici) si leggono a pagine:
+#
+#   fetch_page    al massimo `limit` item + cursore opaco per la pagina dopo
+#   iter_pages    generatore async delle pagine DynamoDB, per lo streaming
+#   ndjson        un item JSON per riga, emesso appena la pagina arriva
+#
+# Il cursore è il LastEvaluatedKey di DynamoDB in JSON base64 url-safe: il
+# client lo rimanda così com'è. La condizione di chiave resta sempre quella
+# dell'utente autenticato, quindi un cursore manipolato non espone dati di
+# altri (al massimo la query fallisce con 400).
+# L'ordine è quello della sort key del GSI (`index_sk` = data, ora, id).
+
+import base64
+import binascii
+import json
+from typing import AsyncIterator, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from .aws import run_io
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Cursore non decodificabile o rifiutato da DynamoDB: il chiamante risponde 400."""
+
+
+def encode_cursor(last_key: Optional[dict]) -> Optional[str]:
+    if not last_key:
+        return None
+    raw = json.dumps(jsonable_encoder(last_key), separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[dict]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(key, dict) or not all(isinstance(v, str) for v in key.values()):
+        raise InvalidCursor(cursor)
+    return key
+
+
+def _operation(table, scan: bool):
+    return table.scan if scan else table.query
+
+
+async def fetch_page(table, limit: int, cursor: Optional[str] = None, scan: bool = False,
+                     **kwargs) -> Tuple[list, Optional[str]]:
+    """Una pagina di al massimo `limit` item e il cursore della successiva.
+
+    Con un FilterExpression DynamoDB applica Limit prima del filtro: si
+    rilegge finché la pagina è piena, chiedendo ogni volta solo gli item
+    mancanti, così il cursore punta esattamente dopo l'ultimo item valutato.
+    """
+    start_key = decode_cursor(cursor)
+    items = []
+    while True:
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        response = await run_io(_operation(table, scan), Limit=limit - len(items), **kwargs)
+        items.extend(response.get('Items', []))
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key or len(items) >= limit:
+            return items, encode_cursor(start_key)
+
+
+async def iter_pages(table, scan: bool = False, **kwargs) -> AsyncIterator[list]:
+    """Pagine DynamoDB (fino a 1 MB) una alla volta: memoria limitata a una pagina."""
+    while True:
+        response = await run_io(_operation(table, scan), **kwargs)
+        yield response.get('Items', [])
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+async def count_items(table, scan: bool = False, **kwargs) -> int:
+    """Numero di item della query/scan (Select COUNT: nessun item trasferito)."""
+    total = 0
+    while True:
+        response = await run_io(_operation(table, scan), Select='COUNT', **kwargs)
+        total += response.get('Count', 0)
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return total
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+async def ndjson(items: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    async for item in items:
+        yield (json.dumps(jsonable_encoder(item), separators=(',', ':')) + '\n').encode()
@@ -0,0 +1,287 @@
+# ============================================
+# ANTEPRIME DEI REFERTI (PRIMA PAGINA IN MINIATURA)
+# ============================================
+# Dopo ogni upload (diretto o a blocchi) il referto entra in una coda in
+# memoria: un worker in background legge il file da S3, renderizza la prima
+# pagina (PDF con pypdfium2, immagini con Pillow), la riduce a un JPEG di al
+# massimo PREVIEW_MAX_SIZE pixel per lato e la salva sotto una chiave derivata:
+#
+#   reports/<patient>/<report>_<file>  ->  previews/<patient>/<report>_<file>.jpg
+#
+# Lo stato dell'anteprima è nello stesso REPORT# / METADATA:
+#
+#   preview_status    pending | ready | unsupported | failed
+#   preview_key       chiave S3 del JPEG
+#   preview_width, preview_height, preview_bytes
+#   preview_version   derivata dall'ETag S3 del file: un nuovo upload (stessa
+#                     s3_key) la cambia, quindi /preview?v=<version> si può
+#                     mettere in cache a lungo senza servire anteprime vecchie
+#
+# A ogni cambio di preview_status la pipeline passa il referto aggiornato a
+# `on_change` (main.py lo pubblica come evento report.saved): il client
+# mostra l'anteprima appena pronta, senza ricaricare.
+#
+# Il render tiene la CPU (e pdfium non è thread-safe): gira in un pool di
+# processi come l'hash delle password. Se un processo si riavvia con
+# anteprime in coda, l'endpoint di anteprima le riaccoda alla prima richiesta.
+#
+# `failed` è definitivo e riguarda solo il documento (pdfium o Pillow non lo
+# decodificano). Gli errori di S3 / DynamoDB o un pool di render caduto
+# lasciano il referto in `pending` e il job viene ritentato con backoff
+# esponenziale; esauriti i tentativi resta in attesa e lo riaccoda l'endpoint.
+#
+#   PREVIEW_WORKERS           processi di render (0 = pipeline disattivata)
+#   PREVIEW_MAX_SIZE          lato massimo dell'anteprima in pixel
+#   PREVIEW_QUALITY           qualità JPEG
+#   PREVIEW_MAX_SOURCE_BYTES  file più grandi non vengono renderizzati
+#   PREVIEW_MAX_ATTEMPTS      tentativi per gli errori transitori
+
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Awaitable, Callable, Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .aws import run_io
+from .uploads import REPORTS_PREFIX
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # senza pypdfium2 i PDF restano senza anteprima
+    pdfium = None
+
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "1"))
+PREVIEW_MAX_SIZE = int(os.getenv("PREVIEW_MAX_SIZE", "320"))
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "75"))
+PREVIEW_MAX_SOURCE_BYTES = int(os.getenv("PREVIEW_MAX_SOURCE_BYTES", str(50 * 1024 * 1024)))
+PREVIEW_MAX_ATTEMPTS = int(os.getenv("PREVIEW_MAX_ATTEMPTS", "4"))
+PREVIEW_BACKOFF_BASE = 1.0
+PREVIEW_BACKOFF_MAX = 30.0
+
+PREVIEWS_PREFIX = "previews/"
+
+# Stati dell'anteprima
+PENDING = "pending"
+READY = "ready"
+UNSUPPORTED = "unsupported"
+FAILED = "failed"
+
+
+def preview_key(s3_key: str) -> str:
+    name = s3_key[len(REPORTS_PREFIX):] if s3_key.startswith(REPORTS_PREFIX) else s3_key
+    return f"{PREVIEWS_PREFIX}{name}.jpg"
+
+
+def preview_version(etag: str) -> str:
+    return hashlib.sha1(etag.strip('"').encode()).hexdigest()[:16]
+
+
+# ============================================
+# RENDER (eseguito nei processi del pool, funzione top-level)
+# ============================================
+def _first_page(data: bytes) -> Optional[Image.Image]:
+    if data[:5] == b'%PDF-':
+        if pdfium is None:
+            return None
+        pdf = pdfium.PdfDocument(data)
+        try:
+            if len(pdf) == 0:
+                return None
+            page = pdf[0]
+            width, height = page.get_size()
+            # Doppia risoluzione: la riduzione finale con Pillow è più nitida
+            scale = min(2.0, 2 * PREVIEW_MAX_SIZE / max(width, height, 1))
+            return page.render(scale=scale).to_pil()
+        finally:
+            pdf.close()
+    try:
+        image = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        return None
+    image.draft('RGB', (PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE))  # JPEG: decodifica già ridotta
+    return ImageOps.exif_transpose(image)
+
+
+def _render(data: bytes) -> Optional[Tuple[bytes, int, int]]:
+    """(JPEG, larghezza, altezza) della prima pagina, None se il formato non è gestito."""
+    image = _first_page(data)
+    if image is None:
+        return None
+    image.thumbnail((PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE))
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=PREVIEW_QUALITY, optimize=True)
+    return out.getvalue(), image.width, image.height
+
+
+# ============================================
+# PIPELINE
+# ============================================
+class PreviewPipeline:
+    def __init__(self, table, s3_client, bucket: str, workers: int = PREVIEW_WORKERS,
+                 on_change: Optional[Callable[[dict], Awaitable[None]]] = None):
+        self._table = table
+        self._s3 = s3_client
+        self._bucket = bucket
+        self.workers = workers
+        self._on_change = on_change
+        self._pool = None
+        self._queue = None
+        self._queued = set()
+        self._attempts = {}
+        self._tasks = []
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn: il worker uvicorn ha già thread attivi (pool AWS), fork non è sicuro
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def enqueue(self, report_id: str):
+        """Accoda un referto (una sola volta finché non viene elaborato)."""
+        if self._queue is None or report_id in self._queued:
+            return
+        self._queued.add(report_id)
+        self._queue.put_nowait(report_id)
+
+    async def _changed(self, report: dict):
+        if self._on_change is None:
+            return
+        try:
+            await self._on_change(report)
+        except Exception as e:
+            print(f"Errore notifica anteprima referto {report.get('report_id')}: {e}")
+
+    async def _set_status(self, report_id: str, status: str, version: Optional[str] = None):
+        update, values = "set preview_status = :s", {':s': status}
+        if version is not None:
+            update += ", preview_version = :v"
+            values[':v'] = version
+        res = await run_io(self._table.update_item,
+            Key={'PK': f"REPORT#{report_id}", 'SK': 'METADATA'},
+            UpdateExpression=update,
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_NEW"
+        )
+        await self._changed(res['Attributes'])
+
+    async def generate(self, report_id: str) -> Optional[str]:
+        """Genera (o rigenera) l'anteprima di un referto; restituisce lo stato finale."""
+        res = await run_io(self._table.get_item, Key={'PK': f"REPORT#{report_id}", 'SK': 'METADATA'})
+        report = res.get('Item')
+        if not report:
+            return None
+        obj = await run_io(self._s3.get_object, Bucket=self._bucket, Key=report['s3_key'])
+        version = preview_version(obj['ETag'])
+        if report.get('preview_status') == READY and report.get('preview_version') == version:
+            obj['Body'].close()
+            return READY  # già allineata al file attuale
+        if obj['ContentLength'] > PREVIEW_MAX_SOURCE_BYTES:
+            obj['Body'].close()
+            await self._set_status(report_id, UNSUPPORTED, version)
+            return UNSUPPORTED
+        data = await run_io(obj['Body'].read)
+
+        loop = asyncio.get_running_loop()
+        try:
+            rendered = await loop.run_in_executor(self._get_pool(), _render, data)
+        except BrokenProcessPool:
+            # Processo di render morto: il prossimo tentativo riparte con un pool nuovo
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            raise
+        except Exception as e:
+            # Documento danneggiato o non decodificabile: rifare il job non cambia l'esito
+            print(f"Errore render anteprima referto {report_id}: {e}")
+            await self._set_status(report_id, FAILED, version)
+            return FAILED
+        if rendered is None:
+            await self._set_status(report_id, UNSUPPORTED, version)
+            return UNSUPPORTED
+        jpeg, width, height = rendered
+
+        # File sostituito durante il render: ci pensa il job del nuovo upload
+        head = await run_io(self._s3.head_object, Bucket=self._bucket, Key=report['s3_key'])
+        if preview_version(head['ETag']) != version:
+            return PENDING
+        key = preview_key(report['s3_key'])
+        await run_io(self._s3.put_object, Bucket=self._bucket, Key=key, Body=jpeg, ContentType='image/jpeg')
+        res = await run_io(self._table.update_item,
+            Key={'PK': f"REPORT#{report_id}", 'SK': 'METADATA'},
+            UpdateExpression="set preview_status = :s, preview_key = :k, preview_width = :w, preview_height = :h, "
+                             "preview_bytes = :b, preview_version = :v, preview_generated_at = :t",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeValues={
+                ':s': READY, ':k': key, ':w': width, ':h': height, ':b': len(jpeg), ':v': version,
+                ':t': datetime.now().isoformat(),
+            },
+            ReturnValues="ALL_NEW"
+        )
+        await self._changed(res['Attributes'])
+        return READY
+
+    async def _worker(self):
+        while True:
+            report_id = await self._queue.get()
+            self._queued.discard(report_id)
+            try:
+                await self.generate(report_id)
+                self._attempts.pop(report_id, None)
+            except Exception as e:
+                # S3 / DynamoDB non raggiungibili o pool caduto: lo stato resta pending
+                attempts = self._attempts.pop(report_id, 0) + 1
+                if attempts >= PREVIEW_MAX_ATTEMPTS:
+                    print(f"Errore anteprima referto {report_id} ({attempts} tentativi), resta in attesa: {e}")
+                    continue
+                self._attempts[report_id] = attempts
+                delay = min(PREVIEW_BACKOFF_BASE * 2 ** (attempts - 1), PREVIEW_BACKOFF_MAX)
+                delay *= random.uniform(0.5, 1.0)
+                print(f"Errore anteprima referto {report_id} ({attempts}/{PREVIEW_MAX_ATTEMPTS}), "
+                      f"nuovo tentativo tra {delay:.1f} s: {e}")
+                asyncio.get_running_loop().call_later(delay, self.enqueue, report_id)
+            finally:
+                self._queue.task_done()
+
+    async def drain(self):
+        """Attende che la coda sia vuota (per benchmark e test)."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def start(self):
+        if self.workers <= 0 or self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._queue = None
+        self._queued.clear()
+        self._attempts.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,73 @@
+# ============================================
+# READINESS (WORKER PRONTO A RICEVERE TRAFFICO)
+# ============================================
+# /health dice solo che il processo risponde (liveness, HEALTHCHECK Docker).
+# /ready dice se il worker può servire richieste e va usato dal load balancer:
+#
+#   1. warm_up, in background all'avvio: crea i client AWS nei thread del
+#      pool (risoluzione credenziali compresa) e fa il primo controllo
+#   2. controllo: una get_item su una chiave fissa, quindi rete, permessi e
+#      tabella (DynamoDB o SQLite) in una sola lettura da 0.5 RCU
+#   3. allo shutdown il worker torna "non pronto" mentre finisce le richieste
+#
+# Il risultato di un controllo vale READY_CACHE_SECONDS: i probe frequenti di
+# più load balancer non diventano carico sulla tabella.
+#
+#   READY_CACHE_SECONDS   durata di un controllo (riuscito o fallito)
+
+import asyncio
+import os
+import time
+
+from .aws import run_io
+
+READY_CACHE_SECONDS = float(os.getenv("READY_CACHE_SECONDS", "5"))
+
+PROBE_KEY = {'PK': 'READY#PROBE', 'SK': 'PROBE'}
+
+
+class Readiness:
+    def __init__(self, table, clients: list, cache_seconds: float = READY_CACHE_SECONDS):
+        self._table = table
+        self._clients = clients
+        self._cache_seconds = cache_seconds
+        self._created_at = time.perf_counter()
+        self.warm = False
+        self.draining = False
+        self.startup_seconds = None
+        self._checked_at = 0.0
+        self._error = "warm-up in corso"
+        self._lock = None
+
+    async def warm_up(self):
+        try:
+            await asyncio.gather(*[run_io(client.client) for client in self._clients])
+        except Exception as e:
+            print(f"Errore warm-up client AWS: {e}")
+        await self.check(force=True)
+        self.warm = True
+        self.startup_seconds = time.perf_counter() - self._created_at
+
+    async def check(self, force: bool = False) -> bool:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:  # un solo controllo alla volta, gli altri ne usano il risultato
+            if force or time.monotonic() - self._checked_at >= self._cache_seconds:
+                try:
+                    await run_io(self._table.get_item, Key=PROBE_KEY)
+                    self._error = None
+                except Exception as e:
+                    self._error = str(e)[:200]
+                self._checked_at = time.monotonic()
+        return self._error is None
+
+    async def status(self) -> dict:
+        ok = self.warm and not self.draining and await self.check()
+        return {
+            'ready': ok,
+            'pid': os.getpid(),
+            'warm': self.warm,
+            'draining': self.draining,
+            'startup_ms': round(self.startup_seconds * 1000) if self.startup_seconds is not None else None,
+            'error': None if ok else ("shutdown in corso" if self.draining else self._error),
+        }
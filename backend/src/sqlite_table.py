@@ -0,0 +1,512 @@
+# ============================================
+# MOTORE SQLITE (STESSA INTERFACCIA DELLA TABLE DYNAMODB)
+# ============================================
+# Alternativa locale a DynamoDB per piccole installazioni e CI: espone gli
+# stessi metodi della Table boto3 usati dall'app (get_item, put_item,
+# update_item, delete_item, query, scan, transact_write_items, batch_writer,
+# batch_write_item, batch_get_item), con gli stessi parametri, risultati,
+# condizioni ed errori (ClientError con ConditionalCheckFailedException /
+# TransactionCanceledException), quindi main.py e i moduli non cambiano.
+# Si seleziona con STORAGE_BACKEND (vedi storage.py).
+#
+# Schema: una riga per item (PK, SK) con l'item serializzato in JSON
+# (formato tipizzato DynamoDB) e colonne per le chiavi dei GSI, ognuna con un
+# indice SQLite parziale, così le query per indice non leggono la tabella:
+#
+#   EmailIndex         (email)
+#   PatientIndex       (patient_id, index_sk)
+#   DoctorIndex        (doctor_id, index_sk)
+#   AppointmentIndex   (appointment_id, SK)
+#
+# WAL: le letture non si bloccano durante le scritture. Le scritture
+# condizionali sono transazioni BEGIN IMMEDIATE (lettura + verifica + scrittura
+# atomiche). Le connessioni sono riusate da un pool limitato.
+#
+#   SQLITE_PATH        file del database (":memory:" per un database temporaneo)
+#   SQLITE_POOL_SIZE   connessioni massime (default: thread del pool AWS)
+
+import base64
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Optional
+
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+from . import expressions
+from .aws import AWS_IO_WORKERS
+from .indexes import EMAIL_INDEX, PATIENT_INDEX, DOCTOR_INDEX, APPOINTMENT_INDEX, INDEX_SK
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "clinica.db")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", str(AWS_IO_WORKERS)))
+
+# Massimo di item per pagina di query/scan (DynamoDB si ferma a 1 MB)
+MAX_PAGE_ITEMS = 1000
+
+# Colonne dei GSI: nome indice -> (colonna hash, colonna range o None)
+INDEX_COLUMNS = {
+    EMAIL_INDEX: ('email', None),
+    PATIENT_INDEX: ('patient_id', INDEX_SK),
+    DOCTOR_INDEX: ('doctor_id', INDEX_SK),
+    APPOINTMENT_INDEX: ('appointment_id', 'sk'),
+}
+ATTRIBUTE_COLUMNS = ('email', 'patient_id', 'doctor_id', 'appointment_id', INDEX_SK)
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+# ============================================
+# SERIALIZZAZIONE
+# ============================================
+def _encode(av: dict):
+    """Attributo tipizzato DynamoDB -> JSON (i binari in base64)."""
+    (kind, value), = av.items()
+    if kind == 'B':
+        return {'B': base64.b64encode(value.value if isinstance(value, Binary) else value).decode()}
+    if kind == 'BS':
+        return {'BS': [base64.b64encode(v.value if isinstance(v, Binary) else v).decode() for v in value]}
+    if kind == 'M':
+        return {'M': {k: _encode(v) for k, v in value.items()}}
+    if kind == 'L':
+        return {'L': [_encode(v) for v in value]}
+    return av
+
+
+def _decode(av: dict) -> dict:
+    (kind, value), = av.items()
+    if kind == 'B':
+        return {'B': base64.b64decode(value)}
+    if kind == 'BS':
+        return {'BS': [base64.b64decode(v) for v in value]}
+    if kind == 'M':
+        return {'M': {k: _decode(v) for k, v in value.items()}}
+    if kind == 'L':
+        return {'L': [_decode(v) for v in value]}
+    return av
+
+
+def dumps(item: dict) -> str:
+    return json.dumps({k: _encode(_serializer.serialize(v)) for k, v in item.items()}, separators=(',', ':'))
+
+
+def loads(data: str) -> dict:
+    return {k: _deserializer.deserialize(_decode(v)) for k, v in json.loads(data).items()}
+
+
+def _error(code: str, message: str, operation: str, **extra) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': 400}, **extra}, operation)
+
+
+def _validation(e: Exception, operation: str) -> ClientError:
+    return _error('ValidationException', str(e), operation)
+
+
+# ============================================
+# POOL DI CONNESSIONI
+# ============================================
+class ConnectionPool:
+    def __init__(self, path: str, size: int):
+        self._path = path
+        self._size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._uri = False
+        if path == ':memory:':
+            # Database in memoria condiviso tra le connessioni del pool; una sola
+            # connessione: la cache condivisa non regge scritture concorrenti
+            self._path = f"file:clinica-{id(self)}?mode=memory&cache=shared"
+            self._uri = True
+            self._size = 1
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: le transazioni si aprono esplicitamente
+        conn = sqlite3.connect(self._path, timeout=30, isolation_level=None,
+                               check_same_thread=False, uri=self._uri)
+        if not self._uri:
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self._size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+
+# ============================================
+# TABLE
+# ============================================
+class SqliteTable:
+    """Table DynamoDB (sottoinsieme usato dall'app) su un file SQLite."""
+
+    def __init__(self, table_name: str, path: str = SQLITE_PATH, pool_size: int = SQLITE_POOL_SIZE):
+        if not re.fullmatch(r'[A-Za-z0-9_.-]+', table_name):
+            raise ValueError(f"Nome tabella non valido: {table_name}")
+        self.name = table_name
+        self._sql_table = f'"{table_name}"'
+        self._pool = ConnectionPool(path, pool_size)
+        self._create_schema()
+
+    def _create_schema(self):
+        prefix = self.name.replace('.', '_').replace('-', '_')
+        with self._pool.connection() as conn:
+            conn.executescript(f"""
+                CREATE TABLE IF NOT EXISTS {self._sql_table} (
+                    pk TEXT NOT NULL,
+                    sk TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    email TEXT,
+                    patient_id TEXT,
+                    doctor_id TEXT,
+                    appointment_id TEXT,
+                    {INDEX_SK} TEXT,
+                    PRIMARY KEY (pk, sk)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS "{prefix}_email" ON {self._sql_table} (email, pk, sk)
+                    WHERE email IS NOT NULL;
+                CREATE INDEX IF NOT EXISTS "{prefix}_patient" ON {self._sql_table} (patient_id, {INDEX_SK}, pk, sk)
+                    WHERE patient_id IS NOT NULL AND {INDEX_SK} IS NOT NULL;
+                CREATE INDEX IF NOT EXISTS "{prefix}_doctor" ON {self._sql_table} (doctor_id, {INDEX_SK}, pk, sk)
+                    WHERE doctor_id IS NOT NULL AND {INDEX_SK} IS NOT NULL;
+                CREATE INDEX IF NOT EXISTS "{prefix}_appointment" ON {self._sql_table} (appointment_id, sk, pk)
+                    WHERE appointment_id IS NOT NULL;
+            """)
+
+    # --- accesso alle righe ---
+    @contextmanager
+    def _write(self):
+        with self._pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _load(self, conn, key: dict) -> Optional[dict]:
+        row = conn.execute(f"SELECT data FROM {self._sql_table} WHERE pk = ? AND sk = ?",
+                           (key['PK'], key['SK'])).fetchone()
+        return loads(row[0]) if row else None
+
+    def _store(self, conn, item: dict):
+        columns = [item.get(c) if isinstance(item.get(c), str) else None for c in ATTRIBUTE_COLUMNS]
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self._sql_table} (pk, sk, data, {', '.join(ATTRIBUTE_COLUMNS)}) "
+            f"VALUES (?, ?, ?, {', '.join('?' for _ in ATTRIBUTE_COLUMNS)})",
+            [item['PK'], item['SK'], dumps(item)] + columns,
+        )
+
+    def _remove(self, conn, key: dict):
+        conn.execute(f"DELETE FROM {self._sql_table} WHERE pk = ? AND sk = ?", (key['PK'], key['SK']))
+
+    @staticmethod
+    def _key(key: dict) -> dict:
+        if set(key) != {'PK', 'SK'} or not all(isinstance(v, str) for v in key.values()):
+            raise ValueError("La chiave deve avere PK e SK di tipo stringa")
+        return key
+
+    @staticmethod
+    def _check(item: Optional[dict], kwargs: dict):
+        expression = kwargs.get('ConditionExpression')
+        if expression is None:
+            return True
+        check = expressions.condition(expression, kwargs.get('ExpressionAttributeNames'),
+                                      kwargs.get('ExpressionAttributeValues'))
+        return check(item or {})
+
+    # --- singoli item ---
+    def get_item(self, Key: dict, **kwargs) -> dict:
+        with self._pool.connection() as conn:
+            item = self._load(conn, self._key(Key))
+        return {'Item': item} if item is not None else {}
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        try:
+            item = {k: expressions.native(v) for k, v in Item.items()}
+            with self._write() as conn:
+                old = self._load(conn, self._key({'PK': item.get('PK'), 'SK': item.get('SK')}))
+                if not self._check(old, kwargs):
+                    raise _error('ConditionalCheckFailedException', "The conditional request failed", 'PutItem')
+                self._store(conn, item)
+        except (ValueError, TypeError) as e:
+            raise _validation(e, 'PutItem')
+        return {'Attributes': old} if kwargs.get('ReturnValues') == 'ALL_OLD' and old else {}
+
+    def update_item(self, Key: dict, **kwargs) -> dict:
+        try:
+            key = self._key(Key)
+            with self._write() as conn:
+                old = self._load(conn, key)
+                if not self._check(old, kwargs):
+                    raise _error('ConditionalCheckFailedException', "The conditional request failed", 'UpdateItem')
+                new, touched = self._apply_update(old, key, kwargs)
+                self._store(conn, new)
+        except (ValueError, TypeError) as e:
+            raise _validation(e, 'UpdateItem')
+        return_values = kwargs.get('ReturnValues', 'NONE')
+        if return_values == 'ALL_NEW':
+            return {'Attributes': new}
+        if return_values == 'UPDATED_NEW':
+            return {'Attributes': {k: new[k] for k in touched if k in new}}
+        if return_values == 'ALL_OLD' and old:
+            return {'Attributes': old}
+        if return_values == 'UPDATED_OLD' and old:
+            return {'Attributes': {k: old[k] for k in touched if k in old}}
+        return {}
+
+    @staticmethod
+    def _apply_update(old: Optional[dict], key: dict, kwargs: dict):
+        new, touched = expressions.apply_update(old or dict(key), kwargs['UpdateExpression'],
+                                                kwargs.get('ExpressionAttributeNames'),
+                                                kwargs.get('ExpressionAttributeValues'))
+        if touched & {'PK', 'SK'}:
+            raise ValueError("Le chiavi dell'item non si possono modificare")
+        return new, touched
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        try:
+            key = self._key(Key)
+            with self._write() as conn:
+                old = self._load(conn, key)
+                if not self._check(old, kwargs):
+                    raise _error('ConditionalCheckFailedException', "The conditional request failed", 'DeleteItem')
+                self._remove(conn, key)
+        except (ValueError, TypeError) as e:
+            raise _validation(e, 'DeleteItem')
+        return {'Attributes': old} if kwargs.get('ReturnValues') == 'ALL_OLD' and old else {}
+
+    # --- transazioni e scritture in blocco ---
+    def transact_write_items(self, TransactItems: list, **kwargs) -> dict:
+        """Tutto o niente; su condizione fallita CancellationReasons come DynamoDB."""
+        try:
+            with self._write() as conn:
+                reasons, writes = [], []
+                for entry in TransactItems:
+                    (action, spec), = entry.items()
+                    if spec.get('TableName', self.name) != self.name:
+                        raise ValueError(f"Tabella non gestita: {spec['TableName']}")
+                    if action == 'Put':
+                        item = {k: expressions.native(v) for k, v in spec['Item'].items()}
+                        key = self._key({'PK': item.get('PK'), 'SK': item.get('SK')})
+                    else:
+                        key = self._key(spec['Key'])
+                    old = self._load(conn, key)
+                    ok = self._check(old, spec)
+                    reasons.append({'Code': 'None'} if ok else
+                                   {'Code': 'ConditionalCheckFailed', 'Message': "The conditional request failed"})
+                    if action == 'Put':
+                        writes.append(('store', item))
+                    elif action == 'Update':
+                        writes.append(('store', self._apply_update(old, key, spec)[0]))
+                    elif action == 'Delete':
+                        writes.append(('remove', key))
+                    elif action != 'ConditionCheck':
+                        raise ValueError(f"Azione non supportata: {action}")
+                if any(r['Code'] != 'None' for r in reasons):
+                    codes = ', '.join(r['Code'] for r in reasons)
+                    raise _error('TransactionCanceledException',
+                                 f"Transaction cancelled, please refer cancellation reasons for specific reasons [{codes}]",
+                                 'TransactWriteItems', CancellationReasons=reasons)
+                for op, value in writes:
+                    self._store(conn, value) if op == 'store' else self._remove(conn, value)
+        except (ValueError, TypeError) as e:
+            raise _validation(e, 'TransactWriteItems')
+        return {}
+
+    @contextmanager
+    def batch_writer(self, overwrite_by_pkeys=None):
+        """Come Table.batch_writer: put/delete accumulati e scritti in un'unica transazione."""
+        batch = _BatchWriter()
+        yield batch
+        with self._write() as conn:
+            for op, value in batch.operations:
+                self._store(conn, value) if op == 'store' else self._remove(conn, self._key(value))
+
+    def batch_write_item(self, RequestItems: dict, **kwargs) -> dict:
+        """Come il client DynamoDB; qui tutte le richieste vengono sempre elaborate."""
+        try:
+            with self._write() as conn:
+                for table_name, requests in RequestItems.items():
+                    if table_name != self.name:
+                        raise ValueError(f"Tabella non gestita: {table_name}")
+                    for request in requests:
+                        if 'PutRequest' in request:
+                            item = {k: expressions.native(v) for k, v in request['PutRequest']['Item'].items()}
+                            self._key({'PK': item.get('PK'), 'SK': item.get('SK')})
+                            self._store(conn, item)
+                        else:
+                            self._remove(conn, self._key(request['DeleteRequest']['Key']))
+        except (ValueError, TypeError, KeyError) as e:
+            raise _validation(e, 'BatchWriteItem')
+        return {'UnprocessedItems': {}}
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        responses = {}
+        try:
+            with self._pool.connection() as conn:
+                for table_name, request in RequestItems.items():
+                    if table_name != self.name:
+                        raise ValueError(f"Tabella non gestita: {table_name}")
+                    found = (self._load(conn, self._key(key)) for key in request['Keys'])
+                    responses[table_name] = [item for item in found if item is not None]
+        except (ValueError, TypeError, KeyError) as e:
+            raise _validation(e, 'BatchGetItem')
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    # --- letture multiple ---
+    def query(self, KeyConditionExpression, IndexName: str = None, FilterExpression=None, Limit: int = None,
+              ExclusiveStartKey: dict = None, ScanIndexForward: bool = True, **kwargs) -> dict:
+        names, values = kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')
+        try:
+            parts = expressions.key_condition_parts(KeyConditionExpression, names, values)
+        except ValueError as e:
+            raise _validation(e, 'Query')
+        hash_column, range_column = INDEX_COLUMNS[IndexName] if IndexName else ('pk', 'sk')
+        column_of = {'PK': 'pk', 'SK': 'sk'}
+        where, params, has_hash = [], [], False
+        for attr, op, args in parts:
+            column = column_of.get(attr, attr)
+            if column == hash_column and op == '=' and not has_hash:
+                has_hash = True
+                where.append(f"{hash_column} = ?")
+                params.append(args[0])
+            elif column == range_column:
+                if op == 'begins_with':
+                    where.append(f"{column} >= ? AND {column} < ?")
+                    params += [args[0], args[0] + '\U0010ffff']
+                elif op == 'BETWEEN':
+                    where.append(f"{column} BETWEEN ? AND ?")
+                    params += args
+                else:
+                    where.append(f"{column} {op} ?")
+                    params.append(args[0])
+            else:
+                raise _validation(ValueError(f"Condizione di chiave non valida su {attr}"), 'Query')
+        if not has_hash:
+            raise _validation(ValueError("Manca l'uguaglianza sulla chiave hash"), 'Query')
+        if range_column and range_column != 'sk':
+            where.append(f"{range_column} IS NOT NULL")
+        # Ordine per chiave range; a parità (solo nei GSI) per chiave primaria
+        order = [c for c in (range_column, 'pk', 'sk') if c and c != hash_column]
+        order = list(dict.fromkeys(order))
+        return self._page('Query', where, params, order, ScanIndexForward, IndexName, hash_column,
+                          range_column, FilterExpression, Limit, ExclusiveStartKey, kwargs)
+
+    def scan(self, FilterExpression=None, Limit: int = None, ExclusiveStartKey: dict = None,
+             Segment: int = None, TotalSegments: int = None, IndexName: str = None, **kwargs) -> dict:
+        where, hash_column, range_column = [], 'pk', 'sk'
+        if IndexName:
+            hash_column, range_column = INDEX_COLUMNS[IndexName]
+            where.append(f"{hash_column} IS NOT NULL")
+        segment = (Segment, TotalSegments) if TotalSegments else None
+        return self._page('Scan', where, [], ['pk', 'sk'], True, IndexName, hash_column, range_column,
+                          FilterExpression, Limit, ExclusiveStartKey, kwargs, segment)
+
+    def _page(self, operation, where, params, order, forward, index_name, hash_column, range_column,
+              filter_expression, limit, start_key, kwargs, segment=None) -> dict:
+        try:
+            check = None
+            if filter_expression is not None:
+                check = expressions.condition(filter_expression, kwargs.get('ExpressionAttributeNames'),
+                                              kwargs.get('ExpressionAttributeValues'))
+        except ValueError as e:
+            raise _validation(e, operation)
+
+        where, params = list(where), list(params)
+        if start_key:
+            # Riprende dopo l'ultimo item valutato, nell'ordine della pagina
+            column_values = [self._start_value(start_key, c, operation) for c in order]
+            comparison = '>' if forward else '<'
+            where.append(f"({', '.join(order)}) {comparison} ({', '.join('?' for _ in order)})")
+            params += column_values
+        page_size = min(limit or MAX_PAGE_ITEMS, MAX_PAGE_ITEMS)
+        direction = 'ASC' if forward else 'DESC'
+        sql = (f"SELECT data FROM {self._sql_table}" + (f" WHERE {' AND '.join(where)}" if where else "")
+               + f" ORDER BY {', '.join(f'{c} {direction}' for c in order)} LIMIT ?")
+
+        items, scanned, last = [], 0, None
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params + [page_size + 1]).fetchall()
+        for data, in rows[:page_size]:
+            item = loads(data)
+            if segment and zlib.crc32(item['PK'].encode()) % segment[1] != segment[0]:
+                continue
+            scanned += 1
+            last = item
+            if check is None or check(item):
+                items.append(item)
+
+        response = {'Items': items, 'Count': len(items), 'ScannedCount': scanned}
+        if len(rows) > page_size and last is not None:
+            response['LastEvaluatedKey'] = self._evaluated_key(last, index_name, hash_column, range_column)
+        elif len(rows) > page_size:
+            # Segmento senza item in questa pagina: si riparte dall'ultima riga letta
+            response['LastEvaluatedKey'] = self._evaluated_key(loads(rows[page_size - 1][0]), index_name,
+                                                               hash_column, range_column)
+        return response
+
+    @staticmethod
+    def _evaluated_key(item: dict, index_name, hash_column, range_column) -> dict:
+        key = {'PK': item['PK'], 'SK': item['SK']}
+        if index_name:
+            for column in (hash_column, range_column):
+                if column and column not in ('pk', 'sk'):
+                    key[column] = item[column]
+        return key
+
+    @staticmethod
+    def _start_value(start_key: dict, column: str, operation: str):
+        attr = {'pk': 'PK', 'sk': 'SK'}.get(column, column)
+        if not isinstance(start_key.get(attr), str):
+            raise _validation(ValueError("ExclusiveStartKey non valida per questa richiesta"), operation)
+        return start_key[attr]
+
+    # --- manutenzione ---
+    def purge_expired(self, now: float = None) -> int:
+        """Cancella gli item con `expires_at` passato (il TTL di DynamoDB)."""
+        now = now or time.time()
+        removed = 0
+        with self._write() as conn:
+            rows = conn.execute(f"SELECT pk, sk, data FROM {self._sql_table} WHERE data LIKE '%\"expires_at\"%'").fetchall()
+            for pk, sk, data in rows:
+                expires_at = loads(data).get('expires_at')
+                if expires_at is not None and expires_at < now:
+                    self._remove(conn, {'PK': pk, 'SK': sk})
+                    removed += 1
+        return removed
+
+
+class _BatchWriter:
+    def __init__(self):
+        self.operations = []
+
+    def put_item(self, Item: dict):
+        self.operations.append(('store', {k: expressions.native(v) for k, v in Item.items()}))
+
+    def delete_item(self, Key: dict):
+        self.operations.append(('remove', Key))
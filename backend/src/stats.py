@@ -0,0 +1,249 @@
+# ============================================
+# STATISTICHE DEL MEDICO (CONTATORI ATOMICI)
+# ============================================
+# Richieste in attesa, visite di oggi, referti del mese e tasso di no-show
+# si leggono da un solo item per medico, aggiornato con `ADD` negli stessi
+# percorsi di scrittura (prenotazione, cambio stato, cancellazione, referto)
+# invece di contare lato client tutti gli appuntamenti:
+#
+#   STATS#<doctor_id> / COUNTERS
+#     total#<stato>            appuntamenti per stato attuale
+#     day#<data>#<stato>       appuntamenti del giorno per stato
+#     past#<stato>             giorni più vecchi di STATS_DAYS_KEPT (piegati
+#                              dalla riconciliazione) e appuntamenti archiviati
+#     reports                  referti caricati
+#     month#<AAAA-MM>#reports  referti caricati nel mese (upload_date)
+#     version                  incrementato da ogni scrittura
+#
+# Gli attributi sono tutti di primo livello: ADD crea da solo quelli nuovi,
+# senza dover inizializzare mappe annidate. L'ADD è un UpdateItem separato,
+# subito dopo la scrittura riuscita, e non un elemento della sua
+# transazione: l'item del medico è caldo (tutte le prenotazioni dei suoi
+# pazienti) e transazioni concorrenti sullo stesso item fallirebbero con
+# TransactionConflict, mentre ADD concorrenti si sommano senza conflitti.
+# Il cambio stato in blocco somma le variazioni e fa un solo ADD. Un errore
+# tra la scrittura e l'ADD viene solo registrato: lo corregge la
+# riconciliazione.
+#
+# No-show: visite confermate il cui giorno è passato senza essere segnate
+# come completate, sul totale di confermate + completate dei giorni passati.
+#
+# La riconciliazione ricostruisce l'item dai dati sorgente (DoctorIndex,
+# referti e indice dell'archivio, vedi archive.py) e lo scrive solo se
+# `version` non è cambiata nel frattempo, altrimenti ricalcola:
+#   python -m src.stats --dry-run
+#   python -m src.stats --doctor <doctor_id>
+#
+#   STATS_DAYS_KEPT   giorni passati con il dettaglio per giorno
+
+import argparse
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+
+from .archive import index_pk
+from .aws import run_io
+from .indexes import appointments_for_doctor, reports_for_doctor, query_all
+
+STATS_DAYS_KEPT = int(os.getenv("STATS_DAYS_KEPT", "90"))
+RECONCILE_ATTEMPTS = 5
+
+COUNTERS_SK = "COUNTERS"
+
+# Valori di AppointmentStatus (main.py): gli altri non diventano contatori
+APPOINTMENT_STATUSES = ('pending', 'confirmed', 'rejected', 'completed', 'cancelled')
+
+
+def stats_key(doctor_id: str) -> dict:
+    return {'PK': f"STATS#{doctor_id}", 'SK': COUNTERS_SK}
+
+
+def _status(value) -> str:
+    # Gli Enum str di main.py: sempre il valore, mai "AppointmentStatus.X"
+    return getattr(value, 'value', value)
+
+
+# ============================================
+# VARIAZIONI (ADD)
+# ============================================
+def appointment_deltas(appt: dict, old_status=None, new_status=None, deltas: Optional[Counter] = None) -> Counter:
+    """Variazioni per un appuntamento che passa da old_status a new_status (None = non esiste)."""
+    deltas = deltas if deltas is not None else Counter()
+    for status, sign in ((old_status, -1), (new_status, 1)):
+        if status is not None and _status(status) in APPOINTMENT_STATUSES:
+            status = _status(status)
+            deltas[f"total#{status}"] += sign
+            deltas[f"day#{appt['date']}#{status}"] += sign
+    return deltas
+
+
+def report_deltas(upload_date: str) -> Counter:
+    return Counter({'reports': 1, f"month#{upload_date[:7]}#reports": 1})
+
+
+def _update_args(deltas: Counter) -> dict:
+    names, values, parts = {'#v': 'version'}, {':one': 1}, ["#v :one"]
+    for i, (attr, delta) in enumerate(sorted(deltas.items())):
+        if delta:
+            names[f"#a{i}"], values[f":d{i}"] = attr, delta
+            parts.append(f"#a{i} :d{i}")
+    return {
+        'UpdateExpression': "ADD " + ", ".join(parts),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+    }
+
+
+async def apply(table, doctor_id: str, deltas: Counter):
+    """ADD atomico delle variazioni (errori solo registrati)."""
+    if not any(deltas.values()):
+        return
+    try:
+        await run_io(table.update_item, Key=stats_key(doctor_id), **_update_args(deltas))
+    except Exception as e:
+        print(f"Errore aggiornamento statistiche {doctor_id} (corrette dalla riconciliazione): {e}")
+
+
+# ============================================
+# LETTURA
+# ============================================
+def summary(item: dict, day: str, month: Optional[str] = None) -> dict:
+    """Statistiche calcolate da un item COUNTERS (vuoto se il medico non ha ancora dati)."""
+    month = month or day[:7]
+    totals, on_day, past = Counter(), Counter(), Counter()
+    for attr, value in item.items():
+        parts = attr.split('#')
+        if parts[0] == 'total' and len(parts) == 2:
+            totals[parts[1]] += int(value)
+        elif parts[0] == 'day' and len(parts) == 3:
+            if parts[1] == day:
+                on_day[parts[2]] += int(value)
+            if parts[1] < day:
+                past[parts[2]] += int(value)
+        elif parts[0] == 'past' and len(parts) == 2:
+            past[parts[1]] += int(value)
+    no_show, completed = past['confirmed'], past['completed']
+    return {
+        'pending': totals['pending'],
+        'day': {'date': day, **{k: v for k, v in on_day.items() if v}},
+        'totals': {k: v for k, v in totals.items() if v},
+        'reports': {'total': int(item.get('reports', 0)),
+                    'month': month, 'this_month': int(item.get(f"month#{month}#reports", 0))},
+        'no_show': no_show,
+        'past_completed': completed,
+        'no_show_rate': round(no_show / (no_show + completed), 4) if no_show + completed else None,
+        'reconciled_at': item.get('reconciled_at'),
+    }
+
+
+# ============================================
+# RICONCILIAZIONE
+# ============================================
+def first_kept_day(today: Optional[date] = None, days_kept: int = STATS_DAYS_KEPT) -> str:
+    return ((today or date.today()) - timedelta(days=days_kept)).isoformat()
+
+
+def fold(item: dict, first_day: str) -> Counter:
+    """Contatori dell'item con i giorni prima di first_day sommati in past#<stato>."""
+    counters = Counter()
+    for attr, value in item.items():
+        parts = attr.split('#')
+        if parts[0] == 'day' and len(parts) == 3 and parts[1] < first_day:
+            attr = f"past#{parts[2]}"
+        if attr not in ('PK', 'SK', 'version', 'reconciled_at'):
+            counters[attr] += int(value)
+    return counters
+
+
+def rebuild(table, doctor_id: str, today: Optional[date] = None, days_kept: int = STATS_DAYS_KEPT) -> dict:
+    """Item COUNTERS ricalcolato da appuntamenti, referti e archivio del medico."""
+    first_day = first_kept_day(today, days_kept)
+    counters = Counter()
+    for appt in appointments_for_doctor(table, doctor_id):
+        status = appt.get('status')
+        if status not in APPOINTMENT_STATUSES:
+            continue
+        counters[f"total#{status}"] += 1
+        if appt['date'] >= first_day:
+            counters[f"day#{appt['date']}#{status}"] += 1
+        else:
+            counters[f"past#{status}"] += 1
+    for entry in query_all(table, KeyConditionExpression=Key('PK').eq(index_pk(doctor_id)) & Key('SK').begins_with("APPT#")):
+        for status, count in entry.get('statuses', {}).items():
+            if status not in APPOINTMENT_STATUSES:
+                continue
+            counters[f"total#{status}"] += int(count)
+            counters[f"past#{status}"] += int(count)
+    for report in reports_for_doctor(table, doctor_id):
+        counters.update(report_deltas(report.get('upload_date') or report.get('exam_date', '')))
+    return {**stats_key(doctor_id), **{k: v for k, v in counters.items() if v}}
+
+
+def reconcile(table, doctor_id: str, dry_run: bool = False) -> dict:
+    """Riscrive l'item COUNTERS se nessuna scrittura è avvenuta durante il ricalcolo."""
+    for _ in range(RECONCILE_ATTEMPTS):
+        current = table.get_item(Key=stats_key(doctor_id), ConsistentRead=True).get('Item')
+        item = rebuild(table, doctor_id)
+        if dry_run:
+            return item
+        version = current.get('version') if current else None
+        item['version'] = int(version or 0) + 1
+        item['reconciled_at'] = datetime.now().isoformat()
+        condition = Attr('PK').not_exists() if current is None else Attr('version').eq(version)
+        try:
+            table.put_item(Item=item, ConditionExpression=condition)
+            return item
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    raise RuntimeError(f"Statistiche di {doctor_id} modificate durante {RECONCILE_ATTEMPTS} ricalcoli")
+
+
+def drift(before: Optional[dict], after: dict) -> list:
+    """Contatori che la riconciliazione ha corretto (non quelli solo piegati in past#)."""
+    first_day = first_kept_day()
+    before, after = fold(before or {}, first_day), fold(after, first_day)
+    return sorted(a for a in set(before) | set(after) if before[a] != after[a])
+
+
+def main():
+    from .storage import open_table
+
+    parser = argparse.ArgumentParser(description="Ricostruisce le statistiche dei medici dai dati sorgente")
+    parser.add_argument("--table", default=os.getenv("DYNAMODB_TABLE", "ClinicaDB"))
+    parser.add_argument("--region", default=os.getenv("AWS_REGION", "us-east-2"))
+    parser.add_argument("--doctor", help="un solo medico (default: tutti)")
+    parser.add_argument("--workers", type=int, default=4, help="medici ricalcolati in parallelo")
+    parser.add_argument("--dry-run", action="store_true", help="confronta soltanto, senza scrivere")
+    args = parser.parse_args()
+
+    table = open_table(args.table, args.region)
+    if args.doctor:
+        doctors = [args.doctor]
+    else:
+        doctors, kwargs = [], {'FilterExpression': Attr('SK').eq('PROFILE') & Attr('role').eq('doctor')}
+        while True:
+            res = table.scan(**kwargs)
+            doctors.extend(p['user_id'] for p in res.get('Items', []))
+            if not res.get('LastEvaluatedKey'):
+                break
+            kwargs['ExclusiveStartKey'] = res['LastEvaluatedKey']
+
+    def run(doctor_id: str) -> int:
+        before = table.get_item(Key=stats_key(doctor_id)).get('Item')
+        return len(drift(before, reconcile(table, doctor_id, args.dry_run)))
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        corrected = list(pool.map(run, doctors))
+    action = "da correggere" if args.dry_run else "corretti"
+    print(f"Medici: {len(doctors)} - contatori {action}: {sum(corrected)} "
+          f"(medici con differenze: {sum(1 for c in corrected if c)})")
+
+
+if __name__ == "__main__":
+    main()
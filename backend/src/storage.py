@@ -0,0 +1,41 @@
+# ============================================
+# SCELTA DEL MOTORE DI STORAGE
+# ============================================
+# L'app usa un unico oggetto `table` con l'interfaccia della Table DynamoDB.
+# STORAGE_BACKEND sceglie chi lo implementa:
+#
+#   dynamodb   (default) DynamoDB, una resource boto3 per thread (aws.py)
+#   sqlite     file SQLite locale con indici e WAL (sqlite_table.py), per
+#              piccole installazioni e CI; il TTL su `expires_at` è applicato
+#              da ttl_loop invece che da DynamoDB
+#
+# S3 e SNS restano servizi AWS in entrambi i casi.
+
+import asyncio
+import os
+
+from .aws import run_io, ThreadLocalTable
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "dynamodb")
+TTL_PURGE_INTERVAL_SECONDS = 3600
+
+
+def open_table(table_name: str, region_name: str):
+    if STORAGE_BACKEND == "sqlite":
+        # Import ritardato: il modulo apre il database all'avvio
+        from .sqlite_table import SqliteTable
+        return SqliteTable(table_name)
+    if STORAGE_BACKEND != "dynamodb":
+        raise ValueError(f"STORAGE_BACKEND non valido: {STORAGE_BACKEND}")
+    return ThreadLocalTable(table_name, region_name)
+
+
+async def ttl_loop(table):
+    while True:
+        try:
+            removed = await run_io(table.purge_expired)
+            if removed:
+                print(f"Item scaduti (TTL) cancellati: {removed}")
+        except Exception as e:
+            print(f"Errore pulizia TTL: {e}")
+        await asyncio.sleep(TTL_PURGE_INTERVAL_SECONDS)
@@ -0,0 +1,185 @@
+# ============================================
+# UPLOAD REFERTI A BLOCCHI (MULTIPART S3)
+# ============================================
+# Flusso in tre passi, riprendibile dopo una disconnessione:
+#   1. initiate  -> crea la sessione (UPLOAD#<id> / SESSION) e l'upload multipart S3
+#   2. parts     -> ogni blocco numerato viene verificato (Content-MD5) e inviato
+#                   a S3; i blocchi possono arrivare in parallelo e in qualsiasi ordine
+#   3. complete  -> S3 ricompone il file, poi si scrive il solito REPORT# / METADATA
+#
+# Il client può chiedere lo stato della sessione per sapere quali blocchi
+# rimandare. Le sessioni abbandonate scadono via TTL DynamoDB (`expires_at`)
+# e gc_abandoned_uploads annulla su S3 gli upload multipart rimasti aperti.
+#
+#   REPORT_MAX_BYTES    dimensione massima di un referto
+#   UPLOAD_PART_SIZE    dimensione dei blocchi (minimo S3: 5 MiB, tranne l'ultimo)
+#   UPLOAD_TTL_HOURS    durata di una sessione di upload
+
+import asyncio
+import base64
+import hashlib
+import math
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+from .aws import run_io
+
+REPORT_MAX_BYTES = int(os.getenv("REPORT_MAX_BYTES", str(500 * 1024 * 1024)))
+UPLOAD_PART_SIZE = max(int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+UPLOAD_TTL_HOURS = float(os.getenv("UPLOAD_TTL_HOURS", "24"))
+UPLOAD_GC_INTERVAL_SECONDS = 3600
+
+REPORTS_PREFIX = "reports/"
+
+
+def session_key(upload_id: str) -> dict:
+    return {'PK': f"UPLOAD#{upload_id}", 'SK': 'SESSION'}
+
+
+def part_count(session: dict) -> int:
+    # Dimensione dei blocchi salvata nella sessione: un cambio di UPLOAD_PART_SIZE
+    # (o un riavvio con un altro valore) non invalida le sessioni già aperte
+    return max(1, math.ceil(int(session['size']) / int(session['part_size'])))
+
+
+def expected_part_size(session: dict, part_number: int) -> int:
+    """Dimensione esatta attesa per un blocco: tutti pieni tranne l'ultimo."""
+    size, part_size, parts = int(session['size']), int(session['part_size']), part_count(session)
+    if part_number < parts:
+        return part_size
+    return size - part_size * (parts - 1)
+
+
+def content_md5(data: bytes) -> str:
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+
+async def create_session(table, s3_client, bucket: str, doctor_id: str, appointment: dict,
+                         report_id: str, s3_key: str, is_update: bool, meta: dict) -> dict:
+    res = await run_io(s3_client.create_multipart_upload,
+        Bucket=bucket, Key=s3_key, ContentType=meta['content_type']
+    )
+    upload_id = str(uuid.uuid4())
+    now = time.time()
+    # owner_id / appointment_ref / patient_ref: nomi diversi dalle chiavi dei GSI,
+    # così le sessioni non compaiono negli indici di appuntamenti e referti
+    session = {
+        **session_key(upload_id),
+        'upload_id': upload_id,
+        's3_upload_id': res['UploadId'],
+        'owner_id': doctor_id,
+        'appointment_ref': appointment['appointment_id'],
+        'patient_ref': appointment['patient_id'],
+        'report_id': report_id,
+        's3_key': s3_key,
+        'is_update': is_update,
+        'status': 'open',
+        'parts': {},
+        'part_size': UPLOAD_PART_SIZE,
+        'created_at': datetime.now().isoformat(),
+        'expires_at': int(now + UPLOAD_TTL_HOURS * 3600),
+        **meta,
+    }
+    await run_io(table.put_item, Item=session)
+    return session
+
+
+async def get_session(table, upload_id: str) -> Optional[dict]:
+    res = await run_io(table.get_item, Key=session_key(upload_id), ConsistentRead=True)
+    session = res.get('Item')
+    if session and int(session['expires_at']) < time.time():
+        return None  # scaduta, in attesa del TTL
+    return session
+
+
+async def upload_part(table, s3_client, bucket: str, session: dict, part_number: int, data: bytes) -> dict:
+    md5 = content_md5(data)
+    res = await run_io(s3_client.upload_part,
+        Bucket=bucket, Key=session['s3_key'], UploadId=session['s3_upload_id'],
+        PartNumber=part_number, Body=data, ContentMD5=md5
+    )
+    part = {'etag': res['ETag'], 'size': len(data), 'md5': md5}
+    # Blocchi diversi aggiornano chiavi diverse della mappa: sicuro in parallelo
+    await run_io(table.update_item,
+        Key=session_key(session['upload_id']),
+        UpdateExpression="set parts.#n = :p",
+        ConditionExpression="#st = :open",
+        ExpressionAttributeNames={'#n': str(part_number), '#st': 'status'},
+        ExpressionAttributeValues={':p': part, ':open': 'open'}
+    )
+    return part
+
+
+async def complete_session(table, s3_client, bucket: str, session: dict):
+    # Una sola complete per sessione, anche con richieste concorrenti
+    await run_io(table.update_item,
+        Key=session_key(session['upload_id']),
+        UpdateExpression="set #st = :done",
+        ConditionExpression="#st = :open",
+        ExpressionAttributeNames={'#st': 'status'},
+        ExpressionAttributeValues={':done': 'completing', ':open': 'open'}
+    )
+    parts = sorted(session['parts'].items(), key=lambda kv: int(kv[0]))
+    try:
+        await run_io(s3_client.complete_multipart_upload,
+            Bucket=bucket, Key=session['s3_key'], UploadId=session['s3_upload_id'],
+            MultipartUpload={'Parts': [{'PartNumber': int(n), 'ETag': p['etag']} for n, p in parts]}
+        )
+    except ClientError:
+        # S3 non ha ricomposto il file: la sessione torna aperta, così il client
+        # può rimandare i blocchi e ritentare la complete invece di ricevere 409
+        await run_io(table.update_item,
+            Key=session_key(session['upload_id']),
+            UpdateExpression="set #st = :open",
+            ConditionExpression="#st = :done",
+            ExpressionAttributeNames={'#st': 'status'},
+            ExpressionAttributeValues={':done': 'completing', ':open': 'open'}
+        )
+        raise
+    await run_io(table.delete_item, Key=session_key(session['upload_id']))
+
+
+async def abort_session(table, s3_client, bucket: str, session: dict):
+    try:
+        await run_io(s3_client.abort_multipart_upload,
+            Bucket=bucket, Key=session['s3_key'], UploadId=session['s3_upload_id']
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchUpload':
+            raise
+    await run_io(table.delete_item, Key=session_key(session['upload_id']))
+
+
+async def gc_abandoned_uploads(s3_client, bucket: str) -> int:
+    """Annulla gli upload multipart S3 più vecchi della durata di una sessione."""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=UPLOAD_TTL_HOURS)
+    aborted = 0
+    kwargs = {'Bucket': bucket, 'Prefix': REPORTS_PREFIX}
+    while True:
+        res = await run_io(s3_client.list_multipart_uploads, **kwargs)
+        for upload in res.get('Uploads', []):
+            if upload['Initiated'] < cutoff:
+                await run_io(s3_client.abort_multipart_upload,
+                    Bucket=bucket, Key=upload['Key'], UploadId=upload['UploadId']
+                )
+                aborted += 1
+        if not res.get('IsTruncated'):
+            return aborted
+        kwargs['KeyMarker'] = res['NextKeyMarker']
+        kwargs['UploadIdMarker'] = res['NextUploadIdMarker']
+
+
+async def gc_loop(s3_client, bucket: str):
+    while True:
+        try:
+            aborted = await gc_abandoned_uploads(s3_client, bucket)
+            if aborted:
+                print(f"Upload multipart abbandonati annullati: {aborted}")
+        except Exception as e:
+            print(f"Errore GC upload: {e}")
+        await asyncio.sleep(UPLOAD_GC_INTERVAL_SECONDS)
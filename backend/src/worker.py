@@ -0,0 +1,20 @@
+# ============================================
+# WORKER UVICORN PER GUNICORN
+# ============================================
+# Come uvicorn.workers.UvicornWorker, con un limite all'attesa delle
+# richieste in corso allo stop: gli stream SSE (/api/events/stream) non
+# finiscono da soli, quindi dopo DRAIN_SECONDS vengono chiusi (i client si
+# riconnettono a un altro worker) e lo shutdown dell'app (outbox, pool di
+# processi) gira prima che gunicorn termini il worker (graceful_timeout).
+#
+#   DRAIN_SECONDS   attesa massima delle richieste in corso allo stop
+
+import os
+
+from uvicorn.workers import UvicornWorker
+
+DRAIN_SECONDS = int(os.getenv("DRAIN_SECONDS", "20"))
+
+
+class Worker(UvicornWorker):
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "timeout_graceful_shutdown": DRAIN_SECONDS}
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useMemo } from 'react';
+import React, { useState, useEffect, useMemo, useRef } from 'react';
 import axios from 'axios';
 import {
     Search, User, Calendar, CheckCircle, Clock,
@@ -22,16 +22,102 @@ const getErrorMessage = (error) => {
     return error.response.data?.detail || 'Errore imprevisto';
 };
 
+// --- EVENTI IN TEMPO REALE (SSE) ---
+// fetch invece di EventSource, che non permette l'header Authorization.
+// Dopo una riconnessione gli eventi persi non arrivano: si riceve 'resync'.
+function useEventStream(onEvent) {
+    const handler = useRef(onEvent);
+    handler.current = onEvent;
+
+    useEffect(() => {
+        const controller = new AbortController();
+        let delay = 1000;
+        let connected = false;
+
+        const listen = async () => {
+            while (!controller.signal.aborted) {
+                try {
+                    const res = await fetch(`${API_URL}/api/events/stream`, {
+                        headers: { Authorization: axios.defaults.headers.common['Authorization'] },
+                        signal: controller.signal
+                    });
+                    if (res.status === 401) return;
+                    const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+                    let buffer = '';
+                    for (;;) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buffer += value;
+                        let end;
+                        while ((end = buffer.indexOf('\n\n')) >= 0) {
+                            const data = buffer.slice(0, end).split('\n').filter(l => l.startsWith('data: ')).map(l => l.slice(6)).join('\n');
+                            buffer = buffer.slice(end + 2);
+                            if (!data) continue;
+                            const event = JSON.parse(data);
+                            if (event.type === 'ready') {
+                                delay = 1000;
+                                if (connected) handler.current({ type: 'resync' });
+                                connected = true;
+                            } else {
+                                handler.current(event);
+                            }
+                        }
+                    }
+                } catch (e) {
+                    if (controller.signal.aborted) return;
+                }
+                await new Promise(resolve => setTimeout(resolve, delay));
+                delay = Math.min(delay * 2, 30000);
+            }
+        };
+        listen();
+        return () => controller.abort();
+    }, []);
+}
+
+const upsert = (list, item, key) => list.some(x => x[key] === item[key])
+    ? list.map(x => x[key] === item[key] ? { ...x, ...item } : x)
+    : [...list, item];
+
+// Delta degli appuntamenti: i cancellati escono dalla lista, come in /api/appointments/my
+const applyAppointmentEvent = (list, event) => {
+    if (event.type === 'appointment.created') return upsert(list, event.data, 'appointment_id');
+    if (event.type !== 'appointment.updated') return list;
+    if (event.data.status === 'cancelled') return list.filter(a => a.appointment_id !== event.data.appointment_id);
+    return list.map(a => a.appointment_id === event.data.appointment_id ? { ...a, status: event.data.status } : a);
+};
+
+// Variazioni dei contatori portate dagli eventi (`stats`, stesse chiavi di STATS#<medico>): nessuna rilettura
+const applyCounterDeltas = (counters, deltas) => {
+    if (!counters || !deltas) return counters;
+    const next = { ...counters, day: { ...counters.day }, totals: { ...counters.totals }, reports: { ...counters.reports } };
+    for (const [key, delta] of Object.entries(deltas)) {
+        const [kind, period, status] = key.split('#');
+        if (kind === 'total') next.totals[period] = (next.totals[period] || 0) + delta;
+        else if (kind === 'day' && period === next.day.date) next.day[status] = (next.day[status] || 0) + delta;
+        else if (kind === 'day' && period < next.day.date && status === 'confirmed') next.no_show += delta;
+        else if (kind === 'day' && period < next.day.date && status === 'completed') next.past_completed += delta;
+        else if (kind === 'month' && period === next.reports.month) next.reports.this_month += delta;
+        else if (kind === 'reports') next.reports.total += delta;
+    }
+    next.pending = next.totals.pending || 0;
+    const past = next.no_show + next.past_completed;
+    next.no_show_rate = past ? next.no_show / past : null;
+    return next;
+};
+
 function App() {
     const [token, setToken] = useState(localStorage.getItem('token'));
     const [user, setUser] = useState(JSON.parse(localStorage.getItem('user') || 'null'));
     const [showLogin, setShowLogin] = useState(false);
+    const [dashboard, setDashboard] = useState(null);
 
+    // Una sola richiesta al caricamento: profilo, appuntamenti, referti recenti e conteggi
     useEffect(() => {
         if (token) {
             axios.defaults.headers.common['Authorization'] = token;
-            axios.get(`${API_URL}/api/users/me`)
-                .then(res => { setUser(res.data); localStorage.setItem('user', JSON.stringify(res.data)); })
+            axios.get(`${API_URL}/api/dashboard`)
+                .then(res => { setUser(res.data.profile); localStorage.setItem('user', JSON.stringify(res.data.profile)); setDashboard(res.data); })
                 .catch(() => logout());
         }
     }, [token]);
@@ -46,7 +132,7 @@ function App() {
     };
 
     const logout = () => {
-        setToken(null); setUser(null);
+        setToken(null); setUser(null); setDashboard(null);
         localStorage.removeItem('token'); localStorage.removeItem('user');
         delete axios.defaults.headers.common['Authorization'];
         setShowLogin(false);
@@ -57,8 +143,8 @@ function App() {
             <>
                 <ToastContainer position="top-right" autoClose={3000} />
                 {user.role === 'patient'
-                    ? <PatientDashboard user={user} onLogout={logout} />
-                    : <DoctorDashboardAdvanced user={user} onLogout={logout} />
+                    ? <PatientDashboard user={user} dashboard={dashboard} onLogout={logout} />
+                    : <DoctorDashboardAdvanced user={user} dashboard={dashboard} onLogout={logout} />
                 }
             </>
         );
@@ -198,7 +284,7 @@ function LoginPage({ onLogin, onBack }) {
 // 2. DASHBOARD MEDICO
 // ============================================
 
-function DoctorDashboardAdvanced({ user, onLogout }) {
+function DoctorDashboardAdvanced({ user, dashboard, onLogout }) {
     const [view, setView] = useState('dashboard');
     const [appointments, setAppointments] = useState([]);
     const [filteredAppts, setFilteredAppts] = useState([]);
@@ -214,7 +300,28 @@ function DoctorDashboardAdvanced({ user, onLogout }) {
         } catch (error) { toast.error("Errore caricamento dati"); }
     };
 
-    useEffect(() => { fetchData(); }, []);
+    // Contatori precalcolati (un get_item lato server): richieste, oggi, referti del mese, no-show
+    const [counters, setCounters] = useState(null);
+    const fetchCounters = async () => {
+        try {
+            const res = await axios.get(`${API_URL}/api/doctors/me/stats`);
+            setCounters(res.data);
+        } catch (error) { /* restano i conteggi calcolati dalla lista */ }
+    };
+
+    useEffect(() => { if (dashboard) setAppointments(dashboard.appointments); }, [dashboard]);
+    useEffect(() => { fetchCounters(); }, []);
+
+    // Nuove prenotazioni, cambi di stato e referti arrivano senza ricaricare lista e contatori
+    useEventStream(event => {
+        if (event.type === 'resync') {
+            fetchData();
+            fetchCounters();
+            return;
+        }
+        setAppointments(list => applyAppointmentEvent(list, event));
+        setCounters(current => applyCounterDeltas(current, event.stats));
+    });
 
     useEffect(() => {
         let result = appointments;
@@ -225,15 +332,18 @@ function DoctorDashboardAdvanced({ user, onLogout }) {
 
     const stats = useMemo(() => ({
         total: appointments.length,
-        pending: appointments.filter(a => a.status === 'pending').length,
-        today: appointments.filter(a => a.date === new Date().toISOString().split('T')[0]).length
-    }), [appointments]);
+        pending: counters ? counters.pending : appointments.filter(a => a.status === 'pending').length,
+        today: counters ? (counters.day.confirmed || 0) : appointments.filter(a => a.date === new Date().toISOString().split('T')[0]).length,
+        reportsMonth: counters ? counters.reports.this_month : '-',
+        noShow: counters && counters.no_show_rate !== null ? `${(counters.no_show_rate * 100).toFixed(1)}%` : '-'
+    }), [appointments, counters]);
 
     const updateStatus = async (id, status) => {
         try {
             await axios.patch(`${API_URL}/api/appointments/${id}/status`, null, { params: { status } });
             toast.success(`Stato aggiornato`);
-            fetchData();
+            // I contatori si aggiornano con l'evento del cambio stato
+            setAppointments(list => applyAppointmentEvent(list, { type: 'appointment.updated', data: { appointment_id: id, status } }));
         } catch (e) { toast.error("Errore"); }
     };
 
@@ -255,7 +365,9 @@ function DoctorDashboardAdvanced({ user, onLogout }) {
                         <div className="card-grid">
                             <StatCard title="Totale" value={stats.total} icon={<Calendar />} />
                             <StatCard title="Da Accettare" value={stats.pending} icon={<Clock />} />
-                            <StatCard title="Oggi" value={stats.today} icon={<CheckCircle />} />
+                            <StatCard title="Confermati Oggi" value={stats.today} icon={<CheckCircle />} />
+                            <StatCard title="Referti del Mese" value={stats.reportsMonth} icon={<FileText />} />
+                            <StatCard title="No-show" value={stats.noShow} icon={<Activity />} />
                         </div>
 
                         <div className="card" style={{ marginBottom: '2rem', display: 'flex', gap: '1rem', alignItems: 'center' }}>
@@ -363,8 +475,24 @@ function StatCard({ title, value, icon }) {
 // 3. DASHBOARD PAZIENTE
 // ============================================
 
-function PatientDashboard({ user, onLogout }) {
+function PatientDashboard({ user, dashboard, onLogout }) {
     const [view, setView] = useState('appointments');
+    const [appointments, setAppointments] = useState([]);
+    const [reports, setReports] = useState([]);
+
+    useEffect(() => {
+        if (dashboard) { setAppointments(dashboard.appointments); setReports(dashboard.reports); }
+    }, [dashboard]);
+
+    const reloadAppointments = () => axios.get(`${API_URL}/api/appointments/my`).then(res => setAppointments(res.data));
+    const loadAllReports = () => axios.get(`${API_URL}/api/reports/my`).then(res => setReports(res.data));
+    const applyEvent = event => setAppointments(list => applyAppointmentEvent(list, event));
+
+    useEventStream(event => {
+        if (event.type === 'resync') reloadAppointments();
+        else if (event.type === 'report.saved') setReports(list => upsert(list, event.data, 'report_id'));
+        else applyEvent(event);
+    });
 
     return (
         <div className="dashboard">
@@ -381,24 +509,20 @@ function PatientDashboard({ user, onLogout }) {
                     <button className={view === 'profile' ? 'active' : ''} onClick={() => setView('profile')}>Profilo</button>
                 </div>
 
-                {view === 'appointments' && <PatientAppointments />}
-                {view === 'book' && <BookAppointment onSuccess={() => setView('appointments')} />}
-                {view === 'reports' && <PatientReports />}
+                {view === 'appointments' && <PatientAppointments appointments={appointments} onChange={applyEvent} />}
+                {view === 'book' && <BookAppointment onSuccess={appt => { applyEvent({ type: 'appointment.created', data: appt }); setView('appointments'); }} />}
+                {view === 'reports' && <PatientReports reports={reports} total={dashboard ? dashboard.counts.reports : 0} onShowAll={loadAllReports} />}
                 {view === 'profile' && <UserProfile user={user} />}
             </div>
         </div>
     );
 }
 
-function PatientAppointments() {
-    const [appointments, setAppointments] = useState([]);
-    useEffect(() => { axios.get(`${API_URL}/api/appointments/my`).then(res => setAppointments(res.data)); }, []);
-
+function PatientAppointments({ appointments, onChange }) {
     const cancel = async (id) => {
         if (window.confirm("Cancellare?")) {
             await axios.delete(`${API_URL}/api/appointments/${id}`);
-            const res = await axios.get(`${API_URL}/api/appointments/my`);
-            setAppointments(res.data);
+            onChange({ type: 'appointment.updated', data: { appointment_id: id, status: 'cancelled' } });
             toast.info("Cancellato");
         }
     }
@@ -434,9 +558,9 @@ function BookAppointment({ onSuccess }) {
     const submit = async (e) => {
         e.preventDefault();
         try {
-            await axios.post(`${API_URL}/api/appointments`, { doctor_id: selectedDoc, date, time_slot: selectedSlot, reason });
+            const res = await axios.post(`${API_URL}/api/appointments`, { doctor_id: selectedDoc, date, time_slot: selectedSlot, reason });
             toast.success("Prenotato!");
-            onSuccess();
+            onSuccess(res.data);
         } catch (e) { toast.error("Errore"); }
     };
 
@@ -473,10 +597,24 @@ function BookAppointment({ onSuccess }) {
     );
 }
 
-function PatientReports() {
-    const [reports, setReports] = useState([]);
-    useEffect(() => { axios.get(`${API_URL}/api/reports/my`).then(res => setReports(res.data)); }, []);
+// Anteprima della prima pagina: URL versionato, il browser la tiene in cache
+function ReportPreview({ report }) {
+    const [src, setSrc] = useState(null);
+    useEffect(() => {
+        if (report.preview_status !== 'ready') return;
+        let url;
+        axios.get(`${API_URL}/api/reports/${report.report_id}/preview?v=${report.preview_version}`, { responseType: 'blob' })
+            .then(res => { url = window.URL.createObjectURL(res.data); setSrc(url); })
+            .catch(() => setSrc(null));
+        return () => { if (url) window.URL.revokeObjectURL(url); };
+    }, [report.report_id, report.preview_status, report.preview_version]);
+
+    if (!src) return null;
+    return <img src={src} alt={`Anteprima ${report.exam_type}`} width={report.preview_width} height={report.preview_height}
+        style={{ maxWidth: '100%', height: 'auto', borderRadius: '5px', border: '1px solid #e2e8f0' }} />;
+}
 
+function PatientReports({ reports, total, onShowAll }) {
     const download = (id, name) => {
         axios.get(`${API_URL}/api/reports/${id}/download`, { responseType: 'blob' })
             .then(res => {
@@ -493,11 +631,13 @@ function PatientReports() {
             {reports.map(r => (
                 <div key={r.report_id} className="card">
                     <h3>📄 {r.exam_type}</h3>
+                    <ReportPreview report={r} />
                     <p>Medico: {r.doctor_name}</p>
                     <p>Data: {r.exam_date}</p>
                     <button className="btn-primary" onClick={() => download(r.report_id, r.original_filename)}>Scarica PDF</button>
                 </div>
             ))}
+            {total > reports.length && <button className="btn-primary" onClick={onShowAll}>Mostra tutti i referti ({total})</button>}
         </div>
     );
 }
@@ -524,10 +664,15 @@ function UserProfile({ user }) {
 
         setLoading(true);
         try {
-            await axios.post(`${API_URL}/api/users/change-password`, {
+            const res = await axios.post(`${API_URL}/api/users/change-password`, {
                 old_password: passData.old_password,
                 new_password: passData.new_password
             });
+            // Il cambio password revoca i token precedenti: usa quello nuovo
+            if (res.data.token) {
+                localStorage.setItem('token', res.data.token);
+                axios.defaults.headers.common['Authorization'] = res.data.token;
+            }
             toast.success("Password cambiata con successo!");
             setPassData({ old_password: '', new_password: '', confirm_password: '' });
         } catch (err) {
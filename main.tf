@@ -13,6 +13,12 @@ variable "alert_email" {
   description = "L'indirizzo email per ricevere le notifiche dai referti"
 }
 
+variable "jwt_secret_key" {
+  type        = string
+  sensitive   = true
+  description = "Chiave HMAC per firmare i token di accesso del backend"
+}
+
 provider "aws" {
   region = "us-east-2"
 }
@@ -47,6 +53,24 @@ resource "aws_s3_bucket_public_access_block" "clinica_bucket_access" {
   restrict_public_buckets = true
 }
 
+# Annulla gli upload multipart dei referti rimasti incompleti
+resource "aws_s3_bucket_lifecycle_configuration" "clinica_bucket_lifecycle" {
+  bucket = aws_s3_bucket.clinica_bucket.id
+
+  rule {
+    id     = "abort-incomplete-uploads"
+    status = "Enabled"
+
+    filter {
+      prefix = "reports/"
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 2
+    }
+  }
+}
+
 # --- 2. DATABASE (DynamoDB) ---
 resource "aws_dynamodb_table" "clinica_db" {
   name           = "ClinicaDB"
@@ -66,6 +90,77 @@ resource "aws_dynamodb_table" "clinica_db" {
     type = "S"
   }
 
+  # Attributi usati come chiavi degli indici secondari (vedi backend/src/indexes.py)
+  attribute {
+    name = "email"
+    type = "S"
+  }
+
+  attribute {
+    name = "patient_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "doctor_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "appointment_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "index_sk"
+    type = "S"
+  }
+
+  # email -> profilo utente (login / registrazione)
+  global_secondary_index {
+    name            = "EmailIndex"
+    hash_key        = "email"
+    projection_type = "ALL"
+    read_capacity   = 5
+    write_capacity  = 5
+  }
+
+  # paziente -> appuntamenti / referti ordinati per data
+  global_secondary_index {
+    name            = "PatientIndex"
+    hash_key        = "patient_id"
+    range_key       = "index_sk"
+    projection_type = "ALL"
+    read_capacity   = 5
+    write_capacity  = 5
+  }
+
+  # medico -> appuntamenti / referti (dottore+data con begins_with)
+  global_secondary_index {
+    name            = "DoctorIndex"
+    hash_key        = "doctor_id"
+    range_key       = "index_sk"
+    projection_type = "ALL"
+    read_capacity   = 5
+    write_capacity  = 5
+  }
+
+  # appuntamento -> referto
+  global_secondary_index {
+    name            = "AppointmentIndex"
+    hash_key        = "appointment_id"
+    range_key       = "SK"
+    projection_type = "ALL"
+    read_capacity   = 5
+    write_capacity  = 5
+  }
+
+  # Scadenza automatica degli item temporanei (es. sessioni di upload)
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
   tags = merge(local.common_tags, {
     Name = "Database Clinica"
   })
@@ -189,8 +284,9 @@ resource "aws_lb_target_group" "clinica_backend_tg" {
   vpc_id      = data.aws_vpc.default.id
   target_type = "ip"
   
+  # /ready: worker avviato e tabella raggiungibile (/health resta il liveness del container)
   health_check {
-    path                = "/health"
+    path                = "/ready"
     matcher             = "200"
     interval            = 60
     timeout             = 30
@@ -293,7 +389,11 @@ resource "aws_ecs_task_definition" "backend_task" {
     environment = [
       { name = "S3_BUCKET_NAME", value = aws_s3_bucket.clinica_bucket.id },
       { name = "DYNAMODB_TABLE", value = aws_dynamodb_table.clinica_db.name },
-      { name = "AWS_REGION", value = "us-east-2" }
+      { name = "AWS_REGION", value = "us-east-2" },
+      { name = "JWT_SECRET_KEY", value = var.jwt_secret_key },
+      # Un solo worker: il broker eventi in memoria non è condiviso tra processi.
+      # Più worker richiedono un Redis (non creato qui) ed EVENTS_BACKEND=redis + EVENTS_REDIS_URL
+      { name = "WEB_CONCURRENCY", value = "1" }
     ]
     logConfiguration = {
       logDriver = "awslogs"